@@ -1,24 +1,72 @@
+import types
 import numpy as np
 import NBodyBuilder.Particle as part
-import NBodyBuilder.Node as node
+import NBodyBuilder.ParticleSet as ps
+import NBodyBuilder.Octree as octree
+import NBodyBuilder.Softening as soft
+import NBodyBuilder.PM as pm
+import NBodyBuilder.Parallel as parallel
+import NBodyBuilder.Stats as st
 
 class BH(object):
     ''' The BH class implements the Barnes-Hut algorithm to compute the gravitational interactions between an arbitrary number of particles.
+    The octree is a linear, array-backed Octree. computeAllAccels walks it once per group of nearby particles rather than once per 
+    particle, and evaluates each group's interaction list as a single vectorized product; computeAccel walks it for a single particle, 
+    without recursion, by following the tree's firstChild and skip pointers. A solver can be kept across time steps: update() refits 
+    the tree to the particles' new positions, and only rebuilds it once they have moved too far.
 
     Args:
         boxSize (float or integer): Size of simulation box
         openAngle (?): ?
-        particles (array): Array of particles
+        particles (ParticleSet or array): Set of particles (an array of Particles is packed into a ParticleSet)
+        leafSize (integer): Maximum number of particles in a leaf of the octree
+        build (string): Tree construction method (see Octree); with "morton" the particle set is also reordered into Z-order
+        groupSize (integer): Maximum number of particles sharing one interaction list in computeAllAccels
+        chunkSize (integer): Approximate number of particles whose groups are walked together, which bounds the temporary memory
+        quadrupole (boolean): Add the quadrupole correction to the monopole of every accepted node
+        splitScale (float): If given, compute only the short-range force S(r) times the Newtonian force (see PM.shortRangeFactor), 
+            as the tree half of the TreePM solver
+        cutoff (float): Nodes entirely farther than cutoff from a particle are skipped (only sensible together with splitScale)
+        workers (integer): If more than 1, computeAllAccels walks the chunks of groups in this many worker processes (see
+            Parallel.workerPool; the pool is kept alive and shared by later BH solvers)
+        rebuildDrift (float): update() rebuilds the tree once a particle has moved more than this many times the side of its leaf 
+            cell since the last build
+        rebuildImbalance (float): update() rebuilds the tree once the refitted nodes have grown, on average, to more than this many 
+            times the side of the cells they were built with (see Octree.growth)
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+        softeningTable (Softening.KernelTable): If given, the softening kernel of computeAllAccels is interpolated from this table
+        stats (Stats): If given, the tree build, refit and multipole sum are timed, and the interactions counted, into it (the walk is
+            timed by the caller, as TimeStepper's "walk" phase)
     '''
 
-    # Given the size of the simulation box, the opening angle, and an array of particles, compute the force on each of the particles via the Barnes-Hut algorithm
-    def __init__(self, boxSize, openAngle, particles):
-        self.root = node.Node([0]*8, particles[0], boxSize, np.zeros(3))  # create the root of the octree
+    # Given the size of the simulation box, the opening angle, and a set of particles, compute the force on each of the particles via the Barnes-Hut algorithm
+    def __init__(self, boxSize, openAngle, particles, leafSize=1, build="partition", groupSize=16, chunkSize=4096, quadrupole=True,
+                 splitScale=None, cutoff=np.inf, workers=None, rebuildDrift=4., rebuildImbalance=1.05,
+                 eps0=0.1, r0=5, softeningTable=None, stats=None):
+        self.particles = ps.asParticleSet(particles)
+        self.boxSize = boxSize
         self.openAngle = openAngle
-        self.particles = particles
+        self.leafSize = leafSize
+        self.build = build
+        self.groupSize = groupSize
+        self.chunkSize = chunkSize
+        self.quadrupole = quadrupole
+        self.splitScale = splitScale
+        self.cutoff = cutoff
+        self.workers = workers
+        self.rebuildDrift = rebuildDrift
+        self.rebuildImbalance = rebuildImbalance
+        self.eps0 = eps0
+        self.r0 = r0
+        self.softeningTable = softeningTable
+        self.stats = stats
+        self.numBuilds = 0
+        self.numRefits = 0
         
         self.buildTree()
-        self.root.sumMultipole()
+        with st.phase(stats, "multipole"):
+            self.tree.sumMultipole(self.particles.pos, self.particles.mass, self.particles.vel)
     
     
     def __repr__(self):
@@ -28,90 +76,581 @@ class BH(object):
                 s (string): Representation of ther Barnes-Hut octree.
         '''
 
-        q = []
-        q.append(self.root)
+        return repr(self.tree)
         
-        levelTracker = self.root.sideLength
-        s = ""
+    def buildTree(self):
+        ''' Assembles the octree by partitioning the simulation box around the particles. A Morton build also sorts the particle set 
+        into the tree's Z-order, so that the particles of every node are contiguous in memory.
         
-        while (len(q) > 0):
-            n = q.pop()
-            
-            if (n.sideLength < levelTracker):
-                s += "\n"
-                levelTracker = n.sideLength
-            
-            s += "{}  ".format(n)
+        '''
+
+        with st.phase(self.stats, "treeBuild"):
+            self.tree = octree.Octree(self.particles.pos, self.boxSize, self.leafSize, build=self.build)
             
-            for c in n.children:
-                if (c != 0):
-                    q.append(c)
-        return s
+            if (self.build == "morton"):
+                self.particles.reorder(self.tree.order)
+                self.tree.order = np.arange(self.particles.size)
         
-    def buildTree(self):
-        ''' Assembles the octree by progressively adding particles to the simulation box and partitioning space accordingly.
+        if (self.stats is not None):
+            self.stats.record("treeDepth", int(self.tree.depth.max()))
+            self.stats.record("numNodes", self.tree.numNodes)
         
+        # remember where the particles were, and the side of each particle's leaf cell, to decide later when to rebuild
+        tree = self.tree
+        leaves = np.nonzero(tree.isLeaf)[0]
+        leaves = leaves[np.argsort(tree.start[leaves])]
+        self.builtPos = self.particles.pos.copy()
+        self.leafSide = np.empty(self.particles.size)
+        self.leafSide[tree.order] = np.repeat(tree.cellSize[leaves], tree.count[leaves])
+        self.numBuilds += 1
+    
+    def update(self):
+        ''' Prepares the solver for the particles' current positions and masses, reusing the tree when the particles have moved 
+        little: the tree is refit (see Octree.refit) unless a particle has drifted by more than rebuildDrift leaf cells since the last 
+        build, or the refit makes the nodes grow by more than rebuildImbalance, in which case it is rebuilt from scratch.
+
+        A refit costs about as much as a Morton build and its multipole sum, and about a sixth of a "partition" build (see the "refit",
+        "build" and "multipole" timings of Benchmark.benchBH), while a tree walk costs a hundred times more or so at any N. Refitting 
+        thus only pays off with the partition build, when the walk is cheap (few particles, a wide opening angle), and not with the
+        Morton build TimeStepper uses.
         '''
 
-        for i in range(1, self.particles.size):
-            n = node.Node([0]*8, self.particles[i], 0, np.zeros(3))
-            self.root.addChild(n)
+        pos = self.particles.pos
+        drift = np.einsum('ij,ij->i', pos - self.builtPos, pos - self.builtPos)
+        
+        if (np.all(drift <= (self.rebuildDrift * self.leafSide)**2)):
+            with st.phase(self.stats, "treeRefit"):
+                self.tree.refit(pos, self.particles.mass, self.particles.vel)
+            if (self.tree.growth() <= self.rebuildImbalance):
+                self.numRefits += 1
+                return
+        
+        self.buildTree()
+        with st.phase(self.stats, "multipole"):
+            self.tree.sumMultipole(pos, self.particles.mass, self.particles.vel)
             
     def computeAccel(self, p):
         ''' Computes the total acceleration on Particle p induced by the other particles/superparticles in the octree.
         
             Args:
-                p (?): A Particle 'p'
+                p (Particle or integer): A Particle of the simulation, or its index in the ParticleSet
 
             Returns:
-                total Accel (?): Total acceleration felt by Particle p from all other particles
+                total Accel (array): Total acceleration felt by Particle p from all other particles
         '''
 
-        totAccel = self.computeAccelHelper(p, self.root)
+        totAccel = self.computeAccelHelper(self.particles.pos[self.particles.row(p)], 0)
         return totAccel
     
-    def computeAccelHelper(self, p, n):
-        ''' Recursive helper method for computeAccel(). Computes the acceleration of Particle p due to Node n.
+    def computeAccelHelper(self, pos, n):
+        ''' Helper method for computeAccel(). Computes the acceleration at position pos due to the subtree rooted at node n, walking it 
+        depth-first with the tree's firstChild/skip pointers instead of recursion.
         
         Args:
-            p (?): A Particle 'p'
-            n (?): A node
+            pos (array): Position of the particle
+            n (integer): Index of a node in the octree
 
         Returns:
-            total Accel (?): Total acceleration felt by Particle p from all other particles
+            total Accel (array): Total acceleration felt at pos from all particles in the subtree of node n
         '''
 
-        dist = p.distTo(n.multipole)
-        
-        # Ignore interactions between overlapping particles
-        if (dist == 0):
-            return np.zeros(3)
+        tree = self.tree
+        mass = self.particles.mass
+        allPos = self.particles.pos
         
         totAccel = np.zeros(3)
+        end = tree.skip[n]
+        opened = particleNode = particleParticle = 0
+        
+        while (n != end):
+            # If the current Node lies entirely beyond the cutoff, skip it
+            if ((self.cutoff < np.inf) and np.linalg.norm(np.maximum(np.abs(pos - tree.center[n]) - tree.size[n] / 2., 0)) > self.cutoff):
+                n = tree.skip[n]
+                continue
+            
+            # If the current Node is a leaf, sum the Newtonian (1/r^2) forces on the particle due to each of the particles it holds
+            if (tree.isLeaf[n]):
+                for j in tree.leafParticles(n):
+                    if (np.any(allPos[j] != pos)):
+                        totAccel += part.newtonAccelSmooth(pos, allPos[j], mass[j], self.eps0, self.r0) * self.split(allPos[j] - pos)
+                        particleParticle += 1
+                n = tree.skip[n]
+                continue
+            
+            dist = np.linalg.norm(pos - tree.com[n])
+            
+            # If the current Node satisfies the opening angle criterion, compute the Newtonian (1/r^2) force on the particle due to the Node's total mass (plus its quadrupole correction)
+            if ((dist > 0) and (tree.size[n] < self.openAngle * dist)):
+                nodeAccel = part.newtonAccelSmooth(pos, tree.com[n], tree.mass[n], self.eps0, self.r0)
+                if (self.quadrupole):
+                    nodeAccel += quadrupoleAccel((tree.com[n] - pos)[None,:], tree.quad[n][None,:,:])[0]
+                totAccel += nodeAccel * self.split(tree.com[n] - pos)
+                particleNode += 1
+                n = tree.skip[n]
+            
+            # If the current Node does not satisfy the opening angle criterion, descend into its children
+            else:
+                n = tree.firstChild[n]
+                opened += 1
         
-        # If the current Node is a leaf or satisfies the opening angle criterion, compute the Newtonian (1/r^2) force on Particle p due to the particles in Node n
-        if ((n.isLeaf()) or (n.sideLength < self.openAngle * dist)):
-            accel = p.newtonAccelSmooth(n.multipole, 0.1, 5)
-            totAccel += accel
-        
-        # If the current Node does not satisfy the opening angle criterion, split the Node and recurse
-        else:
-            for c in n.children:
-                if (c != 0):
-                    accel = self.computeAccelHelper(p, c)
-                    totAccel += accel
+        if (self.stats is not None):
+            self.stats.addCounts({"nodesOpened": opened, "particleNode": particleNode, "particleParticle": particleParticle})
                     
         return totAccel
     
+    def split(self, disp):
+        ''' Returns the fraction of the force at displacement disp that this solver computes: 1, or the short-range factor S(r).
+        
+        Args:
+            disp (array): Displacement from target to source
+
+        Returns:
+            float: Force fraction
+        '''
+
+        if (self.splitScale is None):
+            return 1.
+        return pm.shortRangeFactor(np.linalg.norm(disp), self.splitScale)
+    
+    def computeAllAccels(self, active=None, jerk=False):
+        ''' Compute the pairwise forces/accelerations for all Particles in the simulation, walking the tree once per group of at most 
+        groupSize particles. Groups are processed in chunks of about chunkSize particles.
+        
+        Args:
+            active (array): If given, only the accelerations of these particles are computed (the tree is only walked for the groups 
+                holding at least one of them), and the other accelerations are left unchanged
+            jerk (boolean): Also compute the jerks (time derivatives of the accelerations) into particles.jerk; accepted nodes 
+                contribute the jerk of their monopole, moving with their center-of-mass velocity
+        '''
+
+        counts = None if (self.stats is None) else {}
+        self.walkAllGroups(active, jerk, counts)
+        if (counts is not None):
+            self.stats.addCounts(counts)
     
-    def computeAllAccels(self):
-        ''' Compute the pairwise forces/accelerations for all Particles in the simulation.
+    def walkAllGroups(self, active=None, jerk=False, counts=None):
+        ''' Does the work of computeAllAccels.
         
+        Args:
+            active (array): As in computeAllAccels
+            jerk (boolean): As in computeAllAccels
+            counts (dict): If given, the interaction counts of the walk are added to it (see walkGroups)
         '''
 
-        for p in self.particles:
-            accel = self.computeAccel(p)
-            p.setAccel(accel)
+        tree = self.tree
+        pos = self.particles.pos
+        
+        groups = findGroups(tree, self.groupSize)
+        groupCenter, groupRadius = groupSpheres(tree, pos, groups)
+        
+        isActive = np.ones(self.particles.size, dtype=bool)
+        if (active is not None):
+            isActive[:] = False
+            isActive[active] = True
+            walked = np.logical_or.reduceat(isActive[tree.order], tree.start[groups])
+            groups, groupCenter, groupRadius = groups[walked], groupCenter[walked], groupRadius[walked]
+            if (groups.size == 0):
+                return
+        
+        # chunks of consecutive groups holding about chunkSize particles each
+        chunkSize = self.chunkSize
+        if ((self.workers is not None) and (self.workers > 1)):
+            chunkSize = max(1, min(chunkSize, -(-tree.count[groups].sum() // (4 * self.workers))))   # at least 4 chunks per worker
+        bounds = chunkBounds(tree.count[groups], chunkSize)
+        
+        if ((self.workers is not None) and (self.workers > 1)):
+            self.computeAllAccelsParallel(groups, groupCenter, groupRadius, bounds, isActive, jerk, counts)
+            return
+        
+        vel = self.particles.vel if jerk else None
+        for c0, c1 in zip(bounds[:-1], bounds[1:]):
+            accel, jerks = walkGroups(tree, pos, self.particles.mass, groups[c0:c1], groupCenter[c0:c1], groupRadius[c0:c1], 
+                                      self.openAngle, self.eps0, self.r0, self.quadrupole, self.splitScale, self.cutoff, vel, 
+                                      self.softeningTable, counts)
+            rows = groupRows(tree, groups[c0:c1])
+            self.particles.accel[rows[isActive[rows]]] = accel[isActive[rows]]
+            if (jerk):
+                self.particles.jerk[rows[isActive[rows]]] = jerks[isActive[rows]]
+    
+    def computeAllPotentials(self):
+        ''' Computes the gravitational potential of every particle with the same grouped tree walk as computeAllAccels: accepted nodes
+        contribute their softened monopole potential (plus the quadrupole correction), and the particles of unopened leaves their 
+        softened pair potentials (see Softening.softenedPotential). The potential energy of the system is half the sum of mass times 
+        potential.
+
+        Returns:
+            array: Potential of each particle, in row order, shape (N,)
+        '''
+
+        if (self.splitScale is not None):
+            raise ValueError("potentials of the short-range part of a split force are not supported")
+        
+        tree = self.tree
+        pos = self.particles.pos
+        groups = findGroups(tree, self.groupSize)
+        groupCenter, groupRadius = groupSpheres(tree, pos, groups)
+        bounds = chunkBounds(tree.count[groups], self.chunkSize)
+        
+        phi = np.zeros(self.particles.size)
+        with st.phase(self.stats, "potential"):
+            for c0, c1 in zip(bounds[:-1], bounds[1:]):
+                phi[groupRows(tree, groups[c0:c1])] = potentialGroups(tree, pos, self.particles.mass, groups[c0:c1], groupCenter[c0:c1], 
+                                                                      groupRadius[c0:c1], self.openAngle, self.eps0, self.r0, self.quadrupole)
+        return phi
+    
+    def computeAllAccelsParallel(self, groups, groupCenter, groupRadius, bounds, isActive, jerk=False, counts=None):
+        ''' Walks the chunks of groups [bounds[k], bounds[k+1]) in the worker pool. The tree, the particles and the groups are 
+        published in shared memory, and each worker writes the accelerations of its chunk straight into a shared array.
+        
+        Args:
+            groups (array): Groups, as returned by findGroups
+            groupCenter (array): Centers of the group bounding spheres
+            groupRadius (array): Radii of the group bounding spheres
+            bounds (array): Boundaries of the chunks in 'groups'
+            isActive (array): Flags of the particles whose accelerations are to be updated
+            jerk (boolean): Also compute the jerks
+            counts (dict): If given, the interaction counts of the workers are added to it
+        '''
+
+        tree = self.tree
+        arrays = {name: getattr(tree, name) for name in SHARED_TREE_ARRAYS}
+        arrays.update(pos=self.particles.pos, vel=self.particles.vel, particleMass=self.particles.mass, groups=groups, 
+                      groupCenter=groupCenter, groupRadius=groupRadius, accel=np.zeros_like(self.particles.accel), 
+                      jerk=np.zeros_like(self.particles.jerk))
+        
+        shared = parallel.SharedArrays(arrays)
+        try:
+            options = (self.openAngle, self.eps0, self.r0, self.quadrupole, self.splitScale, self.cutoff, jerk, self.softeningTable,
+                       counts is not None)
+            tasks = [(shared.spec, c0, c1) + options for c0, c1 in zip(bounds[:-1], bounds[1:])]
+            for chunkCounts in parallel.workerPool(self.workers).starmap(walkSharedChunk, tasks):
+                if (counts is not None):
+                    for name, n in chunkCounts.items():
+                        counts[name] = counts.get(name, 0) + n
+            self.particles.accel[isActive] = shared["accel"][isActive]
+            if (jerk):
+                self.particles.jerk[isActive] = shared["jerk"][isActive]
+        finally:
+            shared.close()
+
+SHARED_TREE_ARRAYS = ("com", "comVel", "mass", "quad", "center", "size", "isLeaf", "firstChild", "numChildren", "start", "count", "order")
+
+def walkSharedChunk(spec, c0, c1, openAngle, eps0, r0, quadrupole, splitScale, cutoff, jerk=False, table=None, count=False):
+    ''' Worker task of BH.computeAllAccelsParallel: walks the groups [c0, c1) of the tree published in shared memory and writes the 
+    accelerations of their particles into the shared acceleration array.
+
+    Args:
+        spec (tuple): Parallel.SharedArrays spec of the tree, particle and group arrays
+        c0 (integer): First group of the chunk
+        c1 (integer): End of the chunk
+        openAngle, eps0, r0, quadrupole, splitScale, cutoff: As in walkGroups
+        jerk (boolean): Also compute the jerks, into the shared jerk array
+        table (Softening.KernelTable): As in walkGroups
+        count (boolean): Count the interactions of the chunk
+
+    Returns:
+        dict: Interaction counts of the chunk (see walkGroups), or None if count is False
+    '''
+
+    counts = {} if count else None
+    shm, arrays = parallel.attach(spec)
+    try:
+        tree = types.SimpleNamespace(**{name: arrays[name] for name in SHARED_TREE_ARRAYS})
+        groups = arrays["groups"][c0:c1]
+        accel, jerks = walkGroups(tree, arrays["pos"], arrays["particleMass"], groups, arrays["groupCenter"][c0:c1], 
+                                  arrays["groupRadius"][c0:c1], openAngle, eps0, r0, quadrupole, splitScale, cutoff, 
+                                  arrays["vel"] if jerk else None, table, counts)
+        arrays["accel"][groupRows(tree, groups)] = accel
+        if (jerk):
+            arrays["jerk"][groupRows(tree, groups)] = jerks
+    finally:
+        shm.close()
+    
+    return counts
+            
+def quadrupoleAccel(disp, quad):
+    ''' Quadrupole correction to the acceleration induced by a node: with r the vector from the node's center of mass to the target
+    and Q the node's traceless quadrupole tensor, a = Q r / r^5 - 5/2 (r.Q.r) r / r^7.
+
+    Args:
+        disp (array): Displacements from the targets to the nodes' centers of mass (i.e. -r), shape (K,3)
+        quad (array): Quadrupole tensors of the nodes, shape (K,3,3)
+
+    Returns:
+        array: Acceleration corrections, shape (K,3)
+    '''
+
+    r2 = np.einsum('ki,ki->k', disp, disp)
+    qd = np.einsum('kij,kj->ki', quad, disp)
+    dqd = np.einsum('ki,ki->k', disp, qd)
+    
+    inv2 = 1. / r2
+    inv5 = inv2 * inv2 / np.sqrt(r2)
+    return (-qd + 2.5 * (dqd * inv2)[:,None] * disp) * inv5[:,None]
+
+def quadrupolePotential(disp, quad):
+    ''' Quadrupole correction to the potential of a node, phi = -(r.Q.r) / (2 r^5), whose gradient gives quadrupoleAccel.
+
+    Args:
+        disp (array): Displacements from the targets to the nodes' centers of mass, shape (K,3)
+        quad (array): Quadrupole tensors of the nodes, shape (K,3,3)
+
+    Returns:
+        array: Potential corrections, shape (K,)
+    '''
+
+    r2 = np.einsum('ki,ki->k', disp, disp)
+    dqd = np.einsum('ki,kij,kj->k', disp, quad, disp)
+    return -0.5 * dqd / (r2 * r2 * np.sqrt(r2))
+
+def chunkBounds(counts, chunkSize):
+    ''' Splits a list of groups into chunks of consecutive groups holding about chunkSize particles each.
+
+    Args:
+        counts (array): Number of particles of each group
+        chunkSize (integer): Number of particles per chunk
+
+    Returns:
+        array: Boundaries of the chunks: chunk k holds groups bounds[k] to bounds[k+1]
+    '''
+
+    chunkOf = (np.cumsum(counts) - counts) // chunkSize
+    return np.unique(np.append(np.nonzero(np.diff(chunkOf))[0] + 1, [0, counts.size]))
+
+def findGroups(tree, groupSize):
+    ''' Selects the groups used by the grouped tree walk: the largest nodes holding at most groupSize particles. Every particle 
+    belongs to exactly one group, and since a group is a node its particles are a contiguous range of tree.order.
+
+    Args:
+        tree (Octree): Octree of the particles
+        groupSize (integer): Maximum number of particles in a group
+
+    Returns:
+        array: Node indices of the groups, sorted by their position in tree.order
+    '''
+
+    small = tree.count <= groupSize
+    bigParent = np.ones(tree.numNodes, dtype=bool)
+    bigParent[1:] = tree.count[tree.parent[1:]] > groupSize
+    
+    groups = np.nonzero(small & bigParent)[0]
+    return groups[np.argsort(tree.start[groups])]
+
+def groupSpheres(tree, pos, groups):
+    ''' Returns a bounding sphere for the particles of each group: the center of their bounding box and its half-diagonal.
+
+    Args:
+        tree (Octree): Octree of the particles
+        pos (array): Particle positions, shape (N,3)
+        groups (array): Group nodes, as returned by findGroups
+
+    Returns:
+        (2) arrays: centers, shape (G,3), and radii, shape (G,)
+    '''
+
+    sortedPos = pos[tree.order]
+    lo = np.minimum.reduceat(sortedPos, tree.start[groups], axis=0)
+    hi = np.maximum.reduceat(sortedPos, tree.start[groups], axis=0)
+    return (lo + hi) / 2., np.linalg.norm(hi - lo, axis=1) / 2.
+
+def expandRanges(starts, counts):
+    ''' Concatenates the integer ranges [starts[k], starts[k] + counts[k]).
+
+    Args:
+        starts (array): First value of each range
+        counts (array): Length of each range
+
+    Returns:
+        (2) arrays: the concatenated ranges, and for each value the index k of the range it came from
+    '''
+
+    owner = np.repeat(np.arange(counts.size), counts)
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts, counts) + np.arange(owner.size) - offsets[owner], owner
+
+def interactionLists(tree, groupCenter, groupRadius, openAngle, cutoff=np.inf, counts=None):
+    ''' Walks the tree once for a whole batch of groups at a time. The opening criterion is tested once per (group, node) pair, 
+    using the distance from the node's center of mass to the nearest point of the group's bounding sphere, so that an accepted node 
+    satisfies the usual criterion for every particle of the group. Accepted nodes are added to the group's cell list, unopened 
+    leaves to its leaf list, and the children of all other nodes form the next frontier of the walk. Nodes whose cells lie entirely 
+    farther than cutoff from the group's bounding sphere are dropped.
+
+    Args:
+        tree (Octree): Octree of the particles
+        groupCenter (array): Centers of the group bounding spheres, shape (G,3)
+        groupRadius (array): Radii of the group bounding spheres, shape (G,)
+        openAngle (float): Opening angle
+        cutoff (float): Interaction range
+        counts (dict): If given, the number of (group, node) pairs opened is added to its "nodesOpened"
+
+    Returns:
+        (4) arrays: group and node of each cell interaction, then group and node of each leaf interaction
+    '''
+
+    g = np.arange(groupRadius.size)
+    n = np.zeros(groupRadius.size, dtype=int)
+    cellGroup, cellNode, leafGroup, leafNode = [], [], [], []
+    
+    while (g.size > 0):
+        if (cutoff < np.inf):
+            gap = np.linalg.norm(np.maximum(np.abs(groupCenter[g] - tree.center[n]) - tree.size[n,None] / 2., 0), axis=1)
+            near = gap - groupRadius[g] <= cutoff
+            g, n = g[near], n[near]
+        
+        dist = np.linalg.norm(tree.com[n] - groupCenter[g], axis=1) - groupRadius[g]
+        accept = (dist > 0) & (tree.size[n] < openAngle * dist)
+        leaf = tree.isLeaf[n] & ~accept
+        
+        cellGroup.append(g[accept])
+        cellNode.append(n[accept])
+        leafGroup.append(g[leaf])
+        leafNode.append(n[leaf])
+        
+        opened = ~(accept | leaf)
+        g, n = g[opened], n[opened]
+        if (counts is not None):
+            counts["nodesOpened"] = counts.get("nodesOpened", 0) + g.size
+        n, owner = expandRanges(tree.firstChild[n], tree.numChildren[n])
+        g = g[owner]
+    
+    return np.concatenate(cellGroup), np.concatenate(cellNode), np.concatenate(leafGroup), np.concatenate(leafNode)
+
+def walkGroups(tree, pos, mass, groups, groupCenter, groupRadius, openAngle, eps0, r0, quadrupole=True, splitScale=None, cutoff=np.inf, 
+               vel=None, table=None, counts=None):
+    ''' Computes the accelerations of the particles of a batch of groups. The groups share a single vectorized tree walk 
+    (see interactionLists), and each interaction list is then evaluated as one particle x list product: every particle of a group 
+    against the multipoles of its accepted nodes and against the particles of its leaves.
+
+    Args:
+        tree (Octree): Octree of the particles
+        pos (array): Particle positions, shape (N,3)
+        mass (array): Particle masses, shape (N,)
+        groups (array): Groups from findGroups (any subset)
+        groupCenter (array): Centers of the group bounding spheres
+        groupRadius (array): Radii of the group bounding spheres
+        openAngle (float): Opening angle
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+        quadrupole (boolean): Add the quadrupole correction to the monopole of accepted nodes
+        splitScale (float): If given, only the short-range part S(r) of every interaction is computed
+        cutoff (float): Interaction range (see interactionLists)
+        vel (array): Particle velocities, shape (N,3); if given, the jerks are computed as well (nodes move with tree.comVel)
+        table (Softening.KernelTable): Optional lookup table of the softening kernel of the accelerations
+        counts (dict): If given, the numbers of groups walked, nodes opened and particle-node and particle-particle interactions are 
+            added to its "groups", "nodesOpened", "particleNode" and "particleParticle"
+
+    Returns:
+        (2) arrays: Accelerations of the particles of the groups, group after group, in the order of groupRows(tree, groups), 
+            and their jerks in the same order (None without vel)
+    '''
+
+    gStart = tree.start[groups]
+    gCount = tree.count[groups]
+    gOffset = np.cumsum(gCount) - gCount   # first row of each group in the returned array
+    accel = np.zeros((gCount.sum(), 3))
+    jerk = None if vel is None else np.zeros_like(accel)
+    
+    cellGroup, cellNode, leafGroup, leafNode = interactionLists(tree, groupCenter, groupRadius, openAngle, cutoff, counts)
+    
+    # particle-node interactions
+    local, pair = expandRanges(gOffset[cellGroup], gCount[cellGroup])
+    slot = local - gOffset[cellGroup][pair] + gStart[cellGroup][pair]
+    node = cellNode[pair]
+    if (counts is not None):
+        counts["groups"] = counts.get("groups", 0) + groups.size
+        counts["particleNode"] = counts.get("particleNode", 0) + node.size
+    disp = tree.com[node] - pos[tree.order[slot]]
+    a = soft.softenedAccel(disp, tree.mass[node], eps0, r0, table)
+    if (quadrupole):
+        a += quadrupoleAccel(disp, tree.quad[node])
+    if (vel is not None):
+        j = soft.softenedJerk(disp, tree.comVel[node] - vel[tree.order[slot]], tree.mass[node], eps0, r0)
+    if (splitScale is not None):
+        factor = pm.shortRangeFactor(np.linalg.norm(disp, axis=1), splitScale)[:,None]
+        a *= factor
+        if (vel is not None):
+            j *= factor
+    for k in range(3):
+        accel[:,k] += np.bincount(local, weights=a[:,k], minlength=accel.shape[0])
+        if (vel is not None):
+            jerk[:,k] += np.bincount(local, weights=j[:,k], minlength=accel.shape[0])
+    
+    # particle-particle interactions with the particles of unopened leaves
+    nSrc = tree.count[leafNode]
+    flat, pair = expandRanges(np.zeros_like(nSrc), gCount[leafGroup] * nSrc)
+    local = gOffset[leafGroup][pair] + flat // nSrc[pair]
+    slot = gStart[leafGroup][pair] + flat // nSrc[pair]
+    src = tree.order[tree.start[leafNode][pair] + flat % nSrc[pair]]
+    if (counts is not None):
+        # pairs of a particle with itself contribute nothing, and are not counted
+        counts["particleParticle"] = counts.get("particleParticle", 0) + flat.size - np.count_nonzero(src == tree.order[slot])
+    disp = pos[src] - pos[tree.order[slot]]
+    a = soft.softenedAccel(disp, mass[src], eps0, r0, table)
+    if (vel is not None):
+        j = soft.softenedJerk(disp, vel[src] - vel[tree.order[slot]], mass[src], eps0, r0)
+    if (splitScale is not None):
+        factor = pm.shortRangeFactor(np.linalg.norm(disp, axis=1), splitScale)[:,None]
+        a *= factor
+        if (vel is not None):
+            j *= factor
+    for k in range(3):
+        accel[:,k] += np.bincount(local, weights=a[:,k], minlength=accel.shape[0])
+        if (vel is not None):
+            jerk[:,k] += np.bincount(local, weights=j[:,k], minlength=accel.shape[0])
+    
+    return accel, jerk
+
+def potentialGroups(tree, pos, mass, groups, groupCenter, groupRadius, openAngle, eps0, r0, quadrupole=True):
+    ''' Computes the potentials of the particles of a batch of groups, with the interaction lists of walkGroups.
+
+    Args:
+        tree, pos, mass, groups, groupCenter, groupRadius, openAngle, eps0, r0, quadrupole: As in walkGroups
+
+    Returns:
+        array: Potentials of the particles of the groups, in the order of groupRows(tree, groups)
+    '''
+
+    gStart = tree.start[groups]
+    gCount = tree.count[groups]
+    gOffset = np.cumsum(gCount) - gCount
+    phi = np.zeros(gCount.sum())
+    
+    cellGroup, cellNode, leafGroup, leafNode = interactionLists(tree, groupCenter, groupRadius, openAngle)
+    
+    # particle-node interactions
+    local, pair = expandRanges(gOffset[cellGroup], gCount[cellGroup])
+    slot = local - gOffset[cellGroup][pair] + gStart[cellGroup][pair]
+    node = cellNode[pair]
+    disp = tree.com[node] - pos[tree.order[slot]]
+    p = tree.mass[node] * soft.softenedPotential(np.linalg.norm(disp, axis=1), eps0, r0)
+    if (quadrupole):
+        p += quadrupolePotential(disp, tree.quad[node])
+    phi += np.bincount(local, weights=p, minlength=phi.size)
+    
+    # particle-particle interactions with the particles of unopened leaves (a particle paired with itself contributes nothing)
+    nSrc = tree.count[leafNode]
+    flat, pair = expandRanges(np.zeros_like(nSrc), gCount[leafGroup] * nSrc)
+    local = gOffset[leafGroup][pair] + flat // nSrc[pair]
+    slot = gStart[leafGroup][pair] + flat // nSrc[pair]
+    src = tree.order[tree.start[leafNode][pair] + flat % nSrc[pair]]
+    disp = pos[src] - pos[tree.order[slot]]
+    p = mass[src] * soft.softenedPotential(np.linalg.norm(disp, axis=1), eps0, r0)
+    phi += np.bincount(local, weights=p, minlength=phi.size)
+    
+    return phi
+
+def groupRows(tree, groups):
+    ''' Returns the rows of the particle set held by a list of groups, group after group.
+
+    Args:
+        tree (Octree): Octree of the particles
+        groups (array): Group nodes
+
+    Returns:
+        array: Particle indices
+    '''
+
+    return tree.order[expandRanges(tree.start[groups], tree.count[groups])[0]]
             
 def main():
     #### !!!! TEST !!!! ####
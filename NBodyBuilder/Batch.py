@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import sys
+import time
+import NBodyBuilder.NBodyBuilderClass as nb
+import NBodyBuilder.Diagnostics as diag
+import NBodyBuilder.Stats as st
+
+''' Headless command line: runs one simulation with NBodyBuilderClass from a JSON config file and/or flags, without a display or any
+    prompt, and writes its outputs to a directory. Nothing here imports tkinter or matplotlib, so it suits batch jobs:
+
+        python -m NBodyBuilder --config run.json --out run1
+        python -m NBodyBuilder --numParticles 10000 --ic hernquist --gravity BH --time 10 --dt 0.01 --diagnosticsEvery 10
+
+    The config file is a JSON object with the same names as the flags; flags given on the command line override it, and anything given
+    in neither takes the value in DEFAULTS. The output directory receives history.npy (frames of [mass, x, y, z] by particle id, see
+    TimeStepper), run.json (the configuration, the output times, the wall time and the step and force counts) and, if requested,
+    diagnostics.json, stats.jsonl and checkpoint.npz. With --restart, the run resumes from a checkpoint instead, and keeps writing to
+    the history file of the checkpointed run unless the output directory already holds one; its run.json then records the parameters
+    of the resumed run, completed by the configuration in the run.json of the checkpointed run (such as its initial conditions).
+'''
+
+DEFAULTS = {"numParticles": 100, "ic": "random", "gravity": "BH", "integrator": "leapfrog", "time": 10., "dt": 0.1, "seed": 12345,
+            "outputEvery": 1, "eps0": 0.1, "r0": 5., "openAngle": 0.5, "boxSize": 50., "gridSize": 64, "fmmOrder": 4,
+            "splitScale": None, "workers": None, "checkpointEvery": 1}
+
+OUTPUT_OPTIONS = ("stats", "diagnosticsEvery", "checkpoint", "checkpointEvery", "restart")
+
+def parser():
+    ''' Builds the parser of the command line. Every option but --out defaults to None, so that the options actually given can be told apart
+    from those left to the config file or to DEFAULTS.
+
+    Returns:
+        ArgumentParser: Parser
+    '''
+
+    p = argparse.ArgumentParser(prog="python -m NBodyBuilder", description="Run an NBodyBuilder simulation without a display.")
+    p.add_argument("--config", help="JSON file with the run parameters (the options below, without dashes)")
+    p.add_argument("--numParticles", type=int, help="number of particles (default: {})".format(DEFAULTS["numParticles"]))
+    p.add_argument("--ic", choices=["random", "hernquist"], help="initial conditions (default: {})".format(DEFAULTS["ic"]))
+    p.add_argument("--gravity", choices=["direct", "BH", "FMM", "PM", "TreePM"], help="gravity solver (default: {})".format(DEFAULTS["gravity"]))
+    p.add_argument("--integrator", choices=["euler", "euler_cromer", "leapfrog", "hermite", "yoshida", "forest_ruth"],
+                   help="integrator (default: {})".format(DEFAULTS["integrator"]))
+    p.add_argument("--time", type=float, help="end time (default: {})".format(DEFAULTS["time"]))
+    p.add_argument("--dt", type=float, help="time step (default: {})".format(DEFAULTS["dt"]))
+    p.add_argument("--seed", type=int, help="seed of the initial conditions (default: {})".format(DEFAULTS["seed"]))
+    p.add_argument("--outputEvery", type=int, help="record a frame every outputEvery steps (default: 1)")
+    p.add_argument("--eps0", type=float, help="softening length (default: {})".format(DEFAULTS["eps0"]))
+    p.add_argument("--r0", type=float, help="softening cutoff (default: {})".format(DEFAULTS["r0"]))
+    p.add_argument("--openAngle", type=float, help="opening angle of the BH, FMM and TreePM tree walks (default: {})".format(DEFAULTS["openAngle"]))
+    p.add_argument("--boxSize", type=float, help="size of the root tree cell and of the mesh (default: {})".format(DEFAULTS["boxSize"]))
+    p.add_argument("--gridSize", type=int, help="PM and TreePM mesh cells along each side (default: {})".format(DEFAULTS["gridSize"]))
+    p.add_argument("--fmmOrder", type=int, help="FMM expansion order (default: {})".format(DEFAULTS["fmmOrder"]))
+    p.add_argument("--splitScale", type=float, help="TreePM split scale (default: derived from the mesh spacing)")
+    p.add_argument("--workers", type=int, help="threads or processes of the force computation")
+    p.add_argument("--diagnosticsEvery", type=int, help="measure energy and momenta every diagnosticsEvery frames")
+    p.add_argument("--stats", action="store_true", default=None, help="time the phases of every step, logged to stats.jsonl")
+    p.add_argument("--checkpointEvery", type=int, help="save a checkpoint every checkpointEvery frames (only with --checkpoint)")
+    p.add_argument("--checkpoint", action="store_true", default=None, help="save checkpoints to checkpoint.npz")
+    p.add_argument("--restart", help="resume from this checkpoint file")
+    p.add_argument("--out", default=".", help="output directory (default: the current directory)")
+    return p
+
+def readConfig(args):
+    ''' Merges DEFAULTS, the config file and the options given on the command line, in increasing order of precedence. A restart
+    takes its run parameters from the checkpoint, so DEFAULTS are left out: only the options actually given are returned.
+
+    Args:
+        args (Namespace): Parsed command line
+
+    Returns:
+        dict: Run parameters
+    '''
+
+    config = dict(DEFAULTS) if args.restart is None else {}
+    if (args.config is not None):
+        with open(args.config) as f:
+            config.update(json.load(f))
+    config.update({k: v for k, v in vars(args).items() if (v is not None) and (k not in ("config", "out"))})
+    return config
+
+def run(config, outDir):
+    ''' Runs one simulation headless and writes its outputs.
+
+    Args:
+        config (dict): Run parameters (see readConfig)
+        outDir (string): Output directory
+
+    Returns:
+        dict: The contents of run.json
+    '''
+
+    os.makedirs(outDir, exist_ok=True)
+    options = dict(config)
+    names = ("numParticles", "ic", "gravity", "integrator", "time", "dt")
+    positional = [options.pop(k, None) for k in names]
+
+    diagnostics = None
+    if (options.pop("diagnosticsEvery", None) is not None):
+        diagnostics = diag.Diagnostics(every=config["diagnosticsEvery"])
+        options["diagnostics"] = diagnostics
+    stats = st.Stats(os.path.join(outDir, "stats.jsonl")) if options.pop("stats", None) else None
+    if (options.pop("checkpoint", None)):
+        options["checkpointFile"] = os.path.join(outDir, "checkpoint.npz")
+    restartFile = options.pop("restart", None)
+    historyFile = os.path.join(outDir, "history.npy")
+    if ((restartFile is not None) and not os.path.exists(historyFile)):
+        historyFile = None          # keep writing to the history file of the checkpointed run
+
+    start = time.perf_counter()
+    try:
+        sim = nb.NBodyBuilderClass(*positional, historyFile=historyFile, restartFile=restartFile, stats=stats, **options)
+    finally:
+        if (stats is not None):
+            stats.close()
+    wallTime = time.perf_counter() - start
+
+    if (restartFile is not None):
+        config = restartConfig(config, sim.parameters, restartFile, outDir)
+
+    summary = {"config": config, "times": sim.times.tolist(), "wallTime": wallTime, "numSteps": sim.numSteps, "numForces": sim.numForces,
+               "historyFile": getattr(sim.history, "filename", None)}
+    if (diagnostics is not None):
+        diagnostics.save(os.path.join(outDir, "diagnostics.json"))
+        summary["energyDrift"] = diagnostics.energyDrift()
+    with open(os.path.join(outDir, "run.json"), "w") as f:
+        json.dump(summary, f, indent=1)
+    return summary
+
+def restartConfig(config, parameters, restartFile, outDir):
+    ''' Returns the configuration of a resumed run: that of the checkpointed run, read from the run.json in outDir or next to the
+    checkpoint if there is one (without its OUTPUT_OPTIONS), updated with the options given to the restart and then with the parameters
+    the run resumed with.
+
+    Args:
+        config (dict): Options given to the restart (see readConfig)
+        parameters (dict): Parameters of the resumed run (see TimeStepper.parameters)
+        restartFile (string): Checkpoint the run resumed from
+        outDir (string): Output directory
+
+    Returns:
+        dict: Configuration of the resumed run
+    '''
+
+    merged = {}
+    for runFile in (os.path.join(os.path.dirname(restartFile), "run.json"), os.path.join(outDir, "run.json")):
+        if (os.path.exists(runFile)):
+            with open(runFile) as f:
+                # what the earlier invocation wrote out is not a parameter of the run
+                merged = {k: v for k, v in json.load(f)["config"].items() if k not in OUTPUT_OPTIONS}
+            break
+    merged.update(config)
+    merged.update({k: v for k, v in parameters.items() if (k in DEFAULTS) or (k in merged)})
+    return merged
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    summary = run(readConfig(args), args.out)
+    line = "{} steps, {} force evaluations in {:.3g} s".format(summary["numSteps"], summary["numForces"], summary["wallTime"])
+    if ("energyDrift" in summary):
+        line += ", energy drift {:.3g}".format(summary["energyDrift"])
+    print(line)
+    print("outputs written to {}".format(args.out))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,301 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import NBodyBuilder.IC as IC
+import NBodyBuilder.Hernquist_IC as hern
+import NBodyBuilder.ParticleSet as ps
+import NBodyBuilder.DirectForce as df
+import NBodyBuilder.BH as bh
+import NBodyBuilder.TimeStepper as TimeStepper
+
+''' Benchmark suite: times the direct and Barnes-Hut solvers (tree build, multipole sum and tree walk separately) against the number of
+    particles and the opening angle, with the force error of BH against direct summation, the generation of initial conditions, and
+    full TimeStepper steps. Results are written as JSON (with the machine, NumPy version and git revision they were measured on), and
+    two result files can be compared:
+
+        python -m NBodyBuilder.Benchmark --sizes 1000 4000 --out bench.json
+        python -m NBodyBuilder.Benchmark --compare old.json bench.json
+
+    Times are the best of 'repeat' runs, in seconds (the TimeStepper steps also report the median). The particles are Hernquist halos
+    (a = 10, M = 10) with a fixed seed.
+'''
+
+def runTimes(fn, repeat=3, setup=None):
+    ''' Runs fn repeatedly and returns its wall times.
+
+    Args:
+        fn (function): Function to time, called without arguments
+        repeat (integer): Number of runs
+        setup (function): If given, called without arguments before every run, outside the timing
+
+    Returns:
+        array: Wall time of each run, in seconds
+    '''
+
+    times = np.empty(repeat)
+    for k in range(repeat):
+        if (setup is not None):
+            setup()
+        start = time.perf_counter()
+        fn()
+        times[k] = time.perf_counter() - start
+    return times
+
+def bestTime(fn, repeat=3, setup=None):
+    ''' Runs fn repeatedly and returns its shortest wall time.
+
+    Args:
+        fn (function): Function to time, called without arguments
+        repeat (integer): Number of runs
+        setup (function): If given, called without arguments before every run, outside the timing
+
+    Returns:
+        float: Best wall time, in seconds
+    '''
+
+    return float(runTimes(fn, repeat, setup).min())
+
+def halo(numParticles, seed=12345):
+    ''' Returns the benchmark particle set: a Hernquist halo of numParticles particles.
+
+    Args:
+        numParticles (integer): Number of particles
+        seed (integer): Random seed
+
+    Returns:
+        ParticleSet: Particles
+    '''
+
+    return hern.Hernquist(numParticles, 10, 10, rng=seed).particles
+
+def restoreOrder(particles):
+    ''' Puts the rows of a ParticleSet back in order of particle id, the order it was generated in (the tree build sorts them).
+
+    Args:
+        particles (ParticleSet): Particles
+    '''
+
+    particles.reorder(particles.rank.copy())
+
+def copyOf(particles):
+    ''' Returns a fresh ParticleSet with the same masses, positions and velocities (solvers reorder and overwrite the sets they use).
+
+    Args:
+        particles (ParticleSet): Particles
+
+    Returns:
+        ParticleSet: Copy of the particles
+    '''
+
+    return ps.ParticleSet(particles.mass, particles.pos, particles.vel)
+
+def relativeErrors(accel, reference):
+    ''' Relative errors |a - a_ref| / |a_ref| of a set of accelerations.
+
+    Args:
+        accel (array): Accelerations, shape (N,3)
+        reference (array): Reference accelerations, shape (N,3)
+
+    Returns:
+        dict: Median, 99th percentile and maximum of the relative errors
+    '''
+
+    err = np.linalg.norm(accel - reference, axis=1) / np.linalg.norm(reference, axis=1)
+    return {"errMedian": float(np.median(err)), "err99": float(np.percentile(err, 99)), "errMax": float(err.max())}
+
+def inIdOrder(particles, values):
+    ''' Returns per-row values of a (possibly reordered) ParticleSet in order of particle id.
+
+    Args:
+        particles (ParticleSet): Particles
+        values (array): Values in row order, shape (N,...)
+
+    Returns:
+        array: Values in id order
+    '''
+
+    out = np.empty_like(values)
+    out[particles.ids] = values
+    return out
+
+def benchDirect(sizes, repeat=3):
+    ''' Times DirectForce.computeAllAccels.
+
+    Args:
+        sizes (list): Numbers of particles
+        repeat (integer): Runs per measurement
+
+    Returns:
+        list: One result per size
+    '''
+
+    results = []
+    for n in sizes:
+        solver = df.DirectForce(halo(n))
+        results.append({"benchmark": "direct", "N": n, "accel": bestTime(solver.computeAllAccels, repeat)})
+    return results
+
+def benchBH(sizes, openAngles, repeat=3, directMax=20000):
+    ''' Times the phases of the BH solver (Morton tree build and particle sort, multipole sum, grouped tree walk, and the refit that
+    can replace the build and the multipole sum, see BH.update) and measures its force error against direct summation.
+
+    Args:
+        sizes (list): Numbers of particles
+        openAngles (list): Opening angles
+        repeat (integer): Runs per measurement
+        directMax (integer): Largest number of particles for which the direct reference (and so the error) is computed
+
+    Returns:
+        list: One result per size and opening angle
+    '''
+
+    results = []
+    for n in sizes:
+        particles = halo(n)
+        reference = None
+        if (n <= directMax):
+            direct = copyOf(particles)
+            df.DirectForce(direct).computeAllAccels()
+            reference = direct.accel
+
+        for openAngle in openAngles:
+            p = copyOf(particles)
+            solver = bh.BH(50, openAngle, p, build="morton")
+            # every build starts from the unsorted particles, as the first one did
+            result = {"benchmark": "BH", "N": n, "openAngle": openAngle,
+                      "build": bestTime(solver.buildTree, repeat, setup=lambda: restoreOrder(p)),
+                      "multipole": bestTime(lambda: solver.tree.sumMultipole(p.pos, p.mass, p.vel), repeat),
+                      "walk": bestTime(solver.computeAllAccels, repeat),
+                      "refit": bestTime(lambda: solver.tree.refit(p.pos, p.mass, p.vel), repeat)}
+            result["accel"] = result["build"] + result["multipole"] + result["walk"]
+            if (reference is not None):
+                result.update(relativeErrors(inIdOrder(p, p.accel), reference))
+            results.append(result)
+    return results
+
+def benchIC(sizes, repeat=3):
+    ''' Times the generation of random and Hernquist initial conditions.
+
+    Args:
+        sizes (list): Numbers of particles
+        repeat (integer): Runs per measurement
+
+    Returns:
+        list: One result per size and kind of initial conditions
+    '''
+
+    return [{"benchmark": "IC", "N": n, "ic": ic, "generate": bestTime(lambda: IC.IC(n, ic), repeat)}
+            for n in sizes for ic in ("random", "hernquist")]
+
+def benchStepper(numParticles, configs, steps=5, repeat=1):
+    ''' Times full TimeStepper steps (force computations, integrator updates and history writes).
+
+    Args:
+        numParticles (integer): Number of particles
+        configs (list): (gravity, integrator) pairs
+        steps (integer): Steps per run
+        repeat (integer): Runs per measurement
+
+    Returns:
+        list: One result per configuration, with the best and the median time per step
+    '''
+
+    particles = halo(numParticles)
+    results = []
+    for gravity, integrator in configs:
+        run = lambda: TimeStepper.TimeStepper(copyOf(particles), steps * 0.1, 0.1, integrator, gravity)
+        times = runTimes(run, repeat) / steps
+        results.append({"benchmark": "TimeStepper", "N": numParticles, "gravity": gravity, "integrator": integrator,
+                        "step": float(times.min()), "stepMedian": float(np.median(times))})
+    return results
+
+def machineInfo():
+    ''' Describes where and when the benchmark was run.
+
+    Returns:
+        dict: Date, machine, Python and NumPy versions, number of processors and git revision (if available)
+    '''
+
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+
+    return {"date": datetime.datetime.now().isoformat(timespec="seconds"), "machine": platform.machine(),
+            "processor": platform.processor(), "system": platform.platform(), "python": platform.python_version(),
+            "numpy": np.__version__, "cpus": os.cpu_count(), "revision": revision}
+
+TIMING_FIELDS = ("accel", "build", "multipole", "refit", "walk", "generate", "step", "stepMedian")
+KEY_FIELDS = ("benchmark", "N", "openAngle", "ic", "gravity", "integrator")
+
+def compare(old, new):
+    ''' Compares two benchmark result files: for every measurement present in both, the ratio of old to new time (above 1 when the
+    new run is faster).
+
+    Args:
+        old (dict): Earlier results, as written by main
+        new (dict): Later results
+
+    Returns:
+        string: Table of the ratios
+    '''
+
+    key = lambda r: tuple(r.get(k) for k in KEY_FIELDS)
+    earlier = {key(r): r for r in old["results"]}
+
+    lines = ["{:<50s} {:>10s} {:>10s} {:>10s} {:>8s}".format("measurement", "phase", "old", "new", "speedup")]
+    for r in new["results"]:
+        o = earlier.get(key(r))
+        if (o is None):
+            continue
+        label = " ".join("{}={}".format(k, r[k]) for k in KEY_FIELDS if r.get(k) is not None)
+        for field in TIMING_FIELDS:
+            if ((field in r) and (field in o)):
+                lines.append("{:<50s} {:>10s} {:>10.4g} {:>10.4g} {:>8.2f}".format(label, field, o[field], r[field], o[field] / r[field]))
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m NBodyBuilder.Benchmark", description="Benchmark the NBodyBuilder solvers and integrators.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 4000, 16000], help="numbers of particles")
+    parser.add_argument("--angles", type=float, nargs="+", default=[0.3, 0.5, 0.7, 1.0], help="BH opening angles")
+    parser.add_argument("--directMax", type=int, default=20000, help="largest N for direct summation (timing and error reference)")
+    parser.add_argument("--stepN", type=int, default=2000, help="number of particles of the TimeStepper benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (the best is kept, and for TimeStepper also the median)")
+    parser.add_argument("--only", nargs="+", choices=["direct", "BH", "IC", "TimeStepper"], help="run only these benchmarks")
+    parser.add_argument("--out", default="benchmark.json", help="results file (default: benchmark.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results files instead of running")
+    args = parser.parse_args(argv)
+
+    if (args.compare is not None):
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            print(compare(json.load(f), json.load(g)))
+        return
+
+    only = set(args.only or ["direct", "BH", "IC", "TimeStepper"])
+    results = []
+    if ("direct" in only):
+        results += benchDirect([n for n in args.sizes if n <= args.directMax], args.repeat)
+    if ("BH" in only):
+        results += benchBH(args.sizes, args.angles, args.repeat, args.directMax)
+    if ("IC" in only):
+        results += benchIC(args.sizes, args.repeat)
+    if ("TimeStepper" in only):
+        configs = [("direct", "leapfrog"), ("BH", "leapfrog"), ("BH", "hermite"), ("FMM", "leapfrog"), ("TreePM", "leapfrog")]
+        results += benchStepper(args.stepN, configs, repeat=args.repeat)
+
+    for r in results:
+        print(json.dumps(r))
+
+    with open(args.out, "w") as f:
+        json.dump({"meta": machineInfo(), "results": results}, f, indent=1)
+    print("results written to {}".format(args.out))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,220 @@
+import json
+import numpy as np
+import NBodyBuilder.ParticleSet as ps
+import NBodyBuilder.DirectForce as df
+import NBodyBuilder.BH as bh
+import NBodyBuilder.IC as IC
+
+''' Conservation diagnostics of a simulation: kinetic and potential energy, linear and angular momentum and the virial ratio, measured
+    at a configurable cadence and kept as a time series. The potential energy comes from the same force model as the run: TimeStepper
+    hands over its solver when it holds the forces at the current positions, and the potentials are computed on its tree (or by its
+    direct sum) at no extra tree build; otherwise a BH tree is built with the run's opening angle. A direct sum can be added as a
+    check of the tree's error. TimeStepper takes an optional Diagnostics and measures at its output times:
+
+        diagnostics = Diagnostics.Diagnostics(every=10, directCheck=True)
+        stepper = TimeStepper.TimeStepper(particles, 10, 0.1, "leapfrog", "BH", diagnostics=diagnostics)
+        print(diagnostics.energyDrift())
+'''
+
+def kineticEnergy(particles):
+    ''' Total kinetic energy of a set of particles.
+
+    Args:
+        particles (ParticleSet): Particles
+
+    Returns:
+        float: Kinetic energy
+    '''
+
+    return 0.5 * float(np.sum(particles.mass * np.einsum('ij,ij->i', particles.vel, particles.vel)))
+
+def potentialEnergy(particles, eps0=0.1, r0=5, openAngle=None, solver=None):
+    ''' Total softened potential energy of a set of particles, half the sum of mass times potential.
+
+    Args:
+        particles (ParticleSet): Particles
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+        openAngle (float): Opening angle of the BH tree walk; None sums directly over all pairs
+        solver (BH or DirectForce): If given, a solver already set up on the current positions of these particles, whose 
+            computeAllPotentials is used instead (eps0, r0 and openAngle are then its own)
+
+    Returns:
+        float: Potential energy
+    '''
+
+    if (solver is not None):
+        return 0.5 * float(np.sum(solver.particles.mass * solver.computeAllPotentials()))
+
+    if (openAngle is None):
+        phi = df.DirectForce(particles, eps0=eps0, r0=r0).computeAllPotentials()
+        return 0.5 * float(np.sum(particles.mass * phi))
+
+    # the tree sorts the particles it is built on, so it gets its own copy
+    copy = ps.ParticleSet(particles.mass, particles.pos)
+    phi = bh.BH(50, openAngle, copy, build="morton", eps0=eps0, r0=r0).computeAllPotentials()
+    return 0.5 * float(np.sum(copy.mass * phi))
+
+def momentum(particles):
+    ''' Total linear momentum of a set of particles.
+
+    Args:
+        particles (ParticleSet): Particles
+
+    Returns:
+        array: Momentum, shape (3,)
+    '''
+
+    return (particles.mass[:,None] * particles.vel).sum(axis=0)
+
+def angularMomentum(particles):
+    ''' Total angular momentum of a set of particles about the origin.
+
+    Args:
+        particles (ParticleSet): Particles
+
+    Returns:
+        array: Angular momentum, shape (3,)
+    '''
+
+    return (particles.mass[:,None] * np.cross(particles.pos, particles.vel)).sum(axis=0)
+
+class Diagnostics(object):
+    ''' Time series of the conserved quantities of a simulation. Each record holds the time, the kinetic, potential and total energy,
+    the momentum and angular momentum (as lists) and the virial ratio 2K / |W|, plus the direct-sum potential energy if directCheck is
+    set.
+
+    Args:
+        every (integer): Measure at every 'every'-th output time of the TimeStepper (the initial state is always measured)
+        openAngle (float): Opening angle of the tree walk of the potential energy; None follows the run (see measure)
+        direct (boolean): Always compute the potential energy by direct summation
+        directCheck (boolean): Also compute the potential energy by direct summation, as "potentialDirect"
+    '''
+
+    def __init__(self, every=1, openAngle=None, direct=False, directCheck=False):
+        self.every = every
+        self.openAngle = openAngle
+        self.direct = direct
+        self.directCheck = directCheck
+        self.records = []
+
+    def __repr__(self):
+        ''' Returns a table of the energies and virial ratio of the records.
+
+        Returns:
+            s (string): One line per record
+        '''
+
+        s = "{:>12s} {:>14s} {:>14s} {:>14s} {:>10s}\n".format("time", "kinetic", "potential", "energy", "virial")
+        for r in self.records:
+            s += "{:12.5g} {:14.7g} {:14.7g} {:14.7g} {:10.4f}\n".format(r["time"], r["kinetic"], r["potential"], r["energy"],
+                                                                        r["virialRatio"])
+        return s
+
+    def measure(self, particles, time, eps0=0.1, r0=5, openAngle=0.5, solver=None):
+        ''' Measures the conserved quantities of a set of particles and appends them to the records. Unless direct is set or an
+        openAngle was given to the Diagnostics, the potential energy follows the run: it is computed with the run's solver if one 
+        is given, and otherwise with a tree of the run's opening angle.
+
+        Args:
+            particles (ParticleSet): Particles
+            time (float): Time of the measurement
+            eps0 (float): Gravitational softening length of the simulation
+            r0 (float): Cutoff distance of the softening
+            openAngle (float): Opening angle of the run's tree walk; None for a run summed directly
+            solver (BH or DirectForce): The run's solver, if it is set up on the current positions (see potentialEnergy)
+
+        Returns:
+            dict: The new record
+        '''
+
+        kinetic = kineticEnergy(particles)
+        if (self.direct):
+            potential = potentialEnergy(particles, eps0, r0)
+        elif (self.openAngle is not None):
+            potential = potentialEnergy(particles, eps0, r0, self.openAngle)
+        else:
+            potential = potentialEnergy(particles, eps0, r0, openAngle, solver)
+        record = {"time": float(time), "kinetic": kinetic, "potential": potential, "energy": kinetic + potential,
+                  "momentum": momentum(particles).tolist(), "angularMomentum": angularMomentum(particles).tolist(),
+                  "virialRatio": 2 * kinetic / abs(potential) if potential != 0 else np.inf}
+        if (self.directCheck):
+            record["potentialDirect"] = potentialEnergy(particles, eps0, r0)
+
+        self.records.append(record)
+        return record
+
+    def series(self, name):
+        ''' Returns one quantity of all the records.
+
+        Args:
+            name (string): Name of the quantity ("time", "energy", "momentum", ...)
+
+        Returns:
+            array: Values, shape (numRecords,) or (numRecords,3) for the momenta
+        '''
+
+        return np.array([r[name] for r in self.records])
+
+    def energyDrift(self):
+        ''' Largest relative deviation of the total energy from its first record.
+
+        Returns:
+            float: max |E(t) - E(0)| / |E(0)|
+        '''
+
+        energy = self.series("energy")
+        return float(np.max(np.abs(energy - energy[0])) / abs(energy[0]))
+
+    def momentumDrift(self, name="momentum"):
+        ''' Change of the momentum (or of another vector quantity) between the first and last records.
+
+        Args:
+            name (string): "momentum" or "angularMomentum"
+
+        Returns:
+            float: Norm of the change
+        '''
+
+        values = self.series(name)
+        return float(np.linalg.norm(values[-1] - values[0]))
+
+    def toJSON(self):
+        ''' Returns the records as a JSON string (TimeStepper stores it in its checkpoints).
+
+        Returns:
+            string: JSON list of the records
+        '''
+
+        return json.dumps(self.records, default=float)
+
+    def fromJSON(self, text):
+        ''' Replaces the records with those of a JSON string written by toJSON.
+
+        Args:
+            text (string): JSON list of records
+        '''
+
+        self.records = json.loads(text)
+
+    def save(self, fileName):
+        ''' Writes the records to a JSON file.
+
+        Args:
+            fileName (string): File name
+        '''
+
+        with open(fileName, "w") as f:
+            f.write(self.toJSON())
+
+def main():
+    #### !!!! TEST !!!! ####
+
+    particles = IC.IC(1000, "hernquist").particles
+    diagnostics = Diagnostics(directCheck=True)
+    record = diagnostics.measure(particles, 0.)
+    print(diagnostics)
+    print("tree potential relative error: {:.3g}".format(abs(record["potential"] / record["potentialDirect"] - 1)))
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,169 @@
 import numpy as np
+import NBodyBuilder.Parallel as par
 import NBodyBuilder.Particle as part
+import NBodyBuilder.ParticleSet as ps
+import NBodyBuilder.Softening as soft
 
 ''' The DirectForce class implements an O(N^2) gravity solver that directly computes the Newtonian (1/r^2) force/acceleration between each pair of particles.
+    The pairs are evaluated with NumPy broadcasting in blocks of tileSize targets x tileSize sources, which bounds the temporary memory at O(tileSize^2) for any N.
+    Each block of targets is independent of the others, and NumPy releases the GIL inside its large array operations, so the blocks can be spread over a pool of threads
+    (Parallel.threadPool, started once and reused by every force evaluation).
 
     Args: 
-        particles (array): Array of particles
+        particles (ParticleSet or array): Set of particles (an array of Particles is packed into a ParticleSet)
+        tileSize (integer): Number of targets and of sources per block of pairs
+        workers (integer): Number of threads computing blocks of targets concurrently; None or 1 computes them in the calling thread
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+        softeningTable (Softening.KernelTable): If given, the softening kernel is interpolated from this table
 '''
 
 class DirectForce(object):
     
-    # Given an array of Particles, instantiate a DirectForce object
-    def __init__(self, particles):
-        self.particles = particles
+    # Given a set of Particles, instantiate a DirectForce object
+    def __init__(self, particles, tileSize=512, workers=None, eps0=0.1, r0=5, softeningTable=None):
+        self.particles = ps.asParticleSet(particles)
+        self.tileSize = tileSize
+        self.workers = workers
+        self.eps0 = eps0
+        self.r0 = r0
+        self.softeningTable = softeningTable
         
     def computeAccel(self, p):
         ''' Computes the acceleration of Particle p induced by all other particles in the simulation.
 
         Args:
-            p (?): A Particle 'p'
+            p (Particle or integer): A Particle of the simulation, or its index in the ParticleSet
 
         Returns:
-            totalAccel (?): Total acceleration felt by Particle p from all other particles
+            totalAccel (array): Total acceleration felt by Particle p from all other particles
         '''
 
-        totAccel = np.zeros(3)
+        i = self.particles.row(p)
+        pos = self.particles.pos
+        return accelTile(pos[i:i+1], pos, self.particles.mass, self.eps0, self.r0, self.softeningTable)[0]
+    
+    def computeAllAccels(self, active=None, jerk=False):
+        ''' Computes the pairwise forces/accelerations for all Particles in the simulation.
         
-        for particle in self.particles:
-            if (particle != p):
-                accel = p.newtonAccelSmooth(particle, 0.1, 5)
-                totAccel += accel
+        Args:
+            active (array): If given, only the accelerations of these particles are computed, and the others are left unchanged
+            jerk (boolean): Also compute the jerks (time derivatives of the accelerations) into particles.jerk
+        '''
+
+        targets = np.arange(self.particles.size) if active is None else np.asarray(active)
+        blocks = [targets[i0:i0 + self.tileSize] for i0 in range(0, targets.size, self.tileSize)]
         
-        return totAccel
+        if ((self.workers is None) or (self.workers <= 1)):
+            for block in blocks:
+                self.computeTargetBlock(block, jerk)
+        else:
+            list(par.threadPool(self.workers).map(self.computeTargetBlock, blocks, [jerk] * len(blocks)))
     
-    def computeAllAccels(self):
-        ''' Computes the pairwise forces/accelerations for all Particles in the simulation.
+    def computeAllPotentials(self):
+        ''' Computes the gravitational potential of every particle due to all the others, with the softened potential that matches the 
+        force law (see Softening.softenedPotential). The potential energy of the system is half the sum of mass times potential.
+
+        Returns:
+            array: Potential of each particle, in row order, shape (N,)
         '''
 
-        for p in self.particles:
-            accel = self.computeAccel(p)
-            p.setAccel(accel)
+        pos = self.particles.pos
+        mass = self.particles.mass
+        n = self.particles.size
+        
+        phi = np.zeros(n)
+        for i0 in range(0, n, self.tileSize):
+            for j0 in range(0, n, self.tileSize):
+                phi[i0:i0 + self.tileSize] += potentialTile(pos[i0:i0 + self.tileSize], pos[j0:j0 + self.tileSize], 
+                                                            mass[j0:j0 + self.tileSize], self.eps0, self.r0)
+        return phi
+    
+    def computeTargetBlock(self, targets, jerk=False):
+        ''' Computes the accelerations of a block of (at most tileSize) targets, summing over the blocks of sources.
+        
+        Args:
+            targets (array): Indices of the targets in the ParticleSet
+            jerk (boolean): Also compute the jerks of the targets
+        '''
+
+        pos = self.particles.pos
+        vel = self.particles.vel
+        mass = self.particles.mass
+        n = self.particles.size
+        
+        totAccel = np.zeros((targets.size, 3))
+        totJerk = np.zeros((targets.size, 3))
+        
+        for j0 in range(0, n, self.tileSize):
+            j1 = min(j0 + self.tileSize, n)
+            totAccel += accelTile(pos[targets], pos[j0:j1], mass[j0:j1], self.eps0, self.r0, self.softeningTable)
+            if (jerk):
+                totJerk += jerkTile(pos[targets], vel[targets], pos[j0:j1], vel[j0:j1], mass[j0:j1], self.eps0, self.r0)
+        
+        self.particles.accel[targets] = totAccel
+        if (jerk):
+            self.particles.jerk[targets] = totJerk
+            
+
+def accelTile(pos, srcPos, srcMass, eps0, r0, table=None):
+    ''' Computes the softened accelerations induced on a block of targets by a block of sources, summed over the sources. 
+    A target coinciding with a source (in particular, a particle paired with itself) gets no contribution from it.
+
+    Args:
+        pos (array): Target positions, shape (T,3)
+        srcPos (array): Source positions, shape (S,3)
+        srcMass (array): Source masses, shape (S,)
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+        table (Softening.KernelTable): Optional lookup table of the softening kernel
+
+    Returns:
+        array: Total acceleration on each target, shape (T,3)
+    '''
+
+    disp = srcPos[None,:,:] - pos[:,None,:]
+    return soft.softenedAccel(disp, srcMass[None,:], eps0, r0, table).sum(axis=1)
+
+def potentialTile(pos, srcPos, srcMass, eps0, r0):
+    ''' Computes the softened potentials induced at a block of targets by a block of sources, summed over the sources. A target 
+    coinciding with a source gets no contribution from it.
+
+    Args:
+        pos (array): Target positions, shape (T,3)
+        srcPos (array): Source positions, shape (S,3)
+        srcMass (array): Source masses, shape (S,)
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+
+    Returns:
+        array: Total potential at each target, shape (T,)
+    '''
+
+    disp = srcPos[None,:,:] - pos[:,None,:]
+    r = np.sqrt(np.einsum('tsk,tsk->ts', disp, disp))
+    return (soft.softenedPotential(r, eps0, r0) * srcMass[None,:]).sum(axis=1)
+
+def jerkTile(pos, vel, srcPos, srcVel, srcMass, eps0, r0):
+    ''' Computes the jerks (time derivatives of the softened accelerations) induced on a block of targets by a block of sources, 
+    summed over the sources.
+
+    Args:
+        pos (array): Target positions, shape (T,3)
+        vel (array): Target velocities, shape (T,3)
+        srcPos (array): Source positions, shape (S,3)
+        srcVel (array): Source velocities, shape (S,3)
+        srcMass (array): Source masses, shape (S,)
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+
+    Returns:
+        array: Total jerk on each target, shape (T,3)
+    '''
+
+    disp = srcPos[None,:,:] - pos[:,None,:]
+    dvel = srcVel[None,:,:] - vel[:,None,:]
+    return soft.softenedJerk(disp, dvel, srcMass[None,:], eps0, r0).sum(axis=1)
             
 
 def main():
@@ -0,0 +1,359 @@
+import numpy as np
+import NBodyBuilder.ParticleSet as ps
+import NBodyBuilder.Octree as octree
+import NBodyBuilder.Softening as soft
+import NBodyBuilder.BH as bh
+
+class Expansion(object):
+    ''' Cartesian Taylor expansions of the 1/r potential up to a given order, as used by the FMM solver. A multipole expansion about
+    a center z holds the moments M_a = sum_j m_j (y_j - z)^a over multi-indices a = (a_x, a_y, a_z); a local expansion about c holds
+    coefficients L_b such that sum_j m_j / |x - y_j| = sum_b L_b (x - c)^b near c. Every translation operator is a fixed, sparse
+    bilinear map between two coefficient arrays, so it is tabulated once per order and applied to many nodes at a time as
+    gather-multiply-matmul.
+
+    Args:
+        order (integer): Expansion order p (multi-indices with |a| <= p are kept)
+    '''
+
+    def __init__(self, order):
+        self.order = order
+        self.indices = [(a, b, n - a - b) for n in range(order + 1) for a in range(n, -1, -1) for b in range(n - a, -1, -1)]
+        self.lookup = {alpha: i for i, alpha in enumerate(self.indices)}
+        self.exponents = np.array(self.indices)
+        self.size = len(self.indices)
+        self.sign = (-1.) ** self.exponents.sum(axis=1)
+
+        m2m, m2l, l2l, l2p = [], [], [], []
+        for i, alpha in enumerate(self.indices):
+            for j, beta in enumerate(self.indices):
+                if (all(b <= a for a, b in zip(alpha, beta))):
+                    # M2M: M_a(parent) += C(a, b) d^(a - b) M_b(child); L2L: L_b(child) += C(a, b) d^(a - b) L_a(parent)
+                    diff = self.lookup[tuple(a - b for a, b in zip(alpha, beta))]
+                    m2m.append((diff, j, binomial(alpha, beta), i))
+                    l2l.append((diff, i, binomial(alpha, beta), j))
+                if ((sum(alpha) + sum(beta) <= order) and (sum(alpha) != 1)):
+                    # M2L: L_b += (-1)^|a| C(a + b, a) D^(a + b)(R) M_a (dipole moments about the center of mass vanish)
+                    gamma = self.lookup[tuple(a + b for a, b in zip(alpha, beta))]
+                    m2l.append((gamma, i, (-1)**sum(alpha) * binomial(tuple(a + b for a, b in zip(alpha, beta)), alpha), j))
+            for k in range(3):
+                if (alpha[k] > 0):
+                    # L2P: a_k = sum_b b_k L_b t^(b - e_k)
+                    lowered = list(alpha)
+                    lowered[k] -= 1
+                    l2p.append((self.lookup[tuple(lowered)], i, alpha[k], k))
+
+        self.m2mTable = self.table(m2m, self.size)
+        self.m2lTable = self.table(m2l, self.size)
+        self.l2lTable = self.table(l2l, self.size)
+        self.l2pTable = self.table(l2p, 3)
+
+    @staticmethod
+    def table(terms, numOut):
+        ''' Packs the terms (x index, y index, coefficient, output index) of a bilinear map into gather indices and a selector matrix.
+
+        Args:
+            terms (list): Terms of the map
+            numOut (integer): Number of output coefficients
+
+        Returns:
+            tuple: x indices, y indices, coefficients and the (terms x outputs) selector matrix
+        '''
+
+        xi, yi, coef, out = (np.array(c) for c in zip(*terms))
+        select = np.zeros((len(terms), numOut))
+        select[np.arange(len(terms)), out] = 1.
+        return xi, yi, coef.astype(float), select
+
+    @staticmethod
+    def apply(table, x, y):
+        ''' Evaluates a tabulated bilinear map for a batch of K coefficient arrays.
+
+        Args:
+            table (tuple): Table built by Expansion.table
+            x (array): First operand, shape (K, ...)
+            y (array): Second operand, shape (K, ...)
+
+        Returns:
+            array: Output coefficients, shape (K, numOut)
+        '''
+
+        xi, yi, coef, select = table
+        return (x[:,xi] * y[:,yi] * coef) @ select
+
+    def powers(self, v):
+        ''' Monomials v^a for every multi-index a of the expansion.
+
+        Args:
+            v (array): Vectors, shape (K,3)
+
+        Returns:
+            array: Monomials, shape (K, size)
+        '''
+
+        p = v[:,:,None] ** np.arange(self.order + 1)
+        return p[:,0,self.exponents[:,0]] * p[:,1,self.exponents[:,1]] * p[:,2,self.exponents[:,2]]
+
+    def derivatives(self, R):
+        ''' Taylor coefficients D^g(R) = (d/dR)^g (1/|R|) / g! for every multi-index g of the expansion, from the recurrence
+        n |R|^2 D^g = -(2n - 1) sum_i R_i D^(g - e_i) - (n - 1) sum_i D^(g - 2 e_i), with n = |g|.
+
+        Args:
+            R (array): Separation vectors, shape (K,3)
+
+        Returns:
+            array: Coefficients, shape (K, size)
+        '''
+
+        r2 = np.einsum('ki,ki->k', R, R)
+        D = np.empty((R.shape[0], self.size))
+        D[:,0] = 1. / np.sqrt(r2)
+
+        for i in range(1, self.size):
+            g = self.indices[i]
+            n = sum(g)
+            acc = np.zeros(R.shape[0])
+            for k in range(3):
+                if (g[k] >= 1):
+                    lowered = list(g)
+                    lowered[k] -= 1
+                    acc -= (2 * n - 1) * R[:,k] * D[:,self.lookup[tuple(lowered)]]
+                if (g[k] >= 2):
+                    lowered[k] -= 1
+                    acc -= (n - 1) * D[:,self.lookup[tuple(lowered)]]
+            D[:,i] = acc / (n * r2)
+
+        return D
+
+def binomial(alpha, beta):
+    ''' Multi-index binomial coefficient C(alpha, beta) = prod_i C(alpha_i, beta_i).
+
+    Args:
+        alpha (tuple): Multi-index
+        beta (tuple): Multi-index with beta <= alpha componentwise
+
+    Returns:
+        integer: Binomial coefficient
+    '''
+
+    c = 1
+    for a, b in zip(alpha, beta):
+        for k in range(b):
+            c = c * (a - k) // (k + 1)
+    return c
+
+class FMM(object):
+    ''' The FMM class implements the fast multipole method. It uses the same linear Octree as BH, but interacts cells with cells: a
+    dual-tree traversal finds pairs of well-separated nodes, whose interaction is a multipole-to-local (M2L) translation, and pairs
+    of nearby leaves, which are summed directly with the softened pair law. Local expansions are then pushed down the tree (L2L) and
+    evaluated at the particles (L2P). The cost is O(N) for a fixed opening angle and expansion order.
+
+    Multipole and local expansions are taken about the nodes' centers of mass, so the dipole terms vanish. The far field is not
+    softened: an accepted pair of nodes only contains particle pairs closer than 2.8*eps0 when the nodes' centers of mass are
+    within 2.8*eps0 / (1 - openAngle), which only happens for very compact, well-populated nodes.
+
+    Args:
+        boxSize (float or integer): Size of simulation box
+        openAngle (float): Two nodes interact through their expansions when the sum of their radii is less than openAngle times
+            the distance between their centers of mass
+        particles (ParticleSet or array): Set of particles (an array of Particles is packed into a ParticleSet)
+        order (integer): Expansion order
+        leafSize (integer): Maximum number of particles in a leaf of the octree
+        chunkSize (integer): Maximum number of node pairs (or, for direct sums, particle pairs / 64) evaluated at once
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+        softeningTable (Softening.KernelTable): If given, the softening kernel of the direct sums is interpolated from this table
+    '''
+
+    # Given the size of the simulation box, the opening angle, and a set of particles, compute the force on each of the particles via the fast multipole method
+    def __init__(self, boxSize, openAngle, particles, order=4, leafSize=16, chunkSize=2048, eps0=0.1, r0=5, softeningTable=None):
+        self.particles = ps.asParticleSet(particles)
+        self.boxSize = boxSize
+        self.openAngle = openAngle
+        self.order = order
+        self.leafSize = leafSize
+        self.chunkSize = chunkSize
+        self.eps0 = eps0
+        self.r0 = r0
+        self.softeningTable = softeningTable
+        self.expansion = Expansion(order)
+
+        self.buildTree()
+        self.tree.sumMultipole(self.particles.pos, self.particles.mass)
+
+    def __repr__(self):
+        return repr(self.tree)
+
+    def buildTree(self):
+        ''' Builds the octree from Morton keys and sorts the particle set into the tree's Z-order, so that every node's particles are
+        a contiguous range of rows.
+        '''
+
+        self.tree = octree.Octree(self.particles.pos, self.boxSize, self.leafSize, build="morton")
+        self.particles.reorder(self.tree.order)
+        self.tree.order = np.arange(self.particles.size)
+
+    def radii(self):
+        ''' Returns, for each node, the radius of a sphere about its center of mass enclosing all of its particles. Leaves measure
+        their particles directly; a parent takes the largest of its children's spheres shifted to its own center of mass.
+
+        Returns:
+            array: Node radii, shape (numNodes,)
+        '''
+
+        tree = self.tree
+        radius = np.zeros(tree.numNodes)
+
+        leaves = np.nonzero(tree.isLeaf)[0]
+        leaves = leaves[np.argsort(tree.start[leaves])]
+        leafOf = np.repeat(leaves, tree.count[leaves])
+        radius[leaves] = np.maximum.reduceat(np.linalg.norm(self.particles.pos - tree.com[leafOf], axis=1), tree.start[leaves])
+
+        for level in reversed(tree.levels()[1:]):
+            parent = tree.parent[level]
+            np.maximum.at(radius, parent, radius[level] + np.linalg.norm(tree.com[level] - tree.com[parent], axis=1))
+
+        return radius
+
+    def upwardPass(self):
+        ''' Computes the multipole moments of every node: P2M in the leaves, then M2M from each level to the one above it.
+
+        Returns:
+            array: Multipole moments, shape (numNodes, size)
+        '''
+
+        tree = self.tree
+        exp = self.expansion
+        pos = self.particles.pos
+        mass = self.particles.mass
+
+        M = np.zeros((tree.numNodes, exp.size))
+        leaves = np.nonzero(tree.isLeaf)[0]
+        leaves = leaves[np.argsort(tree.start[leaves])]
+        leafOf = np.repeat(leaves, tree.count[leaves])
+        M[leaves] = np.add.reduceat(mass[:,None] * exp.powers(pos - tree.com[leafOf]), tree.start[leaves], axis=0)
+
+        for level in reversed(tree.levels()[1:]):
+            parent = tree.parent[level]
+            shift = exp.apply(exp.m2mTable, exp.powers(tree.com[level] - tree.com[parent]), M[level])
+            np.add.at(M, parent, shift)
+
+        return M
+
+    def interactionLists(self):
+        ''' Dual-tree traversal, vectorized over the whole frontier of node pairs. Interactions are mutual, so every unordered pair
+        of nodes is visited at most once. A pair of distinct nodes is accepted for M2L when the sum of their radii is less than 
+        openAngle times the distance between their centers of mass; a pair of leaves that is not accepted is summed directly; 
+        otherwise the node with the larger radius is split. A node paired with itself is split into the unordered pairs of its 
+        children, including each child paired with itself.
+
+        Returns:
+            (4) arrays: the two nodes of each M2L pair, then of each direct (P2P) pair
+        '''
+
+        tree = self.tree
+        radius = self.radii()
+
+        a = np.zeros(1, dtype=int)
+        b = np.zeros(1, dtype=int)
+        m2lA, m2lB, p2pA, p2pB = [], [], [], []
+
+        while (a.size > 0):
+            same = a == b
+            dist = np.linalg.norm(tree.com[a] - tree.com[b], axis=1)
+            accept = ~same & (radius[a] + radius[b] < self.openAngle * dist)
+            direct = ~accept & tree.isLeaf[a] & tree.isLeaf[b]
+
+            m2lA.append(a[accept])
+            m2lB.append(b[accept])
+            p2pA.append(a[direct])
+            p2pB.append(b[direct])
+
+            keep = ~(accept | direct)
+            a, b, same = a[keep], b[keep], same[keep]
+            splitA = same | tree.isLeaf[b] | (~tree.isLeaf[a] & (radius[a] >= radius[b]))
+            splitB = same | ~splitA
+
+            nA = np.where(splitA, tree.numChildren[a], 1)
+            nB = np.where(splitB, tree.numChildren[b], 1)
+            flat, pair = bh.expandRanges(np.zeros_like(nA), nA * nB)
+            i, j = flat // nB[pair], flat % nB[pair]
+            unordered = ~same[pair] | (i <= j)
+            pair, i, j = pair[unordered], i[unordered], j[unordered]
+            a = np.where(splitA[pair], tree.firstChild[a][pair] + i, a[pair])
+            b = np.where(splitB[pair], tree.firstChild[b][pair] + j, b[pair])
+
+        return np.concatenate(m2lA), np.concatenate(m2lB), np.concatenate(p2pA), np.concatenate(p2pB)
+
+    def computeAllAccels(self, active=None):
+        ''' Computes the accelerations of all Particles in the simulation.
+
+        Args:
+            active (array): Particles whose accelerations are needed; the expansions couple all particles, so every acceleration is
+                computed, but only these are stored
+        '''
+
+        tree = self.tree
+        exp = self.expansion
+        pos = self.particles.pos
+        mass = self.particles.mass
+        n = self.particles.size
+
+        M = self.upwardPass()
+        m2lA, m2lB, p2pA, p2pB = self.interactionLists()
+
+        # M2L in both directions, in chunks of node pairs; D(-R) differs from D(R) only by the sign (-1)^|g|
+        L = np.zeros_like(M)
+        for c0 in range(0, m2lA.size, self.chunkSize):
+            a = m2lA[c0:c0 + self.chunkSize]
+            b = m2lB[c0:c0 + self.chunkSize]
+            D = exp.derivatives(tree.com[a] - tree.com[b])
+            np.add.at(L, a, exp.apply(exp.m2lTable, D, M[b]))
+            np.add.at(L, b, exp.apply(exp.m2lTable, D * exp.sign, M[a]))
+
+        # L2L, from the root down
+        for level in tree.levels()[1:]:
+            parent = tree.parent[level]
+            L[level] += exp.apply(exp.l2lTable, exp.powers(tree.com[level] - tree.com[parent]), L[parent])
+
+        # L2P: every particle evaluates the local expansion of its leaf
+        leaves = np.nonzero(tree.isLeaf)[0]
+        leaves = leaves[np.argsort(tree.start[leaves])]
+        leafOf = np.repeat(leaves, tree.count[leaves])
+        accel = exp.apply(exp.l2pTable, exp.powers(pos - tree.com[leafOf]), L[leafOf])
+
+        # P2P, in chunks of particle pairs; a leaf paired with itself covers both orderings of each pair already
+        pairCount = tree.count[p2pA] * tree.count[p2pB]
+        ends = np.cumsum(pairCount)
+        c0 = 0
+        while (c0 < p2pA.size):
+            c1 = max(np.searchsorted(ends, ends[c0] - pairCount[c0] + 64 * self.chunkSize, side="right"), c0 + 1)
+            a, b = p2pA[c0:c1], p2pB[c0:c1]
+            nb = tree.count[b]
+            flat, pair = bh.expandRanges(np.zeros_like(nb), tree.count[a] * nb)
+            i = tree.start[a][pair] + flat // nb[pair]
+            j = tree.start[b][pair] + flat % nb[pair]
+            kernel = soft.softenedAccel(pos[j] - pos[i], 1., self.eps0, self.r0, self.softeningTable)
+            mutual = a[pair] != b[pair]
+            for k in range(3):
+                accel[:,k] += np.bincount(i, weights=mass[j] * kernel[:,k], minlength=n)
+                accel[:,k] -= np.bincount(j[mutual], weights=mass[i[mutual]] * kernel[mutual,k], minlength=n)
+            c0 = c1
+
+        if (active is None):
+            self.particles.accel[:] = accel
+        else:
+            self.particles.accel[active] = accel[active]
+
+def main():
+    #### !!!! TEST !!!! ####
+
+    generator = np.random.default_rng(12345)
+    particles = ps.ParticleSet(generator.random(2000), 10 * generator.standard_normal((2000, 3)))
+
+    fmm = FMM(50, 0.5, particles, order=4)
+    fmm.computeAllAccels()
+    print(particles[0])
+    print(particles[1])
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+import argparse
+import json
+import os
+import sys
 import numpy as np
 import NBodyBuilder.NBodyBuilderClass as nb
 
-def driver(numParticles,ic,gravity,integrator,time,dt):
+def driver(numParticles,ic,gravity,integrator,time,dt,outFile=None,mode='scatter',**options):
     """Run NBodyBuilder
 
     Runs NBodyBuilder and animates results
@@ -14,13 +16,209 @@ def driver(numParticles,ic,gravity,integrator,time,dt):
         gravity (str): name of gravity solver
         integrator (str): name of integration method
         time (float): total time to run simulation
-        df (float): time step for integrator
+        dt (float): time step for integrator
+        outFile (str): if given, render the animation to this video or image-sequence file instead of showing it (see render)
+        mode (str): 'scatter' to draw the particles, 'density' to draw projected density maps
+        options: options of the mode (maxParticles, limits, axis, bins, log, ...; see setup_scatter and setup_density)
     """
-    data = nb.NBodyBuilderClass(numParticles,ic,gravity,integrator,time,dt).history
-    times = np.arange(0,time+dt,dt)
-    scatter_plot_2d(data,times)
+    sim = nb.NBodyBuilderClass(numParticles,ic,gravity,integrator,time,dt)
+    if outFile is None:
+        animate_2d(sim.history,sim.times,mode=mode,**options)
+    else:
+        render(sim.history,sim.times,outFile,mode=mode,**options)
 
-def scatter_plot_2d(data,time):
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+def projection(axis):
+    """Projection axes
+
+    Returns the two coordinates kept when projecting along an axis, in right-handed order (x-y along z, y-z along x, z-x along y).
+
+    Args:
+        axis (str or int): axis projected out, 'x', 'y' or 'z' (or 0, 1, 2)
+
+    Returns:
+        tuple: indices (0-2) of the horizontal and vertical coordinates, and their names
+    """
+    k = AXES.get(axis, axis)
+    i, j = (k + 1) % 3, (k + 2) % 3
+    return i, j, 'xyz'[i], 'xyz'[j]
+
+def decimate(numParticles,maxParticles,seed=0):
+    """Particle decimation
+
+    Picks the particles drawn by the animations: all of them up to maxParticles, or else a random subset of maxParticles. The same
+    subset is used for every frame, so the particles drawn keep their identity through the animation.
+
+    Args:
+        numParticles (int): number of particles in the history
+        maxParticles (int): largest number of particles drawn (None draws all of them)
+        seed (int): random seed of the subset
+
+    Returns:
+        array: sorted indices of the particles to draw
+    """
+    if maxParticles is None or numParticles <= maxParticles:
+        return np.arange(numParticles)
+    return np.sort(np.random.default_rng(seed).choice(numParticles,maxParticles,replace=False))
+
+def setup_scatter(fig,data,time,maxParticles=5000,limits=(-100,100),axis='z',markerSize=None):
+    """Scatter plot setup
+
+    Creates the axes and artists of the animated scatter plot once, and returns the function that moves them to a frame. Frames
+    only update the positions of the scatter artist (set_offsets) and the time label, which is drawn inside the axes so that
+    blitting redraws it.
+
+    Args:
+        fig (Figure): figure to draw in
+        data (array): 3D array containing time slices on the first axis, particles on the second axis, and [mass, x-position, y-position, z-position] on the third axis
+        time (array): 1D array of time values
+        maxParticles (int): largest number of particles drawn (see decimate)
+        limits (tuple): lower and upper limit of both axes
+        axis (str): axis along which the particles are projected (see projection)
+        markerSize (float): marker area in points^2 (by default 25, or 4 when more than 1000 particles are drawn)
+
+    Returns:
+        function: update(i) draws frame i and returns the artists it changed
+    """
+    shown = decimate(data.shape[1],maxParticles)
+    if markerSize is None:
+        markerSize = 25 if shown.size <= 1000 else 4
+    i, j, xlabel, ylabel = projection(axis)
+    columns = [1 + i, 1 + j]
+
+    ax = fig.add_subplot(111, aspect='equal', autoscale_on=False, xlim=limits, ylim=limits)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if shown.size < data.shape[1]:
+        ax.set_title('{} of {} particles'.format(shown.size,data.shape[1]))
+    scatter = ax.scatter(data[0,shown,1 + i], data[0,shown,1 + j], s=markerSize, marker="o", edgecolor='black' if shown.size <= 1000 else 'none')
+    label = ax.text(0.02, 0.97, '', transform=ax.transAxes, va='top', bbox=dict(facecolor='white', alpha=0.7, edgecolor='none'))
+
+    def update(i):
+        scatter.set_offsets(np.asarray(data[i,shown][:,columns]))
+        label.set_text('t = {:.3f}'.format(time[i]))
+        return scatter, label
+
+    return update
+
+def density_map(frame,axis='z',bins=256,limits=(-100,100),method='CIC'):
+    """Projected density map
+
+    Deposits the masses of one frame on a bins x bins grid covering limits x limits in the projected plane, and returns the
+    surface density (mass per unit area) of each pixel. With 'CIC' each particle is spread over the four nearest pixel centers
+    with bilinear weights (a smoother, SPH-like deposit); with 'NGP' it falls entirely in its pixel (a mass-weighted 2D histogram).
+    Particles outside the image are dropped. The deposit is a single bincount over all particles.
+
+    Args:
+        frame (array): 2D array with particles on the first axis and [mass, x-position, y-position, z-position] on the second axis
+        axis (str): axis along which the masses are projected (see projection)
+        bins (int): number of pixels along each side
+        limits (tuple): lower and upper limit of both image axes
+        method (str): 'CIC' or 'NGP'
+
+    Returns:
+        array: surface density, shape (bins,bins), with rows along the vertical axis of the image
+    """
+    i, j = projection(axis)[:2]
+    lo, hi = limits
+    h = (hi - lo) / bins
+    u = (frame[:,1 + i] - lo) / h
+    v = (frame[:,1 + j] - lo) / h
+    m = frame[:,0]
+
+    # the particles are binned on a grid with one extra pixel on each side, so that no CIC corner needs its own bounds test
+    n = bins + 2
+    if method == 'NGP':
+        iu = np.floor(u)
+        iv = np.floor(v)
+        keep = (iu >= 0) & (iu < bins) & (iv >= 0) & (iv < bins)
+        flat = ((iv[keep] + 1) * n + iu[keep] + 1).astype(int)
+        image = np.bincount(flat, weights=m[keep], minlength=n * n)
+    else:
+        u0 = np.floor(u - 0.5)
+        v0 = np.floor(v - 0.5)
+        keep = (u0 >= -1) & (u0 < bins) & (v0 >= -1) & (v0 < bins)
+        fu = (u - 0.5 - u0)[keep]
+        fv = (v - 0.5 - v0)[keep]
+        mk = m[keep]
+        flat = ((v0[keep] + 1) * n + u0[keep] + 1).astype(int)
+        image = np.zeros(n * n)
+        for offset, w in ((0, (1 - fu) * (1 - fv)), (1, fu * (1 - fv)), (n, (1 - fu) * fv), (n + 1, fu * fv)):
+            image += np.bincount(flat + offset, weights=mk * w, minlength=n * n)
+    image = image.reshape(n,n)[1:-1,1:-1]
+    return image / h**2
+
+def setup_density(fig,data,time,axis='z',bins=256,limits=(-100,100),log=True,method='CIC',dynamicRange=1e4):
+    """Density map setup
+
+    Creates the axes, the image and its color bar once, and returns the function that moves them to a frame. Frames replace the
+    pixels of the image (set_data), so drawing costs the same for any number of particles. The color scale is fixed by the first
+    frame: its peak density is the top of the scale, and with log scaling the bottom is dynamicRange times lower (emptier pixels
+    take the lowest color).
+
+    Args:
+        fig (Figure): figure to draw in
+        data (array): 3D array containing time slices on the first axis, particles on the second axis, and [mass, x-position, y-position, z-position] on the third axis
+        time (array): 1D array of time values
+        axis (str): axis along which the masses are projected (see projection)
+        bins (int): number of pixels along each side
+        limits (tuple): lower and upper limit of both image axes
+        log (bool): logarithmic color scale
+        method (str): deposit, 'CIC' or 'NGP' (see density_map)
+        dynamicRange (float): ratio of the top to the bottom of a logarithmic color scale
+
+    Returns:
+        function: update(i) draws frame i and returns the artists it changed
+    """
+    from matplotlib.colors import LogNorm, Normalize
+
+    xlabel, ylabel = projection(axis)[2:]
+    first = density_map(np.asarray(data[0]),axis,bins,limits,method)
+    vmax = first.max() if first.max() > 0 else 1.
+    norm = LogNorm(vmin=vmax / dynamicRange, vmax=vmax) if log else Normalize(vmin=0, vmax=vmax)
+
+    def pixels(i):
+        image = density_map(np.asarray(data[i]),axis,bins,limits,method)
+        return np.maximum(image, norm.vmin) if log else image
+
+    ax = fig.add_subplot(111)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    image = ax.imshow(pixels(0), origin='lower', extent=(limits[0], limits[1], limits[0], limits[1]), norm=norm, cmap='inferno',
+                      interpolation='nearest')
+    fig.colorbar(image, ax=ax, label='surface density')
+    label = ax.text(0.02, 0.97, '', transform=ax.transAxes, va='top', color='white')
+
+    def update(i):
+        image.set_data(pixels(i))
+        label.set_text('t = {:.3f}'.format(time[i]))
+        return image, label
+
+    return update
+
+def setup_frames(fig,data,time,mode='scatter',**options):
+    """Animation setup
+
+    Sets up the animation of one of the modes in a figure.
+
+    Args:
+        fig (Figure): figure to draw in
+        data (array): 3D array containing time slices on the first axis, particles on the second axis, and [mass, x-position, y-position, z-position] on the third axis
+        time (array): 1D array of time values
+        mode (str): 'scatter' or 'density'
+        options: options of the mode (see setup_scatter and setup_density)
+
+    Returns:
+        function: update(i) draws frame i and returns the artists it changed
+    """
+    if mode == 'density':
+        return setup_density(fig,data,time,**options)
+    if mode == 'scatter':
+        return setup_scatter(fig,data,time,**options)
+    raise ValueError("unknown mode {}: use 'scatter' or 'density'".format(mode))
+
+def scatter_plot_2d(data,time,maxParticles=5000,limits=(-100,100),interval=100,axis='z'):
     """Animated scatter plot
 
     Animates data in scatter plot over time.
@@ -28,24 +226,115 @@ def scatter_plot_2d(data,time):
     Args:
         data (array): 3D array containing time slices on the first axis, particles on the second axis, and [mass, x-position, y-position, z-position] on the third axis
         time (array): 1D array of time values
+        maxParticles (int): largest number of particles drawn (see decimate)
+        limits (tuple): lower and upper limit of both axes
+        interval (int): delay between frames in milliseconds
+        axis (str): axis along which the particles are projected (see projection)
+    """
+    return animate_2d(data,time,interval,'scatter',maxParticles=maxParticles,limits=limits,axis=axis)
+
+def density_plot_2d(data,time,axis='z',bins=256,limits=(-100,100),log=True,interval=100):
+    """Animated density map
+
+    Animates the mass-weighted projected density of data over time (see density_map).
+
+    Args:
+        data (array): 3D array containing time slices on the first axis, particles on the second axis, and [mass, x-position, y-position, z-position] on the third axis
+        time (array): 1D array of time values
+        axis (str): axis along which the masses are projected (see projection)
+        bins (int): number of pixels along each side
+        limits (tuple): lower and upper limit of both image axes
+        log (bool): logarithmic color scale
+        interval (int): delay between frames in milliseconds
     """
+    return animate_2d(data,time,interval,'density',axis=axis,bins=bins,limits=limits,log=log)
+
+def animate_2d(data,time,interval=100,mode='scatter',**options):
+    """Animation
+
+    Animates data in a window, with blitting: the axes are drawn once and each frame only redraws the artists that change.
+
+    Args:
+        data (array): 3D array containing time slices on the first axis, particles on the second axis, and [mass, x-position, y-position, z-position] on the third axis
+        time (array): 1D array of time values
+        interval (int): delay between frames in milliseconds
+        mode (str): 'scatter' or 'density'
+        options: options of the mode (see setup_scatter and setup_density)
+    """
+    # matplotlib is imported here rather than with the module, so that runs without a display never load it
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
 
     plt.rcParams["figure.figsize"] = [7.50, 3.50]
     plt.rcParams["figure.autolayout"] = True
 
-    fig, ax = plt.subplots()
-
-    def animate(i):
-        fig.clear()
-        ax = fig.add_subplot(111, aspect='equal', autoscale_on=False, xlim=(0, 1), ylim=(0, 1))
-        ax.set_xlim(-100, 100)
-        ax.set_ylim(-100, 100)
-        ax.set_xlabel('x')
-        ax.set_ylabel('y')
-        ax.set_title('t = {:.3f}'.format(time[i]))
-        s = ax.scatter(data[i,:,1], data[i,:,2], s=25, marker="o", edgecolor='black')
+    fig = plt.figure()
+    update = setup_frames(fig,data,time,mode,**options)
 
-    ani = animation.FuncAnimation(fig, animate, interval=100, frames=range(len(data)),repeat_delay = 3000)
-    fig.tight_layout()
+    ani = animation.FuncAnimation(fig, update, interval=interval, frames=range(len(data)), blit=True, repeat_delay=3000)
     plt.show()
+    return ani
+
+def render(data,time,outFile,fps=10,dpi=100,mode='scatter',**options):
+    """Offline rendering
+
+    Renders the animation to a file without opening a window. A file name with a '{}' field (such as 'frame{:04d}.png')
+    receives one image per frame; any other name is written as a video, with Pillow for .gif files and ffmpeg otherwise.
+
+    Args:
+        data (array): 3D array containing time slices on the first axis, particles on the second axis, and [mass, x-position, y-position, z-position] on the third axis
+        time (array): 1D array of time values
+        outFile (str): video file, or pattern of the image files
+        fps (int): frames per second of the video
+        dpi (int): resolution of the frames
+        mode (str): 'scatter' or 'density'
+        options: options of the mode (maxParticles, limits, axis, bins, log, ...; see setup_scatter and setup_density)
+    """
+    # a bare Figure (rather than pyplot) is never attached to a window or an interactive backend
+    from matplotlib.figure import Figure
+    import matplotlib.animation as animation
+
+    fig = Figure(figsize=(7.50, 3.50), tight_layout=True)
+    update = setup_frames(fig,data,time,mode,**options)
+
+    if '{' in outFile:
+        for i in range(len(data)):
+            update(i)
+            fig.savefig(outFile.format(i), dpi=dpi)
+    else:
+        writer = "pillow" if outFile.lower().endswith(".gif") else "ffmpeg"
+        ani = animation.FuncAnimation(fig, update, frames=range(len(data)))
+        ani.save(outFile, writer=writer, fps=fps, dpi=dpi)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m NBodyBuilder.Grapher", description="Render the history of a run (such as the history.npy written by python -m NBodyBuilder) to a video or to images, without a display.")
+    parser.add_argument("history", help="history file (.npy)")
+    parser.add_argument("--out", default="movie.mp4", help="video file, or image pattern such as 'frame{:04d}.png' (default: movie.mp4)")
+    parser.add_argument("--times", help="run.json holding the output times (default: the run.json next to the history, if any)")
+    parser.add_argument("--mode", choices=["scatter", "density"], default="scatter", help="draw particles or projected density maps (default: scatter)")
+    parser.add_argument("--axis", choices=["x", "y", "z"], default="z", help="projection axis (default: z)")
+    parser.add_argument("--maxParticles", type=int, default=5000, help="scatter: largest number of particles drawn (default: 5000)")
+    parser.add_argument("--bins", type=int, default=256, help="density: pixels along each side (default: 256)")
+    parser.add_argument("--linear", action="store_true", help="density: linear instead of logarithmic color scale")
+    parser.add_argument("--limits", type=float, nargs=2, default=[-100, 100], help="axis limits (default: -100 100)")
+    parser.add_argument("--fps", type=int, default=10, help="frames per second of a video (default: 10)")
+    parser.add_argument("--dpi", type=int, default=100, help="resolution (default: 100)")
+    args = parser.parse_args(argv)
+
+    data = np.load(args.history, mmap_mode="r")
+    timesFile = args.times or os.path.join(os.path.dirname(args.history), "run.json")
+    if os.path.isfile(timesFile):
+        with open(timesFile) as f:
+            time = np.array(json.load(f)["times"])
+    else:
+        time = np.arange(len(data), dtype=float)
+
+    if args.mode == 'density':
+        options = dict(bins=args.bins, log=not args.linear)
+    else:
+        options = dict(maxParticles=args.maxParticles)
+    render(data,time,args.out,args.fps,args.dpi,args.mode,axis=args.axis,limits=tuple(args.limits),**options)
+    print("rendered {} frames to {}".format(len(data),args.out))
 
+if __name__ == "__main__":
+    main(sys.argv[1:])
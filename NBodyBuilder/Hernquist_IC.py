@@ -1,120 +1,223 @@
 import numpy as np
-from numpy import random
-import NBodyBuilder.Particle as part
+import NBodyBuilder.ParticleSet as ps
 
 class Hernquist(object):
     """ Hernquist class
-    Randomly draw intial conditions of particles from Hernquist distribution.
+    Randomly draw intial conditions of particles from Hernquist distribution. All particles are drawn at once: radii from the inverse
+    of the cumulative mass profile, isotropic directions, and speeds from the isotropic distribution function of the model (Hernquist
+    1990), so the halo starts in equilibrium. Units have G = 1, as in the force law of the solvers.
 
     Args:
+        numParticles (integer): Number of particles, of mass M / numParticles each
         a (float): Scale radius (See Binney and Tremaine Eqn. 2.66)
         M (float): Total mass
+        rng (Generator or integer): NumPy random Generator, or a seed for a new one (None seeds from the operating system)
     """
 
-    def __init__(self, numParticles, a, M):
+    def __init__(self, numParticles, a, M, rng=None):
         self.a = a
-        self.M = numParticles
+        self.M = M
         self.numParticles = numParticles
-        
+        self.rng = np.random.default_rng(rng)
+
         self.particles = self.generateHernquist()
-        
+
     def __repr__(self):
-        
+
         s = ""
         for p in self.particles:
             s += "{} \n\n".format(p)
-            
+
         return s
-        
-    
+
+
     def cumHern(self, y):
         """Cumulative distribution function for the Hernquist distribution, where y = 4pi/3 * r^3 = volume
-        
-        Agrs: 
-            y ():
-        
+
+        Agrs:
+            y (array): Volumes of the spheres
+
         Returns:
-            array: Cumulative distribution function for the Hernquist distribution
+            array: Mass enclosed in each sphere
         """
-        
+
         return  self.M * np.power(3*y/(4*np.pi), 2./3) * np.power(self.a + np.power(3*y/(4*np.pi), 1./3), -2)
-    
+
     def invHern(self, x):
         """ Inverse of the cumulative distribution function for the Hernquist distribution.
-        
-        Agrs: 
-            x ():
-        
+
+        Agrs:
+            x (array): Enclosed masses, 0 <= x < M
+
         Returns:
-            array: Inverse of the cumulative distribution function
+            array: Volumes of the spheres enclosing them
         """
 
-        return 4*np.pi/3. * np.power(self.a,3) *np.power(x,1.5) * np.power(np.power(self.M,1./3) - np.power(x,0.5), -3)
-    
-    def sampleRadius(self):
-        """ Draw a random radius from the Hernquist distribution.
-        
+        return 4*np.pi/3. * np.power(self.a,3) *np.power(x,1.5) * np.power(np.power(self.M,0.5) - np.power(x,0.5), -3)
+
+    def sampleRadius(self, size=None):
+        """ Draw random radii from the Hernquist distribution.
+
+        Args:
+            size (integer): Number of radii; None for a single one
+
         Returns:
-            array(?): 
+            array: Radii, shape (size,) (a float if size is None)
         """
 
-        randX = random.rand()
+        randX = self.M * self.rng.random(size)
         y = self.invHern(randX)
-        
+
         return np.power(3*y/(4*np.pi), 1./3)
-    
-    def samplePointSphere(self):
-        """ Draw a random point (in spherical coordinates) from the Hernquist distribution.
-        
+
+    def samplePointSphere(self, size=None):
+        """ Draw random points (in spherical coordinates) from the Hernquist distribution. The directions are isotropic, so cos(theta)
+        rather than theta is uniform.
+
+        Args:
+            size (integer): Number of points; None for a single one
+
         Returns:
-            (3) arrays: randR (), randPhi (), randTheta ()
+            (3) arrays: randR (radii), randPhi (azimuths), randTheta (polar angles)
         """
 
-        randR = self.sampleRadius()
-        randPhi = 2*np.pi * random.rand() 
-        randTheta = np.pi * random.rand()
+        randR = self.sampleRadius(size)
+        randPhi = 2*np.pi * self.rng.random(size)
+        randTheta = np.arccos(1 - 2*self.rng.random(size))
         return randR, randPhi, randTheta
 
-    def samplePointCart(self):
-        """ Draw a random point (in Cartesian coordinates) from the Hernquist distribution.
-        
+    def samplePointCart(self, size=None):
+        """ Draw random points (in Cartesian coordinates) from the Hernquist distribution.
+
+        Args:
+            size (integer): Number of points; None for a single one
+
         Returns:
-            (3) arrays: x (array of x-positions), y (array of y-positions), z (array of z-positions)
+            array: Positions, shape (size,3) (shape (3,) if size is None)
         """
 
-        randPointSphere = self.samplePointSphere()
-        r = randPointSphere[0]
-        phi = randPointSphere[1]
-        theta = randPointSphere[2]
-        
+        r, phi, theta = self.samplePointSphere(size)
+
         x = r * np.sin(theta) * np.cos(phi)
         y = r * np.sin(theta) * np.sin(phi)
         z = r * np.cos(theta)
-        
-        return np.array([x, y, z])
 
-    def generateHernquist(self):
-        """ Sample numParticles Particles from a Hernquist distribution.
+        return np.stack([x, y, z], axis=-1)
+
+    def potential(self, r):
+        """ Relative potential Psi(r) = GM / (r + a) of the Hernquist model (G = 1).
+
+        Args:
+            r (array): Radii
+
+        Returns:
+            array: Relative potential, same shape as r
+        """
+
+        return self.M / (r + self.a)
+
+    def sampleSpeed(self, r):
+        """ Draw speeds at the given radii from the isotropic distribution function f(E) of the model. At radius r, the speed
+        v = s * v_esc (v_esc = sqrt(2 Psi)) has density p(s) ~ s^2 F(psi (1 - s^2)), with psi = Psi(r) a / GM and F the dimensionless
+        distribution function (see distributionFunction). The speeds are drawn by rejection, uniformly in s under a per-particle
+        bound looked up from speedBounds; every round redraws only the particles rejected so far.
+
         Args:
-            numParticles (integer): How many particles to draw from the distribution
-            
+            r (array): Radii, shape (K,)
+
         Returns:
-            array: An array of particle positions of length numParticles
+            array: Speeds, shape (K,)
         """
-        #particles = np.zeros(self.numParticles)
-        
-        particles = []
-        for i in range(self.numParticles):
-            particles.append(part.Particle(1, self.samplePointCart()))
-            
-        return np.array(particles)
-    
+
+        psi = np.clip(self.potential(r) * self.a / self.M, 0, 1 - 1e-12)
+        grid, bound = speedBounds()
+
+        # gmax increases with psi, so its value at the grid node above psi bounds the density at psi
+        bound = bound[np.searchsorted(grid, psi)]
+
+        s = np.empty(psi.size)
+        todo = np.arange(psi.size)
+        while (todo.size > 0):
+            trial = self.rng.random(todo.size)
+            accept = self.rng.random(todo.size) * bound[todo] < trial**2 * distributionFunction(psi[todo] * (1 - trial**2))
+            s[todo[accept]] = trial[accept]
+            todo = todo[~accept]
+
+        return s * np.sqrt(2 * self.potential(r))
+
+    def generateHernquist(self):
+        """ Sample numParticles Particles from a Hernquist distribution, with equilibrium velocities (the small net momentum of the
+        sample is removed).
+
+        Returns:
+            ParticleSet: A set of numParticles particles of mass M / numParticles
+        """
+
+        coms = self.samplePointCart(self.numParticles)
+        speed = self.sampleSpeed(np.linalg.norm(coms, axis=1))
+
+        cosTheta = 1 - 2*self.rng.random(self.numParticles)
+        sinTheta = np.sqrt(1 - cosTheta**2)
+        phi = 2*np.pi * self.rng.random(self.numParticles)
+        vels = speed[:,None] * np.stack([sinTheta * np.cos(phi), sinTheta * np.sin(phi), cosTheta], axis=-1)
+        vels -= vels.mean(axis=0)
+
+        return ps.ParticleSet(np.full(self.numParticles, self.M / self.numParticles), coms, vels)
+
+def distributionFunction(q2):
+    """ Dimensionless isotropic distribution function of the Hernquist model (Hernquist 1990, eqn. 17), up to its constant factor
+    M / (8 sqrt(2) pi^3 a^3 v_g^3): F = (3 asin q + q sqrt(1 - q^2) (1 - 2q^2) (8q^4 - 8q^2 - 3)) / (1 - q^2)^(5/2), with
+    q^2 = E a / GM the binding energy in units of GM / a. For small q the bracket cancels to O(q^5) and its series
+    F = 128/5 q^5 (1 + 10/7 q^2) is used instead.
+
+    Args:
+        q2 (array): Binding energies q^2, 0 <= q^2 < 1
+
+    Returns:
+        array: F(q^2), same shape as q2
+    """
+
+    q2 = np.asarray(q2, dtype=float)
+    q = np.sqrt(q2)
+    f = np.empty_like(q2)
+
+    small = q < 0.01
+    f[small] = 128./5 * q[small]**5 * (1 + 10./7 * q2[small])
+
+    qb, q2b = q[~small], q2[~small]
+    bracket = 3 * np.arcsin(qb) + qb * np.sqrt(1 - q2b) * (1 - 2*q2b) * (8*q2b**2 - 8*q2b - 3)
+    f[~small] = bracket / (1 - q2b)**2.5
+
+    return f
+
+_speedBounds = None
+
+def speedBounds():
+    """ Upper bounds of the speed density s^2 F(psi (1 - s^2)) of Hernquist.sampleSpeed over 0 <= s <= 1, tabulated at potentials
+    psi log-spaced from 1e-12 to 1/2 and with 1 - psi log-spaced from 1/2 down to 1e-12 (the density falls like psi^(5/2) far out,
+    and near the center its peak moves towards s = 0 and grows like (1 - psi)^(-3/2), so s is also sampled on a logarithmic grid).
+    The maxima are raised by 2% to cover the discreteness of the s grid. The table is built on first use and cached.
+
+    Returns:
+        (2) arrays: Potentials psi (increasing, from 1e-12 to 1 - 1e-12) and the bound at each of them
+    """
+
+    global _speedBounds
+
+    if (_speedBounds is None):
+        psi = np.append(np.logspace(-12, np.log10(0.5), 256), 1 - np.logspace(np.log10(0.5), -12, 512)[1:])
+        s = np.append(np.logspace(-8, 0, 1024), 0.)
+        g = s**2 * distributionFunction(psi[:,None] * (1 - s**2))
+        _speedBounds = (psi, 1.02 * g.max(axis=1))
+
+    return _speedBounds
+
 def main():
     #### !!!! TEST !!!! ####
-    h = Hernquist(10, 10, 10)
+    h = Hernquist(10, 10, 10, rng=12345)
     print(h)
-    
-    
-    
+
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,6 @@
 import numpy as np
 import numpy.random as rand
-import NBodyBuilder.Particle as part
+import NBodyBuilder.ParticleSet as ps
 import NBodyBuilder.Hernquist_IC as hern
 
 class IC(object):
@@ -22,7 +22,7 @@ class IC(object):
             self.particles = self.randParticles(numParticles, boxSize, seed, twoD)
         
         elif (ic == "hernquist"):
-            self.particles = hern.Hernquist(numParticles, hern_a, hern_m).particles
+            self.particles = hern.Hernquist(numParticles, hern_a, hern_m, rng=seed).particles
             
         else:
             self.particles = self.randParticles(numParticles, boxSize, seed, twoD)
@@ -51,23 +51,18 @@ class IC(object):
             twoD (boolean): True for 2D, false for ?
 
         Returns:
-            particles (list): A list of Particles 'p'
+            particles (ParticleSet): A set of randomly placed particles
         '''
 
-        particles = []
         generator = rand.default_rng(seed)
         randMasses = generator.random(numParticles)
         randCOMS = generator.random((numParticles, 3))
         
-        for i in range(numParticles):
-            mass = 10 * randMasses[i]
-            com = boxSize * randCOMS[i] - boxSize/2.
-            if (twoD): com[2] = 0
+        masses = 10 * randMasses
+        coms = boxSize * randCOMS - boxSize/2.
+        if (twoD): coms[:,2] = 0
             
-            p = part.Particle(mass, com)
-            particles.append(p)
-            
-        return np.array(particles)
+        return ps.ParticleSet(masses, coms)
     
 def main():
     #### !!!! TEST !!!! ####
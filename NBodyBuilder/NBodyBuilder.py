@@ -1,14 +1,15 @@
-import tkinter as tk
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-import NBodyBuilder.Grapher as Grapher
+
+# tkinter, matplotlib and the Grapher are imported by the functions that use them, so that importing this module (or running the
+# headless command line, see Batch) needs no display
 
 def gui():
 	"""GUI
 	
 	Runs NBodyBuilder driver with interactive GUI
 	"""
+	import tkinter as tk
+
 	root = tk.Tk()
 	root.title('NBodyBuilder')
 	#root.iconbitmap("./NBodyBuilder.ico") # Need .ico icon file
@@ -107,6 +108,7 @@ def gui():
 
 	# Make button to plot result
 	def graph():
+		import NBodyBuilder.Grapher as Grapher
 		Grapher.driver(numParticles=N, ic=D, gravity=S, integrator=I, time=T, dt=DT)
 
 	plot = tk.Button(root,text = "Run and Plot", command = graph)
@@ -174,7 +176,7 @@ def non_gui():
 	print("Enter a final time:")
 	while True:
 		T = input()
-		if not T.isnumeric() or float(T)<=0:
+		if not is_positive_number(T):
 			print("Please enter a positive integer or a float")
 		else:
 			break
@@ -182,9 +184,31 @@ def non_gui():
 	print("Enter a time step:")
 	while True:
 		DT = input()
-		if not DT.isnumeric() or float(DT)<=0 or float(DT) > float(T):
+		if not is_positive_number(DT) or float(DT) > float(T):
 			print("Please enter a positive integer or a float that is less than the final time.")
 		else:
 			break
 
-	Grapher.driver(numParticles=int(N), ic=D, gravity=S, integrator=I, time=float(T), dt=float(DT))
\ No newline at end of file
+	names = {'Hernquist': 'hernquist', 'Random': 'random', 'Barnes-Hut': 'BH', 'Direct Force': 'direct',
+	         'Euler': 'euler', 'Euler-Cromer': 'euler_cromer', 'Leapfrog': 'leapfrog'}
+
+	import NBodyBuilder.Grapher as Grapher
+	Grapher.driver(numParticles=int(N), ic=names[D], gravity=names[S], integrator=names[I], time=float(T), dt=float(DT))
+
+
+def is_positive_number(text):
+	"""Positive number check
+
+	Checks whether a text input is a positive integer or float (such as '10', '0.1' or '1e-3')
+
+	Args:
+		text (str): text input
+
+	Returns:
+		bool: True if text is a finite number greater than zero
+	"""
+	try:
+		value = float(text)
+	except ValueError:
+		return False
+	return bool(np.isfinite(value)) and value > 0
@@ -8,7 +8,12 @@ import NBodyBuilder.Particle as part
 
 class NBodyBuilderClass(object):
     
-    def __init__(self, numParticles, ic, gravity, integrator, time, dt):
+    # Record a frame every outputEvery steps of dt; with a historyFile (.npy), frames are streamed to disk and history is a memory map of the file;
+    # with a checkpointFile, the state of the run is saved every checkpointEvery frames, and a run given a restartFile resumes from that checkpoint
+    # (its particles and run parameters replace numParticles, ic, gravity, integrator, time and dt);
+    # seed seeds the initial conditions, and other keyword arguments (eps0, openAngle, workers, diagnostics, stats, ...) are passed on to TimeStepper
+    def __init__(self, numParticles, ic, gravity, integrator, time, dt, outputEvery=1, historyFile=None, checkpointFile=None, checkpointEvery=1,
+                 restartFile=None, seed=12345, **options):
         self.numParticles = numParticles
         self.ic = ic
         self.gravity = gravity
@@ -16,14 +21,30 @@ class NBodyBuilderClass(object):
         self.time = time
         self.dt = dt
         
-        self.particles = IC.IC(numParticles, ic).particles
-        self.history = TimeStepper.TimeStepper(self.particles, time, dt, integrator, gravity).history
+        if (restartFile is not None):
+            stepper = TimeStepper.restart(restartFile, historyFile=historyFile, checkpointFile=checkpointFile, checkpointEvery=checkpointEvery,
+                                           **options)
+            self.particles = stepper.particles
+            self.numParticles = stepper.particles.size
+            self.gravity = stepper.gravity
+            self.integrator = stepper.integrator
+            self.time = stepper.time
+            self.dt = stepper.dt
+        else:
+            self.particles = IC.IC(numParticles, ic, seed=seed).particles
+            stepper = TimeStepper.TimeStepper(self.particles, time, dt, integrator, gravity, outputEvery=outputEvery, historyFile=historyFile,
+                                              checkpointFile=checkpointFile, checkpointEvery=checkpointEvery, **options)
+        self.parameters = stepper.parameters()
+        self.history = stepper.history
+        self.times = stepper.outputTimes
+        self.numSteps = stepper.numSteps
+        self.numForces = stepper.numForces
     
     # Display the 3D array containing the history of the particle positions 
     def __repr__(self):
         s = "\n Displaying [mass, x, y, z] for each particle for each time step: \n\n"
         for t in range(self.history.shape[0]):
-            s += "time: {:.2f}, particles: {} \n\n".format(self.dt * t, self.history[t])
+            s += "time: {:.2f}, particles: {} \n\n".format(self.times[t], self.history[t])
             
         return s
     
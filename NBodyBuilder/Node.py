@@ -10,6 +10,7 @@ class Node(object):
     def __init__(self, children, multipole, sideLength, cellCenter):
         self.children = children
         self.multipole = multipole
+        self.quadrupole = np.zeros((3, 3))  # traceless quadrupole tensor about the multipole's center of mass
         self.sideLength = sideLength
         self.cellCenter = cellCenter
         
@@ -132,6 +133,8 @@ class Node(object):
         
     def sumMultipole(self):
         ''' Recursively traverse the tree from the leaves up to the root, appropriately updating the multipoles in each of the Nodes.
+        Besides the mass and center of mass, each Node accumulates the traceless quadrupole tensor Q_ij = sum m (3 x_i x_j - r^2 delta_ij) 
+        of its particles about its center of mass, by shifting each child's quadrupole to the new center.
         
         Returns:
             ?: ?
@@ -147,6 +150,13 @@ class Node(object):
                 newMultipole.combine(c.sumMultipole())
       
         self.multipole = newMultipole
+        
+        self.quadrupole = np.zeros((3, 3))
+        for c in self.children:
+            if (c != 0):
+                d = c.multipole.com - newMultipole.com
+                self.quadrupole += c.quadrupole + c.multipole.mass * (3 * np.outer(d, d) - np.dot(d, d) * np.eye(3))
+        
         return self.multipole
             
         
@@ -182,6 +192,7 @@ def main():
     print(n1.multipole)
     print(n2.multipole)
     print(n3.multipole)
+    print(n1.quadrupole)
     
     
 if __name__ == "__main__":
@@ -0,0 +1,405 @@
+import numpy as np
+
+class Octree(object):
+    ''' Linear octree used by the Barnes-Hut solver. Instead of a graph of Node objects, the tree is a set of parallel NumPy arrays
+    indexed by node number: enclosed mass, center of mass, cell center, side length, depth, parent, first child and next sibling.
+    Node 0 is the root. Nodes are numbered breadth-first and the children of a node are stored contiguously, so every level of the
+    tree is a contiguous block of nodes and each node covers a contiguous range of the particle permutation 'order'.
+    Both the build and the multipole summation (see sumMultipole) are iterative, so there is no recursion-depth limit.
+    Once built, the tree can follow moving particles without being rebuilt: refit keeps its topology and recomputes the bounds and
+    moments of every node from the new positions.
+
+    The tree can be built in two ways. "partition" splits one node at a time, top-down. "morton" sorts the particles by Morton 
+    (Z-order) key and derives every level of the tree at once from the shared key prefixes; it is the faster of the two, and its 
+    'order' is the Z-order of the particles.
+
+    Args:
+        pos (array): Particle positions, shape (N,3)
+        boxSize (float or integer): Side length of the root cell, centered on the origin (enlarged if particles lie outside it)
+        leafSize (integer): Maximum number of particles in a leaf
+        maxDepth (integer): Depth at which cells stop being subdivided (only reached by coincident particles)
+        build (string): Tree construction method, "partition" or "morton"
+    '''
+
+    def __init__(self, pos, boxSize, leafSize=1, maxDepth=64, build="partition"):
+        self.boxSize = boxSize
+        self.leafSize = leafSize
+        self.maxDepth = maxDepth
+
+        if (build == "morton"):
+            self.buildMorton(pos)
+        else:
+            self.buildTree(pos)
+        
+        self.cellSize = self.size.copy()   # side lengths of the cells as built; refit may enlarge 'size' and move 'center'
+
+    def __repr__(self):
+        ''' Returns a string representation of the octree, one line per level.
+
+        Returns:
+            s (string): Mass, COM and cell center of every node, level by level
+        '''
+
+        s = ""
+        for d in range(self.depth.max() + 1):
+            for n in np.nonzero(self.depth == d)[0]:
+                s += "(mass: {}, COM: {}, center: {})  ".format(self.mass[n], self.com[n], self.center[n])
+            s += "\n"
+        return s
+
+    @property
+    def numNodes(self):
+        ''' Number of nodes in the tree.
+        '''
+
+        return self.size.shape[0]
+
+    def rootSize(self, pos):
+        ''' Returns the side length of the root cell: boxSize, or more if some particles lie outside the box.
+
+        Args:
+            pos (array): Particle positions, shape (N,3)
+
+        Returns:
+            float: Side length of the root cell
+        '''
+
+        extent = 2 * np.abs(pos).max() if pos.size > 0 else 0.
+        return max(float(self.boxSize), extent * (1 + 1e-12))
+
+    def buildTree(self, pos):
+        ''' Assembles the octree top-down. Nodes are processed in breadth-first order; a node holding more than leafSize particles
+        is split by computing the octant of all its particles at once and partitioning its range of 'order' by octant.
+
+        Args:
+            pos (array): Particle positions, shape (N,3)
+        '''
+
+        n = pos.shape[0]
+        self.order = np.arange(n)
+
+        center = [np.zeros(3)]
+        size = [self.rootSize(pos)]
+        depth = [0]
+        parent = [-1]
+        start = [0]
+        count = [n]
+        firstChild = [-1]
+        numChildren = [0]
+
+        # offsets of the 8 octant centers, in units of a quarter of the parent's side length; octant = 4*(x > x0) + 2*(y > y0) + (z > z0)
+        octOffsets = np.array([[(o >> 2) & 1, (o >> 1) & 1, o & 1] for o in range(8)]) * 2. - 1.
+
+        k = 0
+        while (k < len(size)):
+            if ((count[k] > self.leafSize) and (depth[k] < self.maxDepth)):
+                s0 = start[k]
+                idx = self.order[s0:s0 + count[k]]
+                p = pos[idx]
+
+                octant = (4 * (p[:,0] > center[k][0]) + 2 * (p[:,1] > center[k][1]) + (p[:,2] > center[k][2]))
+                self.order[s0:s0 + count[k]] = idx[np.argsort(octant, kind="stable")]
+                octCounts = np.bincount(octant, minlength=8)
+
+                firstChild[k] = len(size)
+                for o in np.nonzero(octCounts)[0]:
+                    center.append(center[k] + octOffsets[o] * size[k] / 4.)
+                    size.append(size[k] / 2.)
+                    depth.append(depth[k] + 1)
+                    parent.append(k)
+                    start.append(s0)
+                    count.append(octCounts[o])
+                    firstChild.append(-1)
+                    numChildren.append(0)
+                    s0 += octCounts[o]
+                numChildren[k] = len(size) - firstChild[k]
+            k += 1
+
+        self.center = np.array(center)
+        self.size = np.array(size)
+        self.depth = np.array(depth)
+        self.parent = np.array(parent)
+        self.start = np.array(start)
+        self.count = np.array(count)
+        self.firstChild = np.array(firstChild)
+        self.numChildren = np.array(numChildren)
+        self.linkTree()
+
+    def buildMorton(self, pos):
+        ''' Assembles the octree from Morton keys. The particles are sorted by key, so that every cell of the tree is a contiguous run 
+        of particles sharing a key prefix (3 bits per level). Each level is then built at once: the runs of equal prefix inside the 
+        cells of the previous level that hold more than leafSize particles become the new nodes.
+
+        Args:
+            pos (array): Particle positions, shape (N,3)
+        '''
+
+        n = pos.shape[0]
+        rootSize = self.rootSize(pos)
+        keys = mortonKeys(pos, np.zeros(3), rootSize)
+        self.order = np.argsort(keys, kind="stable")
+        keys = keys[self.order]
+
+        octOffsets = np.array([[(o >> 2) & 1, (o >> 1) & 1, o & 1] for o in range(8)]) * 2. - 1.
+
+        center = [np.zeros((1, 3))]
+        size = [np.array([rootSize])]
+        parent = [np.array([-1])]
+        start = [np.array([0])]
+        count = [np.array([n])]
+        numNodes = 1
+
+        nodeOf = np.zeros(n, dtype=int)   # deepest node built so far containing each (sorted) particle
+        split = np.full(n, n > self.leafSize)   # particles whose node is being subdivided
+        allCenter, allSize = center[0], size[0]
+
+        for d in range(1, min(self.maxDepth, MORTON_BITS) + 1):
+            idx = np.nonzero(split)[0]
+            if (idx.size == 0):
+                break
+
+            prefix = keys[idx] >> np.uint64(3 * (MORTON_BITS - d))
+            newRun = np.ones(idx.size, dtype=bool)
+            newRun[1:] = (prefix[1:] != prefix[:-1]) | (idx[1:] != idx[:-1] + 1)
+            runStart = np.nonzero(newRun)[0]
+            runCount = np.diff(np.append(runStart, idx.size))
+            runOf = np.cumsum(newRun) - 1
+
+            par = nodeOf[idx[runStart]]
+            octant = (prefix[runStart] & np.uint64(7)).astype(int)
+
+            center.append(allCenter[par] + octOffsets[octant] * allSize[par, None] / 4.)
+            size.append(allSize[par] / 2.)
+            parent.append(par)
+            start.append(idx[runStart])
+            count.append(runCount)
+            allCenter = np.concatenate((allCenter, center[-1]))
+            allSize = np.concatenate((allSize, size[-1]))
+
+            nodeOf[idx] = numNodes + runOf
+            split[idx] = runCount[runOf] > self.leafSize
+            numNodes += runStart.size
+
+        self.center = allCenter
+        self.size = allSize
+        self.parent = np.concatenate(parent)
+        self.start = np.concatenate(start)
+        self.count = np.concatenate(count)
+        self.depth = np.concatenate([np.full(len(p), d) for d, p in enumerate(parent)])
+
+        # runs are created in key order, so the children of a node are contiguous and their parents non-decreasing
+        self.numChildren = np.bincount(self.parent[1:], minlength=numNodes)
+        self.firstChild = np.full(numNodes, -1)
+        children = np.arange(1, numNodes)
+        first = np.ones(numNodes - 1, dtype=bool)
+        first[1:] = self.parent[2:] != self.parent[1:-1]
+        self.firstChild[self.parent[1:][first]] = children[first]
+        self.linkTree()
+
+    def linkTree(self):
+        ''' Derives the navigation arrays from parent/firstChild/numChildren: isLeaf, nextSibling (-1 for the last child), and skip,
+        the node visited next when a walk does not open a node (its next sibling, or the next sibling of its nearest ancestor that
+        has one). Following firstChild to open and skip to move on traverses the tree depth-first without a stack.
+        '''
+
+        self.isLeaf = self.numChildren == 0
+
+        self.nextSibling = np.arange(1, self.numNodes + 1)
+        internal = np.nonzero(~self.isLeaf)[0]
+        self.nextSibling[self.firstChild[internal] + self.numChildren[internal] - 1] = -1
+        self.nextSibling[0] = -1
+
+        # nodes are numbered breadth-first, so parents are always resolved before their children
+        self.skip = self.nextSibling.copy()
+        for d in range(1, self.depth.max() + 1):
+            level = np.nonzero(self.depth == d)[0]
+            last = level[self.nextSibling[level] == -1]
+            self.skip[last] = self.skip[self.parent[last]]
+
+    def levels(self):
+        ''' Returns the node indices of each level of the tree, from the root down.
+
+        Returns:
+            list: One array of node indices per depth
+        '''
+
+        bounds = np.searchsorted(self.depth, np.arange(self.depth.max() + 2))
+        return [np.arange(bounds[d], bounds[d+1]) for d in range(len(bounds) - 1)]
+
+    def leafParticles(self, n):
+        ''' Returns the indices of the particles in node n.
+
+        Args:
+            n (integer): Node index
+
+        Returns:
+            array: Particle indices
+        '''
+
+        return self.order[self.start[n]:self.start[n] + self.count[n]]
+
+    def refit(self, pos, mass, vel=None):
+        ''' Updates the tree for new particle positions without changing its topology: every node keeps its particles, its cell is 
+        replaced by the cube centered on the bounding box of its particles (leaves measure their particles, parents merge their 
+        children's boxes, level by level), and the moments are recomputed. A cell never shrinks below the side it was built with, so 
+        the opening criterion is unchanged right after a build and only becomes more conservative as particles drift.
+
+        Args:
+            pos (array): Particle positions, shape (N,3)
+            mass (array): Particle masses, shape (N,)
+            vel (array): Particle velocities, shape (N,3), for the nodes' center-of-mass velocities (see sumMultipole)
+        '''
+
+        lo = np.zeros((self.numNodes, 3))
+        hi = np.zeros((self.numNodes, 3))
+
+        leaves = np.nonzero(self.isLeaf)[0]
+        leaves = leaves[np.argsort(self.start[leaves])]
+        if (leaves.size > 0):
+            lo[leaves] = np.minimum.reduceat(pos[self.order], self.start[leaves], axis=0)
+            hi[leaves] = np.maximum.reduceat(pos[self.order], self.start[leaves], axis=0)
+
+        for level in reversed(self.levels()[1:]):
+            parent = self.parent[level]
+            internal = np.unique(parent)
+            lo[internal] = np.inf
+            hi[internal] = -np.inf
+            np.minimum.at(lo, parent, lo[level])
+            np.maximum.at(hi, parent, hi[level])
+
+        self.center = (lo + hi) / 2.
+        self.size = np.maximum(self.cellSize, (hi - lo).max(axis=1))
+        self.sumMultipole(pos, mass, vel)
+
+    def growth(self):
+        ''' Returns the mean ratio of a node's current side length to the side of the cell it was built with, weighted by the number 
+        of particles in the node (1 right after a build). Refitted nodes that have grown overlap their neighbors, and the tree walk has
+        to open more of them, so this tracks the extra cost of walking a refitted tree.
+
+        Returns:
+            float: Mean growth factor
+        '''
+
+        return (self.count * self.size / self.cellSize).sum() / self.count.sum()
+
+    def sumMultipole(self, pos, mass, vel=None):
+        ''' Computes the mass, center of mass and traceless quadrupole tensor (about the center of mass) of every node. Leaves are 
+        summed directly from their particles, then the moments are accumulated into the parents one level at a time, from the deepest 
+        level up to the root; a child's quadrupole is shifted to its parent's center of mass on the way. Given the particle 
+        velocities, the velocity of every node's center of mass is computed as well (it is needed for jerks); otherwise it is 0.
+
+        Args:
+            pos (array): Particle positions, shape (N,3)
+            mass (array): Particle masses, shape (N,)
+            vel (array): Particle velocities, shape (N,3)
+        '''
+
+        m = mass[self.order]
+        mx = m[:,None] * pos[self.order]
+        mv = m[:,None] * (np.zeros_like(pos) if vel is None else vel[self.order])
+
+        self.mass = np.zeros(self.numNodes)
+        massPos = np.zeros((self.numNodes, 3))
+        massVel = np.zeros((self.numNodes, 3))
+
+        leaves = np.nonzero(self.isLeaf)[0]
+        leaves = leaves[np.argsort(self.start[leaves])]   # leaves tile 'order', so they can be summed with one reduceat
+        if (leaves.size > 0):
+            self.mass[leaves] = np.add.reduceat(m, self.start[leaves])
+            massPos[leaves] = np.add.reduceat(mx, self.start[leaves], axis=0)
+            massVel[leaves] = np.add.reduceat(mv, self.start[leaves], axis=0)
+
+        for level in reversed(self.levels()[1:]):
+            np.add.at(self.mass, self.parent[level], self.mass[level])
+            np.add.at(massPos, self.parent[level], massPos[level])
+            np.add.at(massVel, self.parent[level], massVel[level])
+
+        self.com = self.center.copy()   # massless nodes fall back on their cell center
+        self.comVel = np.zeros((self.numNodes, 3))
+        massive = self.mass > 0
+        self.com[massive] = massPos[massive] / self.mass[massive, None]
+        self.comVel[massive] = massVel[massive] / self.mass[massive, None]
+        
+        self.quad = np.zeros((self.numNodes, 3, 3))
+        if (leaves.size > 0):
+            leafOf = np.repeat(leaves, self.count[leaves])
+            self.quad[leaves] = np.add.reduceat(quadrupole(m, pos[self.order] - self.com[leafOf]), self.start[leaves], axis=0)
+
+        for level in reversed(self.levels()[1:]):
+            shift = quadrupole(self.mass[level], self.com[level] - self.com[self.parent[level]])
+            np.add.at(self.quad, self.parent[level], self.quad[level] + shift)
+
+
+def quadrupole(mass, disp):
+    ''' Traceless quadrupole tensors m (3 d d^T - |d|^2 I) of point masses at displacements d from an expansion center.
+
+    Args:
+        mass (array): Masses, shape (K,)
+        disp (array): Displacements from the expansion center, shape (K,3)
+
+    Returns:
+        array: Quadrupole tensors, shape (K,3,3)
+    '''
+
+    q = 3 * disp[:,:,None] * disp[:,None,:]
+    q -= np.einsum('ki,ki->k', disp, disp)[:,None,None] * np.eye(3)
+    return mass[:,None,None] * q
+
+MORTON_BITS = 21   # bits per coordinate in a Morton key, so that a key fits in 63 bits
+
+def spreadBits(v):
+    ''' Spreads the lowest 21 bits of each integer in v so that two zero bits separate consecutive bits (bit i moves to bit 3i).
+
+    Args:
+        v (array): Unsigned 64-bit integers smaller than 2**21
+
+    Returns:
+        array: Spread integers
+    '''
+
+    v = v.astype(np.uint64)
+    for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f), 
+                        (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+def mortonKeys(pos, center, size):
+    ''' Computes the Morton (Z-order) key of each position in the cube of side 'size' centered on 'center'. Each coordinate is 
+    quantized to MORTON_BITS bits and the bits are interleaved as x, y, z, so the top 3 bits of a key give the octant of the position 
+    in the cube, the next 3 bits its octant in that sub-cube, and so on, with the same octant numbering as Octree.buildTree.
+
+    Args:
+        pos (array): Positions, shape (N,3)
+        center (array): Center of the cube
+        size (float): Side length of the cube
+
+    Returns:
+        array: Keys, shape (N,), as unsigned 64-bit integers
+    '''
+
+    cells = 1 << MORTON_BITS
+    q = np.floor((pos - (center - size / 2.)) / size * cells)
+    q = np.clip(q, 0, cells - 1).astype(np.uint64)
+    return (spreadBits(q[:,0]) << np.uint64(2)) | (spreadBits(q[:,1]) << np.uint64(1)) | spreadBits(q[:,2])
+
+
+def main():
+    #### !!!! TEST !!!! ####
+
+    pos = np.array([[-1, 1, 1], [1, 1, 1], [49, 49, 49], [1, 1, 1.5]])
+    mass = np.array([1, 2, 3, 4])
+
+    tree = Octree(pos, 100)
+    tree.sumMultipole(pos, mass)
+    print(tree)
+    
+    tree = Octree(pos, 100, build="morton")
+    tree.sumMultipole(pos, mass)
+    print(tree)
+    print(mortonKeys(pos, np.zeros(3), 100))
+    print(tree.firstChild)
+    print(tree.nextSibling)
+    print(tree.skip)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import warnings
+import numpy as np
+import NBodyBuilder.ParticleSet as ps
+
+class PM(object):
+    ''' The PM class implements a particle-mesh gravity solver. The particle masses are assigned to a cubic mesh (cloud-in-cell or
+    triangular-shaped-cloud), the mesh is convolved with the Green's function of the force law using real FFTs, and the mesh
+    accelerations are interpolated back to the particles with the same assignment scheme, so that no particle exerts a net force on
+    itself. The simulation is not periodic, so the convolution is done on a zero-padded mesh of at least twice the size (Hockney &
+    Eastwood), with the force kernel tabulated in real space. The cost is O(N + n^3 log n) for an n^3 mesh.
+
+    With a splitScale r_s, only the long-range part of the force, 1 - S(r) times the Newtonian force (see shortRangeFactor), is
+    computed; this is the mesh half of the TreePM solver. Without it, the mesh carries the full 1/r^2 force, which is accurate for
+    separations of a few mesh cells and more.
+
+    The mesh only resolves the box, so PM suits roughly uniform boxes. Particles outside the box are not put on the mesh: the forces
+    between them and all other particles are summed directly (see directAccels), which is exact but costs O(N) per outside particle,
+    and a warning is issued when more than maxOutside of the particles lie outside. With enlarge, the mesh instead grows to hold all
+    the particles, at the cost of its resolution; TreePM does this, since its split scale follows the mesh spacing.
+
+    Args:
+        boxSize (float or integer): Size of the simulation box, centered on the origin
+        particles (ParticleSet or array): Set of particles (an array of Particles is packed into a ParticleSet)
+        gridSize (integer): Number of mesh cells along each side of the box
+        assignment (string): Mass assignment and interpolation scheme, "CIC" or "TSC"
+        splitScale (float): Force-splitting scale r_s of the long-range force; None for the full force
+        enlarge (boolean): Enlarge the box, like the root cell of the Octree, if particles lie outside it
+        maxOutside (float): Fraction of the particles outside the box above which a warning is issued
+    '''
+
+    # Given the size of the simulation box and a set of particles, compute the force on each of the particles on a mesh
+    def __init__(self, boxSize, particles, gridSize=64, assignment="CIC", splitScale=None, enlarge=False, maxOutside=0.01):
+        self.particles = ps.asParticleSet(particles)
+        self.boxSize = boxSize
+        self.gridSize = gridSize
+        self.assignment = assignment
+        self.splitScale = splitScale
+        self.enlarge = enlarge
+        self.maxOutside = maxOutside
+
+    def __repr__(self):
+        return "PM({0}^3 mesh, {1} assignment, splitScale={2})".format(self.gridSize, self.assignment, self.splitScale)
+
+    def meshGeometry(self):
+        ''' Returns the geometry of the mesh: the box (with enlarge, grown if particles lie outside it) is cut into gridSize cells,
+        and the mesh points are the cell corners plus one extra layer on each side for the assignment stencils.
+
+        Returns:
+            tuple: Coordinate of mesh point 0 along each axis, mesh spacing and number of mesh points along each side
+        '''
+
+        pos = self.particles.pos
+        side = float(self.boxSize)
+        if (self.enlarge and (pos.size > 0)):
+            side = max(side, 2 * np.abs(pos).max() * (1 + 1e-12))
+        spacing = side / self.gridSize
+        return -side / 2. - spacing, spacing, self.gridSize + 3
+
+    def meshAccels(self):
+        ''' Computes the mesh acceleration of every particle (the long-range acceleration if splitScale is set).
+
+        Returns:
+            array: Accelerations, shape (N,3)
+        '''
+
+        lo, spacing, numPoints = self.meshGeometry()
+        pos = self.particles.pos
+        mass = self.particles.mass
+        inside = np.all(np.abs(pos) < spacing * (numPoints - 3) / 2., axis=1)
+        
+        flat, weight = stencil((pos[inside] - lo) / spacing, numPoints, self.assignment)
+        density = np.bincount(flat.ravel(), weights=(mass[inside,None] * weight).ravel(),
+                              minlength=numPoints**3).reshape((numPoints,) * 3)
+        padded = (fftLength(2 * numPoints),) * 3
+        densityHat = np.fft.rfftn(density, s=padded, axes=(0, 1, 2))
+
+        accel = np.zeros((self.particles.size, 3))
+        for k, kernelHat in enumerate(greensFunction(numPoints, spacing, self.splitScale)):
+            field = np.fft.irfftn(densityHat * kernelHat, s=padded, axes=(0, 1, 2))[:numPoints, :numPoints, :numPoints]
+            accel[inside,k] = (field.ravel()[flat] * weight).sum(axis=1)
+
+        outside = ~inside
+        if (outside.any()):
+            if (outside.mean() > self.maxOutside):
+                warnings.warn("{:.1%} of the particles lie outside the PM box of size {:g}, and their forces are summed directly; "
+                              "enlarge boxSize to hold them".format(outside.mean(), self.boxSize))
+            # pairs with an outside particle: every particle feels the outside ones, and the outside ones also feel the inside ones
+            accel += directAccels(pos, pos[outside], mass[outside], self.splitScale)
+            accel[outside] += directAccels(pos[outside], pos[inside], mass[inside], self.splitScale)
+
+        return accel
+
+    def computeAllAccels(self, active=None):
+        ''' Computes the accelerations of all Particles in the simulation.
+
+        Args:
+            active (array): Particles whose accelerations are needed; the mesh is solved for all particles, but only these
+                accelerations are stored
+        '''
+
+        if (active is None):
+            self.particles.accel[:] = self.meshAccels()
+        else:
+            self.particles.accel[active] = self.meshAccels()[active]
+
+def stencil(gridPos, numPoints, assignment):
+    ''' Returns the mesh points and weights over which each particle is spread (CIC: the 2^3 surrounding points, with weights linear
+    in the distance; TSC: the 3^3 nearest points, with quadratic weights).
+
+    Args:
+        gridPos (array): Particle positions in units of the mesh spacing, relative to mesh point 0, shape (N,3)
+        numPoints (integer): Number of mesh points along each side
+        assignment (string): "CIC" or "TSC"
+
+    Returns:
+        (2) arrays: flat indices of the mesh points and weights, both shape (N, 8) or (N, 27)
+    '''
+
+    if (assignment == "TSC"):
+        base = np.rint(gridPos).astype(int) - 1
+        f = gridPos - base - 1
+        w = np.stack([0.5 * (0.5 - f)**2, 0.75 - f**2, 0.5 * (0.5 + f)**2], axis=2)
+    else:
+        base = np.floor(gridPos).astype(int)
+        f = gridPos - base
+        w = np.stack([1 - f, f], axis=2)
+
+    offset = np.arange(w.shape[2])
+    ix = (base[:,0,None] + offset)[:,:,None,None]
+    iy = (base[:,1,None] + offset)[:,None,:,None]
+    iz = (base[:,2,None] + offset)[:,None,None,:]
+    flat = (ix * numPoints + iy) * numPoints + iz
+    weight = w[:,0,:,None,None] * w[:,1,None,:,None] * w[:,2,None,None,:]
+    return flat.reshape(gridPos.shape[0], -1), weight.reshape(gridPos.shape[0], -1)
+
+def directAccels(pos, srcPos, srcMass, splitScale=None, tileSize=512):
+    ''' Sums the Newtonian accelerations (the long-range part 1 - S(r) of them, if splitScale is set) induced on targets by sources, 
+    in blocks of tileSize targets x tileSize sources. A target coinciding with a source gets no contribution from it.
+
+    Args:
+        pos (array): Target positions, shape (T,3)
+        srcPos (array): Source positions, shape (S,3)
+        srcMass (array): Source masses, shape (S,)
+        splitScale (float): Force-splitting scale r_s; None for the full force
+        tileSize (integer): Number of targets and of sources per block
+
+    Returns:
+        array: Acceleration of each target, shape (T,3)
+    '''
+
+    accel = np.zeros((pos.shape[0], 3))
+    for i0 in range(0, pos.shape[0], tileSize):
+        for j0 in range(0, srcPos.shape[0], tileSize):
+            disp = srcPos[None,j0:j0 + tileSize,:] - pos[i0:i0 + tileSize,None,:]
+            r = np.sqrt(np.einsum('tsk,tsk->ts', disp, disp))
+            with np.errstate(divide="ignore"):
+                coef = np.where(r > 0, srcMass[None,j0:j0 + tileSize] / r**3, 0.)
+            if (splitScale is not None):
+                coef *= 1. - shortRangeFactor(r, splitScale)
+            accel[i0:i0 + tileSize] += np.einsum('ts,tsk->tk', coef, disp)
+    return accel
+
+_greensCache = {}
+
+def greensFunction(numPoints, spacing, splitScale):
+    ''' Fourier transforms of the three components of the force kernel, -d / |d|^3 (times the long-range factor if splitScale is
+    set), tabulated on the zero-padded mesh at the separations d between mesh points. The transforms only depend on the mesh, so
+    they are cached and reused by later solvers on the same mesh.
+
+    Args:
+        numPoints (integer): Number of mesh points along each side (the padded mesh has fftLength(2 * numPoints))
+        spacing (float): Mesh spacing
+        splitScale (float): Force-splitting scale r_s; None for the full force
+
+    Returns:
+        list: Three complex arrays, the transforms of the x, y and z kernels
+    '''
+
+    key = (numPoints, spacing, splitScale)
+    if (key not in _greensCache):
+        _greensCache.clear()
+
+        n = fftLength(2 * numPoints)
+        d = spacing * np.where(np.arange(n) < n // 2, np.arange(n), np.arange(n) - n)
+        dx, dy, dz = np.meshgrid(d, d, d, indexing="ij", sparse=True)
+        r = np.sqrt(dx**2 + dy**2 + dz**2)
+
+        r[0,0,0] = 1.   # the kernel vanishes at d = 0 anyway
+        coef = -1. / r**3
+        if (splitScale is not None):
+            coef *= 1. - shortRangeFactor(r, splitScale)
+
+        _greensCache[key] = [np.fft.rfftn(coef * dk) for dk in (dx, dy, dz)]
+
+    return _greensCache[key]
+
+def fftLength(n):
+    ''' Returns the smallest integer >= n with no prime factors other than 2, 3 and 5, for which FFTs are fast.
+
+    Args:
+        n (integer): Minimum length
+
+    Returns:
+        integer: FFT length
+    '''
+
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while (m % p == 0):
+                m //= p
+        if (m == 1):
+            return n
+        n += 1
+
+def erfc(x):
+    ''' Complementary error function for x >= 0 (Abramowitz & Stegun 7.1.26, absolute error below 1.5e-7).
+
+    Args:
+        x (array): Non-negative arguments
+
+    Returns:
+        array: erfc(x), same shape as x
+    '''
+
+    t = 1. / (1. + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return poly * np.exp(-x * x)
+
+def shortRangeFactor(r, splitScale):
+    ''' Fraction S(r) = erfc(u) + 2u/sqrt(pi) exp(-u^2), u = r / (2 r_s), of the Newtonian force at separation r carried by the
+    short-range part of the force split of Bagla (2002) and Springel (2005); the long-range part 1 - S(r) is smooth on scales of r_s,
+    and S(r) falls below 1e-3 beyond about 5.5 r_s.
+
+    Args:
+        r (array): Separations
+        splitScale (float): Force-splitting scale r_s
+
+    Returns:
+        array: S(r), same shape as r
+    '''
+
+    u = np.asarray(r, dtype=float) / (2. * splitScale)
+    return erfc(u) + 2. / np.sqrt(np.pi) * u * np.exp(-u * u)
+
+def main():
+    #### !!!! TEST !!!! ####
+
+    generator = np.random.default_rng(12345)
+    particles = ps.ParticleSet(generator.random(2000), 10 * generator.standard_normal((2000, 3)))
+
+    pm = PM(100, particles, gridSize=64, assignment="TSC")
+    print(pm)
+    pm.computeAllAccels()
+    print(particles[0])
+    print(particles[1])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+''' Helpers for running solver work in a pool of worker processes. Arrays are handed to the workers through a single
+    multiprocessing.shared_memory block (see SharedArrays) rather than pickled, and the pool itself is kept alive between calls
+    (see workerPool), so that a simulation pays the start-up cost of the workers once rather than every time step. Solvers that
+    work in threads instead get a thread pool kept alive the same way (see threadPool).
+'''
+
+class SharedArrays(object):
+    ''' A set of named NumPy arrays published in one shared memory block. The creating process owns the block and must close() it;
+    worker processes attach to it by passing the picklable 'spec' to attach().
+
+    Args:
+        arrays (dict): Arrays to publish, by name; each is copied into the block
+    '''
+
+    def __init__(self, arrays):
+        layout = []
+        offset = 0
+        for name, a in arrays.items():
+            a = np.ascontiguousarray(a)
+            layout.append((name, a.dtype.str, a.shape, offset))
+            offset += -(-a.nbytes // 64) * 64   # keep every array 64-byte aligned
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.spec = (self.shm.name, layout)
+        self.arrays = views(self.shm, layout)
+        for name, a in arrays.items():
+            self.arrays[name][...] = a
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self):
+        ''' Releases and destroys the shared memory block. Arrays obtained from it must not be used afterwards.
+        '''
+
+        self.arrays = None
+        self.shm.close()
+        self.shm.unlink()
+
+def views(shm, layout):
+    ''' Returns NumPy views of the arrays laid out in a shared memory block.
+
+    Args:
+        shm (SharedMemory): Shared memory block
+        layout (list): (name, dtype, shape, offset) of each array
+
+    Returns:
+        dict: Arrays by name
+    '''
+
+    return {name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset) for name, dtype, shape, offset in layout}
+
+def attach(spec):
+    ''' Attaches to a block published by SharedArrays, from a worker process. The returned block must be closed once the arrays are
+    no longer used.
+
+    Args:
+        spec (tuple): SharedArrays.spec of the block
+
+    Returns:
+        (2) tuple: the SharedMemory block and a dict of its arrays by name
+    '''
+
+    name, layout = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, views(shm, layout)
+
+_pool = None
+_poolWorkers = 0
+
+def workerPool(workers):
+    ''' Returns a process pool with the given number of workers. The pool is created on first use and reused by later calls with
+    the same number of workers (a different number replaces it); it is shut down when the interpreter exits.
+
+    Args:
+        workers (integer): Number of worker processes
+
+    Returns:
+        multiprocessing.pool.Pool: Worker pool
+    '''
+
+    global _pool, _poolWorkers
+
+    if ((_pool is None) or (_poolWorkers != workers)):
+        closePool()
+        _pool = mp.get_context().Pool(workers)
+        _poolWorkers = workers
+
+    return _pool
+
+def closePool():
+    ''' Shuts down the pool created by workerPool, if any.
+    '''
+
+    global _pool, _poolWorkers
+
+    if (_pool is not None):
+        _pool.close()
+        _pool.join()
+        _pool = None
+        _poolWorkers = 0
+
+atexit.register(closePool)
+
+_threadPool = None
+_threadPoolWorkers = 0
+
+def threadPool(workers):
+    ''' Returns a thread pool with the given number of workers, created on first use and reused like the process pool of workerPool.
+
+    Args:
+        workers (integer): Number of threads
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: Thread pool
+    '''
+
+    global _threadPool, _threadPoolWorkers
+
+    if ((_threadPool is None) or (_threadPoolWorkers != workers)):
+        closeThreadPool()
+        _threadPool = ThreadPoolExecutor(workers)
+        _threadPoolWorkers = workers
+
+    return _threadPool
+
+def closeThreadPool():
+    ''' Shuts down the pool created by threadPool, if any.
+    '''
+
+    global _threadPool, _threadPoolWorkers
+
+    if (_threadPool is not None):
+        _threadPool.shutdown()
+        _threadPool = None
+        _threadPoolWorkers = 0
+
+atexit.register(closeThreadPool)
+
+def main():
+    #### !!!! TEST !!!! ####
+
+    shared = SharedArrays({"x": np.arange(5.), "ids": np.arange(3)})
+    shm, arrays = attach(shared.spec)
+    arrays["x"] *= 2
+    shm.close()
+    print(shared["x"], shared["ids"])
+    shared.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,34 @@
 import numpy as np
+import NBodyBuilder.Softening as soft
+
+def _stored(name, arrayName):
+    ''' Builds the property used for each of a Particle's physical attributes. An unbound Particle keeps the value on itself; 
+    a Particle bound to a ParticleSet reads and writes its current row of the set's 'arrayName' array instead.
+
+    Args:
+        name (string): Name of the private attribute used by an unbound Particle
+        arrayName (string): Name of the ParticleSet array holding this attribute
+
+    Returns:
+        property: Property forwarding to the Particle or to its ParticleSet row
+    '''
+
+    def getter(self):
+        if (self._set is None):
+            return getattr(self, name)
+        return getattr(self._set, arrayName)[self._set.rank[self._id]]
+
+    def setter(self, value):
+        if (self._set is None):
+            setattr(self, name, value)
+        else:
+            getattr(self._set, arrayName)[self._set.rank[self._id]] = value
+
+    return property(getter, setter)
 
 class Particle(object):
     ''' This class keeps track of individual particles as well as the "super-particles" associated with non-leaf Nodes in Barnes-Hut.
+    A Particle can also be bound to a row of a ParticleSet, in which case it is a thin view onto the set's arrays.
     
     Args:
         mass (integer): Total mass of particles (or a particle)
@@ -9,12 +36,33 @@ class Particle(object):
 
     '''
     
+    mass = _stored("_mass", "mass")
+    com = _stored("_com", "pos")
+    vel = _stored("_vel", "vel")  #: array representing Particle velocity
+    accel = _stored("_accel", "accel")
+    
     # Given a mass and a center of mass (or a position, for individual particles), instantiate a Particle object with no acceleration
     def __init__(self, mass, com):
+        self._set = None
+        self._id = None
+        
         self.mass = mass
         self.com = com
         self.accel = np.zeros(3) 
-        self.vel = np.zeros(3) #: array representing Particle velocity
+        self.vel = np.zeros(3)
+    
+    def bind(self, particleSet, id):
+        ''' Binds this Particle to a particle of a ParticleSet, so that its mass, position, velocity and acceleration are read from and written to the set's arrays.
+        The particle is identified by its id in the set, so the binding survives the set being reordered.
+
+        Args:
+            particleSet (ParticleSet): Set holding the particle data
+            id (integer): Id of this Particle in the set
+
+        '''
+
+        self._set = particleSet
+        self._id = id
     
     def __str__(self):
         ''' Returns a string representation of a Particle displaying the Particle's mass, COM, and acceleration.
@@ -107,16 +155,7 @@ class Particle(object):
 
         '''
 
-        r = self.distTo(p)
-        displacement = p.com - self.com
-        
-        eps = self.epsilon(r, eps0, r0)   # gravitational softening
-        softDisp = r + eps                # softened displacement
-        
-        accelMag = p.mass / softDisp**2
-        accelVec = accelMag * displacement / softDisp
-        
-        return accelVec
+        return newtonAccelSmooth(self.com, p.com, p.mass, eps0, r0)
     
     def epsilon(self, r, eps0, r0):
         ''' Implementation of gravitational softening law from Springel et al. 2013; r is the displacement and eps0 is the softening length. The softening has a finite range, going to 0 for distances greater than r0 (with r0 being smaller than half the smallest box dimension).
@@ -131,11 +170,7 @@ class Particle(object):
 
         '''
 
-        if (r >= r0):
-            return 0
-        
-        else:
-            return -2.8 * eps0 / self.W2(r / (2.8 * eps0)) - r
+        return epsilon(r, eps0, r0)
         
     def W2(self, u):
         ''' Kernel for gravitational softening (from Springel, Yoshida, White 2001). 
@@ -148,14 +183,51 @@ class Particle(object):
 
         '''
 
-        if ((u >= 0) and (u < 0.5)):
-            return 16./3 * u**2 - 48./5 * u**4 + 32./5 * u**5 - 14./5
-      
-        elif ((u >= 0.5) and (u < 1)):
-            return 1./15 * u**-1 + 32./3 * u**2 - 16 * u**3 + 48./5 * u**4 - 32./15 * u**5 - 16./5
-      
-        else: 
-            return -1./u
+        return W2(u)
+        
+
+def newtonAccelSmooth(pos, srcPos, srcMass, eps0, r0):
+    ''' Computes the softened 1/r^2 acceleration induced at position 'pos' by a mass 'srcMass' at position 'srcPos'. 
+    This is the pair law used by Particle.newtonAccelSmooth, written in terms of plain arrays so that solvers can apply it to rows of a ParticleSet.
+
+    Args:
+        pos (array): Position at which the acceleration is evaluated
+        srcPos (array): Position of the source mass
+        srcMass (integer or float): Source mass
+        eps0 (integer or float): Gravitational softening
+        r0 (integer or float): Cutoff distance of the softening
+
+    Returns:
+        accelVec (array): Acceleration induced at 'pos' by the source
+    '''
+
+    return soft.softenedAccel(np.asarray(srcPos, dtype=float) - pos, srcMass, eps0, r0)
+
+def epsilon(r, eps0, r0):
+    ''' Gravitational softening law from Springel et al. 2013 (see Particle.epsilon), for a single separation (see Softening.epsilon).
+
+    Args:
+        r (float): Displacement
+        eps0 (integer or float): Gravitational softening
+        r0 (integer or float): Cutoff distance of the softening
+
+    Returns:
+        float: Softening added to the displacement
+    '''
+
+    return float(soft.epsilon(r, eps0, r0))
+
+def W2(u):
+    ''' Kernel for gravitational softening from Springel, Yoshida, White 2001 (see Particle.W2), for a single separation (see Softening.W2).
+
+    Args:
+        u (float): Displacement in units of the kernel length 2.8*eps0
+
+    Returns:
+        float: Softening kernel
+    '''
+
+    return float(soft.W2(u))
         
         
 def main():
@@ -172,7 +244,7 @@ def main():
     p1.combine(p2)
     print(p1)
     
-    l = [1, np.NaN]*8
+    l = [1, np.nan]*8
     print(l)
     print(np.all(np.isnan(l)))
     
@@ -0,0 +1,159 @@
+import numpy as np
+import NBodyBuilder.Particle as part
+
+class ParticleSet(object):
+    ''' This class stores a whole system of particles as a structure of arrays: masses in a contiguous (N,) array and positions, 
+    velocities and accelerations (and, for the Hermite integrator, jerks) in contiguous (N,3) arrays. Solvers and integrators work on these arrays directly; indexing or 
+    iterating over a ParticleSet yields Particles bound to the corresponding rows, so code written against arrays of Particles keeps working.
+    Each particle also has a fixed id (its row when the set was created); the rows may later be permuted with reorder(), and 'ids' and 
+    'rank' translate between rows and ids.
+
+    Args:
+        mass (array): Masses of the particles, shape (N,)
+        pos (array): Positions of the particles, shape (N,3)
+        vel (array): Velocities of the particles, shape (N,3); zero if not given
+        accel (array): Accelerations of the particles, shape (N,3); zero if not given
+    '''
+
+    def __init__(self, mass, pos, vel=None, accel=None):
+        self.mass = np.array(mass, dtype=float).reshape(-1)
+        self.pos = np.array(pos, dtype=float).reshape(-1, 3)
+        self.vel = np.zeros_like(self.pos) if vel is None else np.array(vel, dtype=float).reshape(-1, 3)
+        self.accel = np.zeros_like(self.pos) if accel is None else np.array(accel, dtype=float).reshape(-1, 3)
+        self.jerk = np.zeros_like(self.pos)   # time derivative of accel, only computed when asked for
+        
+        self.ids = np.arange(self.size)    # id of the particle stored in each row
+        self.rank = np.arange(self.size)   # row holding each particle id
+
+    @classmethod
+    def fromParticles(cls, particles):
+        ''' Packs an array of Particles into a new ParticleSet. The Particles are bound to the new set, so they remain valid views 
+        of their particle as the set is evolved.
+
+        Args:
+            particles (array): Array of Particles
+
+        Returns:
+            ParticleSet: Set holding the masses, positions, velocities and accelerations of the Particles
+        '''
+
+        s = cls(np.array([p.mass for p in particles]), 
+                np.array([p.com for p in particles]).reshape(-1, 3), 
+                np.array([p.vel for p in particles]).reshape(-1, 3), 
+                np.array([p.accel for p in particles]).reshape(-1, 3))
+        
+        for i, p in enumerate(particles):
+            p.bind(s, i)
+            
+        return s
+
+    @property
+    def size(self):
+        ''' Number of particles in the set.
+        '''
+
+        return self.mass.shape[0]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        ''' Returns a Particle bound to the particle currently stored in row i of the set.
+
+        Args:
+            i (integer): Index of the particle
+
+        Returns:
+            Particle: View of particle i
+        '''
+
+        if (i < 0):
+            i += self.size
+        if ((i < 0) or (i >= self.size)):
+            raise IndexError("particle index out of range")
+        
+        p = part.Particle.__new__(part.Particle)
+        p.bind(self, self.ids[i])
+        return p
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def __repr__(self):
+        s = ""
+        for p in self:
+            s += "{} \n\n".format(p)
+            
+        return s
+
+    def resetAccel(self):
+        ''' Sets the acceleration of every particle to 0.
+        '''
+
+        self.accel[:] = 0
+
+    def reorder(self, perm):
+        ''' Permutes the rows of the set in place, so that row k afterwards holds the particle previously in row perm[k]. Particles 
+        bound to the set keep pointing at the same particle.
+
+        Args:
+            perm (array): Permutation of the rows, shape (N,)
+        '''
+
+        self.mass[:] = self.mass[perm]
+        self.pos[:] = self.pos[perm]
+        self.vel[:] = self.vel[perm]
+        self.accel[:] = self.accel[perm]
+        self.jerk[:] = self.jerk[perm]
+        
+        self.ids[:] = self.ids[perm]
+        self.rank[self.ids] = np.arange(self.size)
+
+    def row(self, p):
+        ''' Returns the row currently holding a particle, given either as a Particle bound to this set or as a row index.
+
+        Args:
+            p (Particle or integer): Particle of this set, or its row index
+
+        Returns:
+            integer: Row of the particle
+        '''
+
+        if (isinstance(p, part.Particle)):
+            if (p._set is not self):
+                raise ValueError("the Particle is not bound to this ParticleSet")
+            return int(self.rank[p._id])
+        return int(p)
+
+def asParticleSet(particles):
+    ''' Returns 'particles' as a ParticleSet, packing (and binding) an array of Particles if necessary.
+
+    Args:
+        particles (ParticleSet or array): Particles to use
+
+    Returns:
+        ParticleSet: Structure-of-arrays view of the particles
+    '''
+
+    if (isinstance(particles, ParticleSet)):
+        return particles
+    return ParticleSet.fromParticles(particles)
+
+def main():
+    #### !!!! TEST !!!! ####
+    
+    p1 = part.Particle(2, np.array([0, 0, 0]))
+    p2 = part.Particle(3, np.array([1, 1, 1]))
+    
+    s = asParticleSet(np.array([p1, p2]))
+    s.pos += 1
+    s.vel[1] = [0, 0, 1]
+    s.reorder(np.array([1, 0]))
+    
+    print(s)
+    print(p1)
+    print(p2.vel)
+    
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import contextlib
+import json
+import time
+
+''' Instrumentation of a simulation: per-phase timers, interaction counters and other per-step values, gathered in a Stats object and
+    optionally logged as one JSON line per step. TimeStepper, BH and TreePM take an optional Stats; without one (the default) they skip
+    all instrumentation, at the cost of a None test per phase.
+'''
+
+class Stats(object):
+    ''' Timers and counters of a simulation. Phases may be nested (the tree build inside the setup of the solver, for instance), and
+    each phase is charged only its exclusive time, the time not spent in the phases nested inside it, so the phases of a step add up
+    to its wall time. Counters are summed, and values (such as the tree depth) keep their last setting.
+
+    The phases timed by TimeStepper and BH are "integrator" (the integrator's own updates), "solver" (setting up the gravity solver),
+    "treeBuild", "treeRefit" and "multipole" (BH tree maintenance), "walk" (the force computation proper, of any solver), "history"
+    (writing frames), "diagnostics" (measuring the conserved quantities), "potential" (BH potentials) and "checkpoint"; the outputs
+    written after a step are charged to that step's record. BH counts "nodesOpened", "particleNode" and "particleParticle"
+    interactions and "groups" walked, and records "treeDepth" and "numNodes".
+
+    Args:
+        logFile (string): If given, every step appends a JSON line with its times, counts and values to this file
+    '''
+
+    def __init__(self, logFile=None):
+        self.times = {}        # exclusive time of each phase, over the whole run
+        self.counts = {}       # counters, over the whole run
+        self.values = {}       # last value of each recorded quantity
+        self.numSteps = 0
+        self.stepTimes = {}
+        self.stepCounts = {}
+        self.stack = []        # [phase, start, time spent in nested phases] of the running phases
+        self.logFile = logFile
+        self.log = open(logFile, "a") if logFile is not None else None
+
+    def __repr__(self):
+        ''' Returns a table of the total time of each phase and of the counters.
+
+        Returns:
+            s (string): One line per phase, counter and value
+        '''
+
+        total = sum(self.times.values())
+        s = "{} steps, {:.4g} s\n".format(self.numSteps, total)
+        for phase, t in sorted(self.times.items(), key=lambda item: -item[1]):
+            s += "  {:<18s} {:10.4g} s  {:5.1f}%\n".format(phase, t, 100. * t / total if total > 0 else 0.)
+        for name, n in sorted(self.counts.items()):
+            s += "  {:<18s} {:12d}\n".format(name, n)
+        for name, v in sorted(self.values.items()):
+            s += "  {:<18s} {:>12}\n".format(name, v)
+        return s
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        ''' Context manager timing a phase.
+
+        Args:
+            phase (string): Name of the phase
+        '''
+
+        frame = [phase, time.perf_counter(), 0.]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            elapsed = time.perf_counter() - frame[1]
+            exclusive = elapsed - frame[2]
+            self.times[phase] = self.times.get(phase, 0.) + exclusive
+            self.stepTimes[phase] = self.stepTimes.get(phase, 0.) + exclusive
+            if (self.stack):
+                self.stack[-1][2] += elapsed
+
+    def count(self, name, n=1):
+        ''' Adds n to a counter.
+
+        Args:
+            name (string): Name of the counter
+            n (integer): Increment
+        '''
+
+        self.counts[name] = self.counts.get(name, 0) + int(n)
+        self.stepCounts[name] = self.stepCounts.get(name, 0) + int(n)
+
+    def addCounts(self, counts):
+        ''' Adds a dict of increments to the counters.
+
+        Args:
+            counts (dict): Increments, by counter name
+        '''
+
+        for name, n in counts.items():
+            self.count(name, n)
+
+    def record(self, name, value):
+        ''' Sets a value.
+
+        Args:
+            name (string): Name of the value
+            value (number): Value
+        '''
+
+        self.values[name] = value
+
+    def endStep(self, **info):
+        ''' Closes the record of a step: the times and counts since the previous record (with the current values and the given
+        information) are appended to the log, if any, and the next record starts empty.
+
+        Args:
+            info: Information about the step (time, dt, ...) to include in the log
+        '''
+
+        self.numSteps += 1
+        if (self.log is not None):
+            line = dict(info, step=self.numSteps, times=self.stepTimes, counts=self.stepCounts, values=self.values)
+            self.log.write(json.dumps(line, default=float) + "\n")
+        self.stepTimes = {}
+        self.stepCounts = {}
+
+    def close(self):
+        ''' Closes the log file.
+        '''
+
+        if (self.log is not None):
+            self.log.close()
+            self.log = None
+
+def phase(stats, name):
+    ''' Returns a timer for a phase of stats, or a context manager doing nothing if stats is None.
+
+    Args:
+        stats (Stats): Stats, or None
+        name (string): Name of the phase
+
+    Returns:
+        context manager
+    '''
+
+    if (stats is None):
+        return contextlib.nullcontext()
+    return stats.timer(name)
+
+def main():
+    #### !!!! TEST !!!! ####
+
+    stats = Stats()
+    with stats.timer("outer"):
+        with stats.timer("inner"):
+            time.sleep(0.01)
+        stats.count("calls", 2)
+    stats.record("depth", 3)
+    stats.endStep()
+    print(stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+import NBodyBuilder.IC as IC
+import NBodyBuilder.TimeStepper as TimeStepper
+import NBodyBuilder.Diagnostics as diag
+
+''' Runs ensembles of simulations: every configuration of a parameter grid (or of an explicit list) is evolved in a pool of worker
+    processes, each run writes its history to its own .npy file, and a summary table lists the wall time and the drift of the conserved
+    quantities of every run. It can be used from Python (sweep) or from the command line:
+
+        python -m NBodyBuilder.Sweep --grid '{"numParticles": [100, 1000], "gravity": ["direct", "BH"]}' --workers 4 --out runs
+
+    A configuration is a dict with the arguments of NBodyBuilderClass (numParticles, ic, gravity, integrator, time, dt), plus optionally
+    "seed" for the initial conditions, "diagnosticsEvery" (the conserved quantities are measured at every diagnosticsEvery-th output
+    time; by default only at the start and the end), "diagnosticsDirect" (measure the potential energy by direct summation rather
+    than with the run's own tree, see Diagnostics) and any other keyword argument of TimeStepper (outputEvery, eps0, openAngle,
+    gridSize, blockSteps, ...); missing keys take the values in DEFAULTS. The runs of a sweep already share the processors, so when
+    they run in a pool each of them computes its forces in one process, and a "workers" option above 1 is rejected.
+'''
+
+DEFAULTS = {"numParticles": 100, "ic": "random", "gravity": "BH", "integrator": "leapfrog", "time": 10, "dt": 0.1, "seed": 12345}
+
+SUMMARY_COLUMNS = ("run", "numParticles", "ic", "gravity", "integrator", "dt", "time", "wallTime", "numSteps", "numForces",
+                   "energyDrift", "momentumDrift", "angularMomentumDrift", "historyFile")
+
+def expandGrid(grid, base=None):
+    ''' Returns the configurations of a parameter grid: one for every combination of the values listed in the grid.
+
+    Args:
+        grid (dict): Lists of values, by parameter name (a single value is used as is)
+        base (dict): Parameters shared by all configurations
+
+    Returns:
+        list: Configurations (dicts), the last parameter of the grid varying fastest
+    '''
+
+    names = list(grid.keys())
+    values = [v if isinstance(v, (list, tuple)) else [v] for v in grid.values()]
+    return [dict(base or {}, **dict(zip(names, combo))) for combo in itertools.product(*values)]
+
+def runConfig(config, outDir, run=0):
+    ''' Runs one configuration and returns its row of the summary table. The history is written to outDir/run<run>.npy.
+
+    Args:
+        config (dict): Configuration (see the module description)
+        outDir (string): Directory of the history files
+        run (integer): Index of the run in the sweep
+
+    Returns:
+        dict: Summary of the run (see SUMMARY_COLUMNS); energyDrift is the largest deviation of the energy over the measurements,
+            relative to the initial energy, and the momentum drifts are the absolute changes from the start to the end
+    '''
+
+    config = dict(DEFAULTS, **config)
+    options = {k: v for k, v in config.items() if k not in DEFAULTS}
+    historyFile = os.path.join(outDir, "run{:04d}.npy".format(run))
+    diagnostics = diag.Diagnostics(every=options.pop("diagnosticsEvery", sys.maxsize), direct=options.pop("diagnosticsDirect", False))
+
+    particles = IC.IC(config["numParticles"], config["ic"], seed=config["seed"]).particles
+
+    start = time.perf_counter()
+    stepper = TimeStepper.TimeStepper(particles, config["time"], config["dt"], config["integrator"], config["gravity"],
+                                      historyFile=historyFile, diagnostics=diagnostics, **options)
+    wallTime = time.perf_counter() - start
+
+    return {"run": run, "numParticles": config["numParticles"], "ic": config["ic"], "gravity": config["gravity"],
+            "integrator": config["integrator"], "dt": config["dt"], "time": config["time"], "wallTime": wallTime,
+            "numSteps": stepper.numSteps, "numForces": stepper.numForces, "energyDrift": diagnostics.energyDrift(),
+            "momentumDrift": diagnostics.momentumDrift(), "angularMomentumDrift": diagnostics.momentumDrift("angularMomentum"),
+            "historyFile": historyFile}
+
+def _runTask(task):
+    return runConfig(*task)
+
+def sweep(configs, outDir="sweep", workers=None):
+    ''' Runs a list of configurations, at most 'workers' at a time, and writes the summary table to outDir/summary.csv.
+
+    Args:
+        configs (list or dict): Configurations, or a parameter grid (see expandGrid)
+        outDir (string): Directory of the history files and of the summary
+        workers (integer): Number of worker processes; None uses one per processor, 1 runs everything in this process
+
+    Returns:
+        list: Summary rows (see runConfig), in the order of the configurations
+    '''
+
+    if (isinstance(configs, dict)):
+        configs = expandGrid(configs)
+    os.makedirs(outDir, exist_ok=True)
+
+    tasks = [(config, outDir, run) for run, config in enumerate(configs)]
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    if (workers <= 1):
+        rows = [_runTask(task) for task in tasks]
+    else:
+        # every pool worker already has a processor of its own, so the runs may not start thread or process pools of their own
+        if (any((config.get("workers") or 1) > 1 for config in configs)):
+            raise ValueError("runs in a pool of sweep workers must compute their forces in one process: drop their \"workers\" option "
+                             "or run the sweep with workers=1")
+        with mp.get_context().Pool(workers) as pool:
+            rows = pool.map(_runTask, tasks, chunksize=1)
+
+    with open(os.path.join(outDir, "summary.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    return rows
+
+def summaryTable(rows):
+    ''' Formats summary rows as an aligned text table.
+
+    Args:
+        rows (list): Summary rows (see runConfig)
+
+    Returns:
+        string: Table, one line per run
+    '''
+
+    def cell(value):
+        if (isinstance(value, float)):
+            return "{:.3g}".format(value)
+        return str(value)
+
+    columns = SUMMARY_COLUMNS[:-1]
+    cells = [[cell(row[c]) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(line[k]) for line in cells]) for k, c in enumerate(columns)]
+
+    lines = ["  ".join(c.rjust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(c.rjust(w) for c, w in zip(line, widths)) for line in cells]
+    return "\n".join(lines)
+
+def loadJSON(text):
+    ''' Parses a JSON argument of the command line, given either inline or as the name of a file holding it.
+
+    Args:
+        text (string): JSON text or file name
+
+    Returns:
+        JSON value
+    '''
+
+    if (os.path.isfile(text)):
+        with open(text) as f:
+            return json.load(f)
+    return json.loads(text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m NBodyBuilder.Sweep", description="Run a parameter sweep of NBodyBuilder simulations.")
+    parser.add_argument("--grid", help="parameter grid, as JSON or a JSON file: lists of values by parameter name")
+    parser.add_argument("--configs", help="explicit list of configurations, as JSON or a JSON file")
+    parser.add_argument("--base", default="{}", help="parameters shared by all configurations (overridden by their own), as JSON or a JSON file")
+    parser.add_argument("--workers", type=int, default=None, help="number of runs at a time (default: one per processor)")
+    parser.add_argument("--out", default="sweep", help="output directory (default: sweep)")
+    args = parser.parse_args(argv)
+
+    if ((args.grid is None) == (args.configs is None)):
+        parser.error("give exactly one of --grid and --configs")
+    base = loadJSON(args.base)
+    if (args.grid is not None):
+        configs = expandGrid(loadJSON(args.grid), base)
+    else:
+        configs = [dict(base, **config) for config in loadJSON(args.configs)]
+
+    rows = sweep(configs, args.out, args.workers)
+    print(summaryTable(rows))
+    print("\nsummary written to {}".format(os.path.join(args.out, "summary.csv")))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,42 +1,382 @@
+import os
 import numpy as np
 import NBodyBuilder.Particle as part
 import NBodyBuilder.DirectForce as df
 import NBodyBuilder.BH as bh
+import NBodyBuilder.FMM as fmm
+import NBodyBuilder.PM as pm
+import NBodyBuilder.TreePM as treepm
+import NBodyBuilder.ParticleSet as ps
+import NBodyBuilder.Softening as soft
+import NBodyBuilder.Stats as st
 
 class TimeStepper(object):
     ''' This class evolves a set of Particles through time to simulate N gravitationally-interacting particles.
+
+    Args:
+        particles (ParticleSet or array): Set of particles (an array of Particles is packed into a ParticleSet)
+        time (float): End time of the run
+        dt (float): Time step (the longest one, with blockSteps or adaptive)
+        integrator (string): "euler", "euler_cromer", "leapfrog", "hermite", "yoshida" or "forest_ruth"
+        gravity (string): Gravity solver, "direct", "BH", "FMM", "PM" or "TreePM"
+        workers (integer): If more than 1, threads of the direct force evaluation, or processes of the BH one (see Parallel.workerPool)
+        reuseTree (boolean): Keep the BH tree from one step to the next and refit it (this rarely saves time, see BH.update)
+        blockSteps (boolean): Give each particle its own leapfrog step dt / 2^k, k <= maxLevel (see leapfrogBlock)
+        maxLevel (integer): Largest k of the block and adaptive steps dt / 2^k
+        eta (float): Accuracy parameter of the block and adaptive steps (see stepLevels)
+        adaptive (boolean): Without blockSteps, choose one step for all particles before every step (see chooseStep)
+        outputTimes (array): Times at which the history is recorded; steps are shortened to end exactly on them
+        outputEvery (integer): Without outputTimes, record the history every outputEvery * dt
+        historyFile (string): If given, the history is written frame by frame to this .npy file through a memory map
+        eps0 (float): Gravitational softening length
+        r0 (float): Cutoff distance of the softening
+        tabulatedSoftening (boolean): Read the softening kernel from a lookup table (see Softening.KernelTable)
+        checkpointFile (string): If given, the state of the run is saved to this file, and without a historyFile the history streamed
+            to a .history.npy file named after it (see saveCheckpoint)
+        checkpointEvery (integer): Save a checkpoint after every checkpointEvery frames (and after the last one)
+        restartFile (string): Resume from this checkpoint, whose particles and parameters replace the arguments above (see restart)
+        stats (Stats): If given, every step is timed phase by phase and its interactions counted (see Stats)
+        diagnostics (Diagnostics): If given, the conserved quantities are measured at every diagnostics.every-th output time
+        openAngle (float): Opening angle of the BH, FMM and TreePM tree walks
+        boxSize (float): Size of the root tree cell and of the mesh (see PM for particles outside it)
+        gridSize (integer): Number of PM and TreePM mesh cells along each side
+        fmmOrder (integer): Expansion order of FMM
+        splitScale (float): TreePM split scale; None derives it from the mesh spacing (see TreePM)
     '''
     
-    # Given an array of Particles, an end time, a time step dt, and an integration scheme, evolve the Particles through time and save the history of particle positions (and masses) in a 3D array
-    def __init__(self, particles, time, dt, integrator, gravity):
-        self.particles = particles
-        self.time = time
-        self.dt = dt
+    # Given a set of Particles, an end time, a time step dt, and an integration scheme, evolve the Particles through time and save the history of particle positions (and masses) in a 3D array
+    def __init__(self, particles, time, dt, integrator, gravity, workers=None, reuseTree=False, blockSteps=False, maxLevel=10, eta=0.025,
+                 adaptive=False, outputTimes=None, outputEvery=1, historyFile=None, eps0=0.1, r0=5, tabulatedSoftening=False, checkpointFile=None,
+                 checkpointEvery=1, restartFile=None, stats=None, diagnostics=None, openAngle=0.5,
+                 boxSize=50, gridSize=64, fmmOrder=4, splitScale=None):
+        self.workers = workers
+        self.reuseTree = reuseTree
+        self.checkpointFile = checkpointFile
+        self.checkpointEvery = checkpointEvery
+        self.stats = stats
+        self.diagnostics = diagnostics
+        self.accelSolver = None
+        self.solverCurrent = False      # whether accelSolver is set up on the current positions
         
-        self.history = np.zeros((int(time/dt) + 1, particles.size, 4))
+        if (restartFile is not None):
+            self.loadCheckpoint(restartFile, historyFile)
+        else:
+            self.particles = ps.asParticleSet(particles)
+            self.time = time
+            self.dt = dt
+            self.integrator = integrator
+            self.gravity = gravity
+            self.blockSteps = blockSteps
+            self.maxLevel = maxLevel
+            self.eta = eta
+            self.adaptive = adaptive
+            self.eps0 = eps0
+            self.r0 = r0
+            self.tabulatedSoftening = tabulatedSoftening
+            self.openAngle = openAngle
+            self.boxSize = boxSize
+            self.gridSize = gridSize
+            self.fmmOrder = fmmOrder
+            self.splitScale = splitScale
+            
+            self.accelCurrent = False   # whether particles.accel holds the accelerations at the current positions
+            self.jerkCurrent = False    # whether particles.jerk holds the jerks at the current positions and velocities
+            self.level = None           # block time step level of each particle id
+            self.numForces = 0          # number of particle accelerations computed so far
+            self.numSteps = 0           # number of integration steps taken so far
+            
+            if (outputTimes is None):
+                outputTimes = dt * np.arange(0, int(time/dt) + 1, outputEvery)
+            self.outputTimes = np.asarray(outputTimes, dtype=float)
+            self.now = 0.
+            self.frame = 0              # number of frames recorded so far
+            
+            if ((historyFile is None) and (checkpointFile is not None)):
+                historyFile = os.path.splitext(checkpointFile)[0] + ".history.npy"
+            self.historyFile = historyFile
+            shape = (self.outputTimes.size, self.particles.size, 4)
+            if (historyFile is None):
+                self.history = np.zeros(shape)
+            else:
+                self.history = np.lib.format.open_memmap(historyFile, mode="w+", dtype=float, shape=shape)
         
-        for t in range(self.history.shape[0]):
-            if (t != 0):
-                
-                if (gravity == "direct"):
-                    accelSolver = df.DirectForce(self.particles)
-                elif (gravity == "BH"):
-                    accelSolver = bh.BH(50, 0.1, self.particles)
-                else:
-                    accelSolver = df.DirectForce(self.particles)
-                    
-                accelSolver.computeAllAccels()
+        self.run()
+    
+    def run(self):
+        ''' Evolves the particles from the current frame to the end of the run, recording a frame at each of the outputTimes and
+        saving a checkpoint after every checkpointEvery frames (and after the last one).
+        '''
+
+        dt = self.dt
+        lastStep = None     # stats record of the last step, closed only after the outputs that follow it
+        
+        for t in range(self.frame, self.outputTimes.size):
+            target = self.outputTimes[t]
+            while (target - self.now > 1e-9 * dt):
+                if (lastStep is not None):
+                    self.stats.endStep(**lastStep)
+                step = self.chooseStep(dt) if (self.adaptive and not self.blockSteps) else dt
+                if (target - self.now < step * (1 - 1e-9)):
+                    step = target - self.now
                 
-                if (integrator == "euler_cromer"):
-                    self.euler_cromer()    
-                elif (integrator == "euler"):
-                    self.euler()
-                else:
-                    self.euler_cromer()
+                self.dt = step
+                with st.phase(self.stats, "integrator"):
+                    self.step()
+                self.dt = dt
+                self.now += step
+                self.numSteps += 1
+                if (self.stats is not None):
+                    lastStep = {"time": self.now, "dt": step, "numForces": self.numForces}
+            self.now = max(self.now, target)
+            
+            # particles may be reordered by the solver, so frames are written in order of particle id
+            with st.phase(self.stats, "history"):
+                self.history[t,self.particles.ids,0] = self.particles.mass
+                self.history[t,self.particles.ids,1:] = self.particles.pos
+            self.frame = t + 1
+            
+            if ((self.diagnostics is not None) and ((t % self.diagnostics.every == 0) or (self.frame == self.outputTimes.size))):
+                with st.phase(self.stats, "diagnostics"):
+                    # the run's own solver is reused for the potentials if its tree (or direct sum) is set up on the current positions
+                    solver = self.accelSolver if (self.solverCurrent and hasattr(self.accelSolver, "computeAllPotentials")) else None
+                    self.diagnostics.measure(self.particles, self.now, self.eps0, self.r0, None if self.gravity == "direct" else self.openAngle,
+                                             solver)
+            
+            if ((self.checkpointFile is not None) and ((self.frame % self.checkpointEvery == 0) or (self.frame == self.outputTimes.size))):
+                with st.phase(self.stats, "checkpoint"):
+                    self.saveCheckpoint(self.checkpointFile)
+            
+            if (lastStep is not None):
+                self.stats.endStep(**lastStep)
+                lastStep = None
+        
+        if (self.historyFile is not None):
+            self.history.flush()
+    
+    def saveCheckpoint(self, fileName):
+        ''' Saves the full state of the run to a binary .npz file: the phase space of the particles (with their current accelerations 
+        and jerks, so that the integrator continues exactly as it would have), the time, step and force counters, the block time 
+        step levels, the run and solver parameters, the diagnostics records and the number of frames recorded, which the history 
+        file holds (only a run keeping its history in memory, without a checkpointFile, saves its frames in the checkpoint). The 
+        file is written next to its destination and then renamed over it, so a run killed while saving leaves the previous 
+        checkpoint intact. The solver is rebuilt on restart; a reused BH tree (reuseTree) is rebuilt on the positions it was last
+        built on, which are saved too, so that the restarted run refits and rebuilds it, and computes its forces, just as the original
+        run does.
+
+        Args:
+            fileName (string): Checkpoint file
+        '''
+
+        p = self.particles
+        if (self.historyFile is not None):
+            self.history.flush()
+        
+        state = {"mass": p.mass, "pos": p.pos, "vel": p.vel, "accel": p.accel, "jerk": p.jerk, "ids": p.ids,
+                 "time": self.time, "dt": self.dt, "integrator": self.integrator, "gravity": self.gravity, 
+                 "blockSteps": self.blockSteps, "maxLevel": self.maxLevel, "eta": self.eta, "adaptive": self.adaptive,
+                 "eps0": self.eps0, "r0": self.r0, "tabulatedSoftening": self.tabulatedSoftening, "openAngle": self.openAngle,
+                 "boxSize": self.boxSize, "gridSize": self.gridSize, "fmmOrder": self.fmmOrder,
+                 "splitScale": np.nan if self.splitScale is None else self.splitScale,
+                 "outputTimes": self.outputTimes, "now": self.now, "frame": self.frame, "numSteps": self.numSteps, 
+                 "numForces": self.numForces, "accelCurrent": self.accelCurrent, "jerkCurrent": self.jerkCurrent,
+                 "level": np.zeros(0, dtype=int) if self.level is None else self.level,
+                 "historyFile": "" if self.historyFile is None else self.historyFile,
+                 "diagnostics": "" if self.diagnostics is None else self.diagnostics.toJSON(),
+                 "treePos": self.accelSolver.builtPos if self.reusedTree() else np.zeros((0, 3))}
+        if (self.historyFile is None):
+            state["history"] = self.history[:self.frame]
+        
+        partial = fileName + ".part"
+        with open(partial, "wb") as f:
+            np.savez(f, **state)
+        os.replace(partial, fileName)
+    
+    def loadCheckpoint(self, fileName, historyFile=None):
+        ''' Restores the state of a run saved by saveCheckpoint (the solver itself is rebuilt at the next force computation, except for 
+        a reused BH tree, which is rebuilt here, see restoreTree).
+
+        Args:
+            fileName (string): Checkpoint file
+            historyFile (string): History file of the run, if it has moved since the checkpoint was saved
+        '''
+
+        with np.load(fileName) as c:
+            # the rows are restored in the order they had, so that the solvers sum the forces in the same order
+            self.particles = ps.ParticleSet(c["mass"], c["pos"], c["vel"], c["accel"])
+            self.particles.jerk[:] = c["jerk"]
+            self.particles.ids = c["ids"].copy()
+            self.particles.rank = np.argsort(self.particles.ids)
+            
+            self.time = float(c["time"])
+            self.dt = float(c["dt"])
+            self.integrator = str(c["integrator"])
+            self.gravity = str(c["gravity"])
+            self.blockSteps = bool(c["blockSteps"])
+            self.maxLevel = int(c["maxLevel"])
+            self.eta = float(c["eta"])
+            self.adaptive = bool(c["adaptive"])
+            self.eps0 = float(c["eps0"])
+            self.r0 = float(c["r0"])
+            self.tabulatedSoftening = bool(c["tabulatedSoftening"])
+            self.openAngle = float(c["openAngle"]) if "openAngle" in c else 0.1     # the fixed angle of runs checkpointed before it was an option
+            self.boxSize = float(c["boxSize"]) if "boxSize" in c else 50
+            self.gridSize = int(c["gridSize"]) if "gridSize" in c else 64
+            self.fmmOrder = int(c["fmmOrder"]) if "fmmOrder" in c else 4
+            self.splitScale = float(c["splitScale"]) if ("splitScale" in c) and np.isfinite(c["splitScale"]) else None
+            self.outputTimes = c["outputTimes"].copy()
+            
+            self.now = float(c["now"])
+            self.frame = int(c["frame"])
+            self.numSteps = int(c["numSteps"])
+            self.numForces = int(c["numForces"])
+            self.accelCurrent = bool(c["accelCurrent"])
+            self.jerkCurrent = bool(c["jerkCurrent"])
+            self.level = c["level"].copy() if c["level"].size > 0 else None
             
-            for i in range(particles.size):
-                self.history[t,i] = np.array([particles[i].mass, 
-                                              particles[i].com[0], particles[i].com[1], particles[i].com[2]]) 
+            if ((self.diagnostics is not None) and ("diagnostics" in c) and (str(c["diagnostics"]))):
+                self.diagnostics.fromJSON(str(c["diagnostics"]))
+            
+            if (historyFile is None):
+                historyFile = str(c["historyFile"]) or None
+            self.historyFile = historyFile
+            if (historyFile is None):
+                self.history = np.zeros((self.outputTimes.size, self.particles.size, 4))
+                self.history[:self.frame] = c["history"]
+            else:
+                self.history = np.lib.format.open_memmap(historyFile, mode="r+")
+            
+            if (self.reuseTree and ("treePos" in c) and (c["treePos"].size > 0)):
+                self.restoreTree(c["treePos"])
+    
+    def reusedTree(self):
+        ''' Returns whether the run keeps a BH tree from one force computation to the next (see BH.update).
+
+        Returns:
+            boolean: True if the next force computation refits (or rebuilds) the current tree
+        '''
+
+        return self.reuseTree and (self.gravity == "BH") and (self.accelSolver is not None)
+    
+    def restoreTree(self, treePos):
+        ''' Rebuilds the reused BH tree of a restored run on the positions it was last built on in the checkpointed run. The tree's 
+        topology, and the drift from those positions, decide how BH.update refits or rebuilds it at the next force computation, so 
+        the restored run then computes the same forces as the checkpointed one. The particles keep their current positions.
+
+        Args:
+            treePos (array): Positions of the last build, in the current row order, shape (N,3)
+        '''
+
+        p = self.particles
+        current = p.pos.copy()
+        rank = p.rank.copy()
+        
+        p.pos[:] = treePos
+        softening = {"eps0": self.eps0, "r0": self.r0, "softeningTable": soft.kernelTable() if self.tabulatedSoftening else None}
+        self.accelSolver = bh.BH(self.boxSize, self.openAngle, p, build="morton", workers=self.workers, stats=self.stats, **softening)
+        # the build sorts the rows, which were already in its order, but the positions are put back by id all the same
+        p.pos[:] = current[rank[p.ids]]
+    
+    def step(self):
+        ''' Evolves the particles by one time step dt with the chosen integrator.
+        '''
+
+        if (self.integrator == "leapfrog"):
+            if (self.blockSteps):
+                self.leapfrogBlock()
+            else:
+                self.leapfrog()
+        elif (self.integrator == "hermite"):
+            self.hermite()
+        elif (self.integrator == "yoshida"):
+            self.yoshida()
+        elif (self.integrator == "forest_ruth"):
+            self.forest_ruth()
+        elif (self.integrator == "euler"):
+            if (not self.accelCurrent):
+                self.computeAccels()
+            self.euler()
+        else:
+            if (not self.accelCurrent):
+                self.computeAccels()
+            self.euler_cromer()
+    
+    def chooseStep(self, maxStep):
+        ''' Chooses the step of the adaptive mode: the smallest sqrt(2 eta eps0 / |a|) over all particles, or for the Hermite 
+        integrator the smallest eta |a| / |da/dt| (see stepLevels), rounded down to maxStep / 2^k with k <= maxLevel. Accelerations 
+        at the current positions are computed first if necessary (for the Hermite integrator, with jerks), and are then used by the 
+        step itself.
+
+        Args:
+            maxStep (float): Longest allowed step
+
+        Returns:
+            float: Time step
+        '''
+
+        hermite = self.integrator == "hermite"
+        if ((not self.accelCurrent) or (hermite and not self.jerkCurrent)):
+            self.computeAccels(jerk=hermite)
+        
+        saved = self.dt
+        self.dt = maxStep
+        level = self.stepLevels(self.particles.accel, self.particles.jerk if self.jerkCurrent else None).max()
+        self.dt = saved
+        return maxStep / 2**level
+        
+    def computeAccels(self, active=None, jerk=False):
+        ''' Computes the accelerations of the particles at their current positions with the chosen gravity solver.
+        
+        Args:
+            active (array): Boolean flags by particle id; if given, only the accelerations of the flagged particles are computed
+            jerk (boolean): Also compute the jerks (only the direct and BH solvers can)
+        '''
+
+        if (jerk and (self.gravity not in ("direct", "BH"))):
+            raise ValueError("jerks are only computed by the direct and BH gravity solvers, not {}".format(self.gravity))
+
+        softening = {"eps0": self.eps0, "r0": self.r0, "softeningTable": soft.kernelTable() if self.tabulatedSoftening else None}
+        
+        with st.phase(self.stats, "solver"):
+            if (self.reusedTree()):
+                self.accelSolver.update()
+            elif (self.gravity == "direct"):
+                self.accelSolver = df.DirectForce(self.particles, workers=self.workers, **softening)
+            elif (self.gravity == "BH"):
+                self.accelSolver = bh.BH(self.boxSize, self.openAngle, self.particles, build="morton", workers=self.workers, stats=self.stats, **softening)
+            elif (self.gravity == "FMM"):
+                self.accelSolver = fmm.FMM(self.boxSize, self.openAngle, self.particles, order=self.fmmOrder, **softening)
+            elif (self.gravity == "PM"):
+                self.accelSolver = pm.PM(self.boxSize, self.particles, self.gridSize)
+            elif (self.gravity == "TreePM"):
+                self.accelSolver = treepm.TreePM(self.boxSize, self.openAngle, self.particles, gridSize=self.gridSize, stats=self.stats,
+                                                 splitScale=self.splitScale, **softening)
+            else:
+                self.accelSolver = df.DirectForce(self.particles, workers=self.workers, **softening)
+        
+        # the solver may have reordered the particles, so the active ids are translated to rows only now
+        rows = None if active is None else np.sort(self.particles.rank[np.nonzero(active)[0]])
+        with st.phase(self.stats, "walk"):
+            if (jerk):
+                self.accelSolver.computeAllAccels(rows, jerk=True)
+            else:
+                self.accelSolver.computeAllAccels(rows)
+        self.numForces += self.particles.size if rows is None else rows.size
+        self.accelCurrent = rows is None
+        self.jerkCurrent = jerk and (rows is None)
+        self.solverCurrent = True
+    
+    def parameters(self):
+        ''' Returns the parameters of the run, as given to TimeStepper or restored from a checkpoint.
+
+        Returns:
+            dict: Parameters, by argument name, plus "numParticles"
+        '''
+
+        return {"numParticles": self.particles.size, "time": self.time, "dt": self.dt, "integrator": self.integrator, "gravity": self.gravity,
+                "workers": self.workers, "reuseTree": self.reuseTree, "blockSteps": self.blockSteps, "maxLevel": self.maxLevel, "eta": self.eta,
+                "adaptive": self.adaptive, "eps0": self.eps0, "r0": self.r0, "tabulatedSoftening": self.tabulatedSoftening,
+                "openAngle": self.openAngle, "boxSize": self.boxSize, "gridSize": self.gridSize, "fmmOrder": self.fmmOrder,
+                "splitScale": self.splitScale}
         
     def __repr__(self):
         ''' Display the 3D array containing the history of the particle positions.
@@ -47,7 +387,7 @@ class TimeStepper(object):
 
         s = "\n Displaying [mass, x, y, z] for each particle for each time step: \n\n"
         for t in range(self.history.shape[0]):
-            s += "time: {:.2f}, particles: {} \n\n".format(self.dt * t, self.history[t])
+            s += "time: {:.2f}, particles: {} \n\n".format(self.outputTimes[t], self.history[t])
             
         return s
             
@@ -55,27 +395,206 @@ class TimeStepper(object):
         ''' Evolves the particles by one time step using the forward-Euler method.
         '''
 
-        for p in self.particles:
-            
-            dv = self.dt * p.accel
-            dx = self.dt * p.vel
-            p.vel = p.vel + dv
-            p.com = p.com + dx
-            
-            p.resetAccel()
+        p = self.particles
+        
+        dx = self.dt * p.vel
+        p.vel += self.dt * p.accel
+        p.pos += dx
+        
+        p.resetAccel()
+        self.accelCurrent = False
+        self.solverCurrent = False
 
     def euler_cromer(self):
         ''' Evolves the particles by one time step using the Euler-Cromer method.
         '''
 
-        for p in self.particles:
+        p = self.particles
+        
+        p.vel += self.dt * p.accel
+        p.pos += self.dt * p.vel
+        
+        p.resetAccel()
+        self.accelCurrent = False
+        self.solverCurrent = False
+
+    def leapfrog(self):
+        ''' Evolves the particles by one time step using the kick-drift-kick leapfrog: a half step in velocity, a full step in 
+        position, then a half step in velocity with the accelerations at the new positions. Those accelerations are kept for the 
+        first half step of the next time step, so each step costs a single force computation.
+        '''
+
+        p = self.particles
+        
+        if (not self.accelCurrent):
+            self.computeAccels()
+        
+        p.vel += 0.5 * self.dt * p.accel
+        p.pos += self.dt * p.vel
+        
+        self.computeAccels()
+        p.vel += 0.5 * self.dt * p.accel
+
+    def hermite(self):
+        ''' Evolves the particles by one time step using the 4th-order Hermite predictor-corrector scheme (Makino & Aarseth 1992). 
+        Positions and velocities are predicted with a Taylor series in the acceleration and jerk, the acceleration and jerk are 
+        computed at the predicted state, and the step is corrected with the Hermite interpolant of the two. Each step costs a single
+        evaluation of accelerations and jerks: as usual for this scheme, those computed at the predicted state are used as the 
+        accelerations and jerks of the corrected state in the prediction of the next step.
+        '''
+
+        p = self.particles
+        dt = self.dt
+        
+        if (not self.jerkCurrent):
+            self.computeAccels(jerk=True)
+        
+        # the solver may reorder the particles, so the state at the start of the step is kept in order of id
+        rows = p.rank
+        x0, v0, a0, j0 = p.pos[rows], p.vel[rows], p.accel[rows], p.jerk[rows]
+        
+        p.pos[rows] = x0 + dt * v0 + dt**2 / 2. * a0 + dt**3 / 6. * j0
+        p.vel[rows] = v0 + dt * a0 + dt**2 / 2. * j0
+        
+        self.computeAccels(jerk=True)
+        rows = p.rank
+        a1, j1 = p.accel[rows], p.jerk[rows]
+        
+        v1 = v0 + dt / 2. * (a0 + a1) + dt**2 / 12. * (j0 - j1)
+        p.pos[rows] = x0 + dt / 2. * (v0 + v1) + dt**2 / 12. * (a0 - a1)
+        p.vel[rows] = v1
+        # the accelerations and jerks of the predicted state stand for those of the corrected one, but the solver is set up on the former
+        self.solverCurrent = False
+
+    def yoshida(self):
+        ''' Evolves the particles by one time step using the 4th-order symplectic integrator of Yoshida (1990): three kick-drift-kick
+        leapfrog steps of w1 dt, w0 dt and w1 dt, with w1 = 1 / (2 - 2^(1/3)) and w0 = 1 - 2 w1 (a negative, backwards step). The 
+        accelerations at the end of each leapfrog step are reused by the next, so a step costs three force computations.
+        '''
+
+        dt = self.dt
+        w1 = 1. / (2. - 2.**(1./3))
+        w0 = 1. - 2. * w1
+        
+        for w in (w1, w0, w1):
+            self.dt = w * dt
+            self.leapfrog()
+        self.dt = dt
+
+    def forest_ruth(self):
+        ''' Evolves the particles by one time step using the 4th-order symplectic integrator of Forest & Ruth (1990), in its 
+        kick-drift form: four kicks and three drifts, with the same triple-jump coefficients as yoshida but with the adjacent half 
+        kicks merged. Like leapfrog, it starts and ends with a kick, so the accelerations at the end of a step (or those computed by 
+        chooseStep) serve the first kick of the next one, and a step costs three force computations.
+        '''
+
+        p = self.particles
+        dt = self.dt
+        w1 = 1. / (2. - 2.**(1./3))
+        w0 = 1. - 2. * w1
+        
+        kicks = (w1 / 2., (w0 + w1) / 2., (w0 + w1) / 2., w1 / 2.)
+        drifts = (w1, w0, w1)
+        
+        if (not self.accelCurrent):
+            self.computeAccels()
+        
+        for k in range(3):
+            p.vel += kicks[k] * dt * p.accel
+            p.pos += drifts[k] * dt * p.vel
+            self.computeAccels()
+        p.vel += kicks[3] * dt * p.accel
+
+    def stepLevels(self, accel, jerk=None):
+        ''' Block time step levels for the given accelerations: each particle's step is the largest dt / 2^k (k <= maxLevel) not 
+        exceeding sqrt(2 eta eps0 / |a|), with eps0 the gravitational softening length, or, if the jerks are given, the criterion of
+        Aarseth (1985) eta |a| / |da/dt|.
+
+        Args:
+            accel (array): Accelerations, shape (K,3)
+            jerk (array): Jerks, shape (K,3)
+
+        Returns:
+            array: Levels k, shape (K,)
+        '''
+
+        a = np.linalg.norm(accel, axis=1)
+        level = np.zeros(a.size, dtype=int)
+        if (jerk is None):
+            moving = a > 0
+            ideal = np.sqrt(2 * self.eta * self.eps0 / a[moving])
+        else:
+            j = np.linalg.norm(jerk, axis=1)
+            moving = j > 0
+            ideal = self.eta * a[moving] / j[moving]
+        with np.errstate(divide="ignore"):
+            level[moving] = np.clip(np.ceil(np.log2(self.dt / ideal)), 0, self.maxLevel)
+        return level
+
+    def leapfrogBlock(self):
+        ''' Evolves the particles by one time step dt using the kick-drift-kick leapfrog with hierarchical block time steps. Each 
+        particle has its own step dt / 2^k, and the steps of all particles end together at the end of dt. Time advances from one 
+        step end to the next: all particles drift, and only those whose step ends there (the active particles) get new 
+        accelerations, a closing half kick, a new level and the opening half kick of their next step. A particle can only move to a 
+        longer step at a time that is a multiple of it, which keeps the steps nested.
+        '''
+
+        p = self.particles
+        n = p.size
+        ticks = 2**self.maxLevel   # the time unit of the substeps is dt / 2^maxLevel
+        tick = self.dt / ticks
+        
+        if (self.level is None):
+            self.computeAccels()
+            self.level = np.empty(n, dtype=int)
+            self.level[p.ids] = self.stepLevels(p.accel)
+        
+        # every particle starts a step at the beginning of dt
+        stepStart = np.zeros(n, dtype=int)
+        stepTicks = 2**(self.maxLevel - self.level)
+        rows = p.rank
+        p.vel[rows] += 0.5 * (stepTicks * tick)[:,None] * p.accel[rows]
+        
+        now = 0
+        while (now < ticks):
+            end = (stepStart + stepTicks).min()
+            p.pos += (end - now) * tick * p.vel
+            now = end
             
-            dv = self.dt * p.accel
-            p.vel = p.vel + dv
-            dx = self.dt * p.vel
-            p.com = p.com + dx
+            active = stepStart + stepTicks == now
+            self.computeAccels(active)
+            ids = np.nonzero(active)[0]
+            rows = p.rank[ids]
+            p.vel[rows] += 0.5 * (stepTicks[ids] * tick)[:,None] * p.accel[rows]
             
-            p.resetAccel()
+            # new levels; a longer step may only start at a multiple of its length
+            level = self.stepLevels(p.accel[rows])
+            while True:
+                misaligned = (now % 2**(self.maxLevel - level) != 0)
+                if (not misaligned.any()):
+                    break
+                level[misaligned] += 1
+            self.level[ids] = level
+            stepStart[ids] = now
+            stepTicks[ids] = 2**(self.maxLevel - level)
+            
+            if (now < ticks):
+                p.vel[rows] += 0.5 * (stepTicks[ids] * tick)[:,None] * p.accel[rows]
+
+def restart(restartFile, **options):
+    ''' Resumes a run from a checkpoint saved by TimeStepper and evolves it to the end. The resumed run reproduces the original one
+    exactly (with reuseTree, if it reuses the tree as well).
+
+    Args:
+        restartFile (string): Checkpoint to resume from
+        options: Other TimeStepper arguments that may differ from the original run (workers, reuseTree, historyFile, checkpointFile,
+            checkpointEvery)
+
+    Returns:
+        TimeStepper: The resumed run
+    '''
+
+    return TimeStepper(None, None, None, None, None, restartFile=restartFile, **options)
 
 def main():
     #### !!!! TEST !!!! ####
@@ -0,0 +1,98 @@
+import numpy as np
+import NBodyBuilder.ParticleSet as ps
+import NBodyBuilder.BH as bh
+import NBodyBuilder.PM as pm
+import NBodyBuilder.Stats as st
+
+class TreePM(object):
+    ''' The TreePM class splits gravity into a long-range part, computed on a mesh by PM, and a short-range part, computed with the
+    Barnes-Hut tree by BH (Bagla 2002; Springel 2005). The short-range force is the Newtonian force times S(r), which falls off like
+    a Gaussian beyond the split scale r_s, so the tree walk only reaches out to the cutoff 5.5 r_s (at least the softening cutoff r0,
+    beyond which the softening law of Particle.epsilon also vanishes); the remainder is smooth on the scale r_s and is resolved by the mesh. For large,
+    roughly uniform boxes this is much cheaper than a full tree walk, since every particle only interacts with its neighborhood.
+
+    The mesh must resolve the split scale, r_s >= 1.25 mesh spacings (Springel 2005). The mesh covers the box, enlarged if particles
+    lie outside it (see PM's enlarge), so by default the split scale is derived from the actual mesh spacing: it is the larger of
+    r0 / 5.5 and 1.25 spacings, and the tree walk reaches out to 5.5 r_s. A coarse mesh (a small gridSize, or a halo whose outliers
+    stretch the mesh) thus shifts work to the tree rather than losing accuracy.
+
+    Args:
+        boxSize (float or integer): Size of simulation box
+        openAngle (float): Opening angle of the short-range tree walk
+        particles (ParticleSet or array): Set of particles (an array of Particles is packed into a ParticleSet)
+        r0 (float): Cutoff distance of the softening, and the smallest range of the short-range force
+        gridSize (integer): Number of mesh cells along each side of the box
+        assignment (string): Mass assignment and interpolation scheme of the mesh, "CIC" or "TSC"
+        leafSize (integer): Maximum number of particles in a leaf of the octree
+        groupSize (integer): Maximum number of particles sharing one interaction list in the tree walk
+        eps0 (float): Gravitational softening length of the short-range force
+        softeningTable (Softening.KernelTable): If given, the softening kernel is interpolated from this table
+        stats (Stats): If given, the tree phases are timed and counted into it (see BH), and the mesh solve is timed as "mesh"
+        splitScale (float): Split scale r_s; None derives it from the mesh spacing as described above
+    '''
+
+    # Given the size of the simulation box, the opening angle, and a set of particles, compute the force on each of the particles with a tree for short range and a mesh for long range
+    def __init__(self, boxSize, openAngle, particles, r0=5, gridSize=64, assignment="CIC", leafSize=1, groupSize=16, eps0=0.1, 
+                 softeningTable=None, stats=None, splitScale=None):
+        self.particles = ps.asParticleSet(particles)
+        self.boxSize = boxSize
+        self.r0 = r0
+        self.stats = stats
+
+        self.mesh = pm.PM(boxSize, self.particles, gridSize, assignment, enlarge=True)
+        if (splitScale is None):
+            splitScale = max(r0 / 5.5, 1.25 * self.mesh.meshGeometry()[1])
+        self.splitScale = splitScale
+        self.mesh.splitScale = splitScale
+
+        self.tree = bh.BH(boxSize, openAngle, self.particles, leafSize, build="morton", groupSize=groupSize, 
+                          splitScale=splitScale, cutoff=5.5 * splitScale, eps0=eps0, r0=r0, softeningTable=softeningTable, 
+                          stats=stats)
+
+    def __repr__(self):
+        return "TreePM(r0={0}, splitScale={1}, {2})".format(self.r0, self.splitScale, self.mesh)
+
+    def computeAccel(self, p):
+        ''' Computes the acceleration of Particle p. The mesh is solved for all particles at once, so this costs as much as a full
+        mesh solve.
+
+        Args:
+            p (Particle or integer): A Particle of the simulation, or its index in the ParticleSet
+
+        Returns:
+            totalAccel (array): Total acceleration felt by Particle p from all other particles
+        '''
+
+        i = self.particles.row(p)
+        return self.tree.computeAccel(i) + self.mesh.meshAccels()[i]
+
+    def computeAllAccels(self, active=None):
+        ''' Computes the accelerations of all Particles in the simulation: the short-range tree part plus the long-range mesh part.
+
+        Args:
+            active (array): If given, only the accelerations of these particles are computed (the tree is only walked for them), and
+                the others are left unchanged
+        '''
+
+        with st.phase(self.stats, "mesh"):
+            longRange = self.mesh.meshAccels()
+        self.tree.computeAllAccels(active)
+        if (active is None):
+            self.particles.accel += longRange
+        else:
+            self.particles.accel[active] += longRange[active]
+
+def main():
+    #### !!!! TEST !!!! ####
+
+    generator = np.random.default_rng(12345)
+    particles = ps.ParticleSet(generator.random(2000), 10 * generator.standard_normal((2000, 3)))
+
+    treePM = TreePM(50, 0.5, particles)
+    print(treePM)
+    treePM.computeAllAccels()
+    print(particles[0])
+    print(particles[1])
+
+if __name__ == "__main__":
+    main()
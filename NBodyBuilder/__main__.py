@@ -0,0 +1,7 @@
+import sys
+import NBodyBuilder.Batch as Batch
+
+''' Runs the headless command line (see Batch): python -m NBodyBuilder --help
+'''
+
+Batch.main(sys.argv[1:])
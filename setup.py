@@ -4,6 +4,7 @@ setup(
 
     name = "NBodyBuilder",
     version = "1.0.2",
-    packages = find_packages()
+    packages = find_packages(),
+    entry_points = {"console_scripts": ["nbodybuilder = NBodyBuilder.Batch:main"]}
     
 )
\ No newline at end of file